@@ -0,0 +1,187 @@
+"""
+Concurrent read/write benchmark of the database access: a connection opened per
+request in the default journal mode (former behavior) against the pooled, tuned
+connections of `db.py`, with feedback recorded by each request or queued and recorded
+in batches (write-behind mode, `feedback_buffer.py`).
+
+Reader threads run the queries of /recommend/next (cold start count and history),
+writer threads the feedback transaction of /feedback/update, for a fixed duration.
+With write-behind, write latencies are those of the requests (validation and
+queueing); all queued events are recorded before the results are reported.
+
+Usage: python bench_db.py
+"""
+
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+import numpy as np
+
+from db import ConnectionPool
+from feedback_buffer import FeedbackBuffer, apply_feedback
+from popularity import create_popularity_table
+from user_profiles import create_profile_table
+
+N_SONGS = 50_000
+N_USERS = 2_000
+HISTORY_SIZE = 100
+N_READERS = 8
+N_WRITERS = 2
+DURATION = 5.0
+
+
+def create_database(path):
+    """Database with the backend schema and a synthetic catalog and history."""
+    rng = random.Random(0)
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE songs (
+            song_id TEXT PRIMARY KEY, title TEXT, artist TEXT, duration REAL,
+            release TEXT, year INTEGER, tempo REAL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE listening_history (
+            user_id TEXT NOT NULL, song_id TEXT NOT NULL, listening_time INTEGER,
+            algo_type TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, song_id)
+        )
+    ''')
+    conn.executemany("INSERT INTO songs VALUES (?, ?, ?, 210, NULL, 2000, 120)",
+                     [(f"SO{i:016X}", f"Title {i}", f"Artist {i % 1000}") for i in range(N_SONGS)])
+    conn.executemany("INSERT OR IGNORE INTO listening_history (user_id, song_id, listening_time) VALUES (?, ?, ?)", [
+        (f"user{user}", f"SO{rng.randrange(N_SONGS):016X}", rng.randint(1, 10))
+        for user in range(N_USERS) for _ in range(HISTORY_SIZE)
+    ])
+    create_profile_table(conn.cursor())
+    create_popularity_table(conn.cursor())
+    conn.commit()
+    conn.close()
+
+
+def read_request(conn, rng):
+    """Queries of /recommend/next for a user with history."""
+    cursor = conn.cursor()
+    user_id = f"user{rng.randrange(N_USERS)}"
+    cursor.execute("SELECT COUNT(*) FROM listening_history WHERE user_id = ?", (user_id,))
+    cursor.fetchone()
+    cursor.execute("SELECT song_id, listening_time FROM listening_history WHERE user_id = ?", (user_id,))
+    cursor.fetchall()
+
+
+def write_request(conn, rng):
+    """Feedback transaction of /feedback/update."""
+    cursor = conn.cursor()
+    user_id, song_id = f"user{rng.randrange(N_USERS)}", f"SO{rng.randrange(N_SONGS):016X}"
+    cursor.execute("SELECT song_id FROM songs WHERE song_id = ?", (song_id,))
+    cursor.fetchone()
+    cursor.execute("SELECT duration FROM songs WHERE song_id = ?", (song_id,))
+    cursor.fetchone()
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute("SELECT listening_time FROM listening_history WHERE user_id = ? AND song_id = ?",
+                   (user_id, song_id))
+    cursor.fetchone()
+    cursor.execute('''
+        INSERT INTO listening_history (user_id, song_id, listening_time)
+        VALUES (?, ?, ?)
+        ON CONFLICT(user_id, song_id)
+        DO UPDATE SET
+            listening_time = listening_history.listening_time + excluded.listening_time,
+            timestamp = CURRENT_TIMESTAMP
+    ''', (user_id, song_id, rng.randint(0, 10)))
+    conn.commit()
+
+
+def buffered_write_request(buffer, conn, rng):
+    """/feedback/update in write-behind mode: validation reads, then queueing."""
+    cursor = conn.cursor()
+    user_id, song_id = f"user{rng.randrange(N_USERS)}", f"SO{rng.randrange(N_SONGS):016X}"
+    cursor.execute("SELECT song_id FROM songs WHERE song_id = ?", (song_id,))
+    cursor.fetchone()
+    cursor.execute("SELECT duration FROM songs WHERE song_id = ?", (song_id,))
+    cursor.fetchone()
+    buffer.submit(user_id, song_id, rng.randint(0, 10))
+
+
+def run(borrow, duration=DURATION, write=write_request):
+    """
+    Runs readers and writers concurrently, each request on a connection from `borrow`
+    (a context manager factory).
+
+    Returns:
+        dict: Latencies (ms) of the reads and writes, and the number of failed requests.
+    """
+    latencies = {'read': [], 'write': []}
+    errors = []
+    deadline = time.perf_counter() + duration
+
+    def worker(kind, seed):
+        rng = random.Random(seed)
+        request = read_request if kind == 'read' else write
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                with borrow() as conn:
+                    request(conn, rng)
+            except sqlite3.OperationalError as e:
+                errors.append(str(e))
+                continue
+            latencies[kind].append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=worker, args=('read', i)) for i in range(N_READERS)]
+    threads += [threading.Thread(target=worker, args=('write', N_READERS + i)) for i in range(N_WRITERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {**latencies, 'errors': len(errors)}
+
+
+@contextmanager
+def connection_per_request(path):
+    """Former behavior: `sqlite3.connect` at the start of each request, closed at its end."""
+    conn = sqlite3.connect(path)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def report(name, results):
+    reads, writes = np.array(results['read']), np.array(results['write'])
+    print(f"{name:>22}: {len(reads) / DURATION:8.0f} reads/s (p50 {np.median(reads):6.2f} ms, "
+          f"p99 {np.percentile(reads, 99):7.2f} ms), {len(writes) / DURATION:6.0f} writes/s "
+          f"(p99 {np.percentile(writes, 99):7.2f} ms), {results['errors']} errors")
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        print(f"Creating database ({N_SONGS} songs, {N_USERS} users x {HISTORY_SIZE} tracks)...")
+        create_database(path)
+        print(f"{N_READERS} readers, {N_WRITERS} writers, {DURATION:.0f}s per configuration")
+
+        # Per-request connections (run first, while the file is still in rollback journal mode)
+        report('connect per request', run(partial(connection_per_request, path)))
+
+        pool = ConnectionPool(path, size=N_READERS + N_WRITERS)
+        report('pooled, WAL, tuned', run(pool.connection))
+        pool.close()
+
+        # One more connection for the flusher
+        pool = ConnectionPool(path, size=N_READERS + N_WRITERS + 1)
+
+        def record(events):
+            with pool.connection() as conn:
+                apply_feedback(conn, None, events)
+
+        buffer = FeedbackBuffer(record)
+        results = run(pool.connection, write=partial(buffered_write_request, buffer))
+        buffer.close()
+        report('pooled + write-behind', results)
+        pool.close()
@@ -0,0 +1,131 @@
+"""
+Latency of the resolution of song references sent by title to /feedback/update,
+against the catalog size: the former scans of the songs table (`title = ? OR
+title || ' - ' || artist = ?`, then `? LIKE '%' || title || '%'`) against the
+indexed resolution of `song_resolver.py`.
+
+References are drawn from catalog songs as sent by clients: exact titles, "Title -
+Artist", decorated titles ("Artist - Title (Official Video)") and unknown songs.
+
+Usage: python bench_resolver.py
+"""
+
+import os
+import random
+import tempfile
+import time
+import numpy as np
+
+from db import connect
+from popularity import create_popularity_table
+from song_resolver import create_song_index_tables, rebuild_song_index, resolve_song
+
+CATALOG_SIZES = [10_000, 100_000, 1_000_000]
+VOCABULARY_SIZE = 20_000
+N_REFERENCES = 400
+# The former scans take up to seconds per reference on large catalogs
+N_LEGACY_REFERENCES = 40
+
+
+def create_catalog(path, n_songs, rng):
+    """Database with `n_songs` songs, Zipf-distributed title words and popularity."""
+    words = [f"w{i}" for i in range(VOCABULARY_SIZE)]
+    word_weights = 1 / np.arange(1, VOCABULARY_SIZE + 1)
+    word_weights /= word_weights.sum()
+    np_rng = np.random.default_rng(rng.randrange(2 ** 32))
+    title_words = np_rng.choice(VOCABULARY_SIZE, size=(n_songs, 4), p=word_weights)
+    title_lengths = np_rng.integers(1, 5, size=n_songs)
+
+    songs = [
+        (f"SO{i:016X}", ' '.join(words[w] for w in title_words[i, :title_lengths[i]]).title(),
+         f"Artist {i % (n_songs // 10)}")
+        for i in range(n_songs)
+    ]
+    conn = connect(path)
+    conn.execute('''
+        CREATE TABLE songs (
+            song_id TEXT PRIMARY KEY, title TEXT, artist TEXT, duration REAL,
+            release TEXT, year INTEGER, tempo REAL
+        )
+    ''')
+    conn.executemany("INSERT INTO songs VALUES (?, ?, ?, 210, NULL, 2000, 120)", songs)
+    create_popularity_table(conn.cursor())
+    conn.executemany("INSERT INTO song_popularity VALUES (?, ?)",
+                     [(song[0], float(np_rng.pareto(1.5))) for song in songs])
+    create_song_index_tables(conn.cursor())
+    conn.commit()
+    return conn, songs
+
+
+def sample_references(songs, rng, n):
+    """(kind, reference) pairs as sent by clients."""
+    references = []
+    for _ in range(n):
+        _, title, artist = rng.choice(songs)
+        kind = rng.choice(['title', 'title - artist', 'decorated', 'unknown'])
+        if kind == 'title':
+            reference = title
+        elif kind == 'title - artist':
+            reference = f"{title} - {artist}"
+        elif kind == 'decorated':
+            reference = f"{artist} - {title.upper()} (Official Video)"
+        else:
+            reference = f"Unreleased {rng.randrange(10 ** 9)} Demo"
+        references.append((kind, reference))
+    return references
+
+
+def legacy_resolve(cursor, reference):
+    """Former resolution of /feedback/update."""
+    cursor.execute("SELECT song_id FROM songs WHERE title = ? OR title || ' - ' || artist = ?",
+                   (reference, reference))
+    row = cursor.fetchone()
+    if row:
+        return row[0]
+    cursor.execute("SELECT song_id FROM songs WHERE ? LIKE '%' || title || '%'", (reference,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def time_resolution(resolve, cursor, references):
+    """Latencies (ms) and number of resolved references."""
+    latencies, n_resolved = [], 0
+    for _, reference in references:
+        start = time.perf_counter()
+        resolved = resolve(cursor, reference)
+        latencies.append((time.perf_counter() - start) * 1000)
+        n_resolved += bool(resolved[0] if isinstance(resolved, tuple) else resolved)
+    return np.array(latencies), n_resolved
+
+
+def report(name, latencies, n_resolved):
+    print(f"{name:>12}: p50 {np.median(latencies):9.3f} ms, p99 {np.percentile(latencies, 99):9.3f} ms, "
+          f"{n_resolved}/{len(latencies)} resolved")
+
+
+if __name__ == '__main__':
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        for n_songs in CATALOG_SIZES:
+            path = os.path.join(directory, f"catalog_{n_songs}.db")
+            conn, songs = create_catalog(path, n_songs, rng)
+            start = time.perf_counter()
+            n_keys = rebuild_song_index(conn)
+            conn.commit()
+            print(f"\n{n_songs} songs: indexed {n_keys} keys in {time.perf_counter() - start:.1f}s "
+                  f"({os.path.getsize(path) / 2 ** 20:.0f} MiB database)")
+
+            references = sample_references(songs, rng, N_REFERENCES)
+            cursor = conn.cursor()
+            report('former', *time_resolution(legacy_resolve, cursor, references[:N_LEGACY_REFERENCES]))
+            report('indexed', *time_resolution(resolve_song, cursor, references))
+
+            stages = {}
+            for kind, reference in references:
+                _, stage = resolve_song(cursor, reference)
+                stages.setdefault(kind, []).append(stage)
+            print('             ' + ', '.join(
+                f"{kind}: {sum(stage is not None for stage in kind_stages)}/{len(kind_stages)}"
+                for kind, kind_stages in stages.items()
+            ))
+            conn.close()
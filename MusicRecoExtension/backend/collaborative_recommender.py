@@ -10,12 +10,18 @@ if str(project_root) not in sys.path:
 
 COLLABORATIVE_AVAILABLE = False
 get_api_recommendations = None
+get_api_similar_songs = None
 
 try:
-    from collaborative.api import get_recommendations as _get_recs
+    # Cheap: the serving bundle is only loaded on the first recommendation
+    from collaborative.api import get_recommendations as _get_recs, get_similar_songs as _get_similar, is_available
     get_api_recommendations = _get_recs
-    COLLABORATIVE_AVAILABLE = True
-    print("[COLLABORATIVE] ✓ Module loaded successfully in wrapper")
+    get_api_similar_songs = _get_similar
+    COLLABORATIVE_AVAILABLE = is_available()
+    if COLLABORATIVE_AVAILABLE:
+        print("[COLLABORATIVE] ✓ Module loaded successfully in wrapper")
+    else:
+        print("[COLLABORATIVE] ⚠ Serving bundle not found. Run `python -m collaborative.bundle` first.")
 except Exception as e:
     print(f"[COLLABORATIVE] ⚠ Could not import module or load models: {e}")
     COLLABORATIVE_AVAILABLE = False
@@ -55,7 +61,7 @@ def get_collaborative_recommendations(user_id, conn, limit=10):
         
         # Get raw recommendations (list of song_ids)
         print(f"[COLLABORATIVE] Calling API with {len(user_listenings)} listenings")
-        raw_recs = get_api_recommendations(user_listenings)
+        raw_recs = get_api_recommendations(user_listenings, n=limit)
         
         if not raw_recs:
             print("[COLLABORATIVE] No raw recommendations returned")
@@ -63,39 +69,71 @@ def get_collaborative_recommendations(user_id, conn, limit=10):
         
         print(f"[COLLABORATIVE] API returned {len(raw_recs)} raw IDs")
         # Get metadata for the top recommendations
-        top_n = raw_recs[:limit]
-        placeholders = ','.join(['?'] * len(top_n))
-        
-        query = f"SELECT song_id, title, artist, duration, release, year, tempo FROM songs WHERE song_id IN ({placeholders})"
-        cursor.execute(query, top_n)
-        found_songs = cursor.fetchall()
-        
-        if not found_songs:
-            print("[COLLABORATIVE] No matching songs found in DB")
-            return []
-            
-        # Map back to preserve order of recommendation (since SQL IN doesn't preserve order)
-        songs_map = {
-            row[0]: {
-                "song_id": row[0],
-                "title": row[1],
-                "artist": row[2],
-                "duration": row[3],
-                "release": row[4],
-                "year": row[5],
-                "tempo": row[6]
-            } 
-            for row in found_songs
-        }
-        
-        # Reconstruct ordered list
-        ordered_recs = []
-        for song_id in top_n:
-            if song_id in songs_map:
-                ordered_recs.append(songs_map[song_id])
-                
-        return ordered_recs
+        return fetch_songs(cursor, raw_recs[:limit])
         
     except Exception as e:
         print(f"[COLLABORATIVE] Error generating recommendation: {e}")
         return []
+
+
+def get_similar_songs(song_id, conn, limit=10):
+    """
+    Get the songs most similar to a given song ("more like this"), from the
+    collaborative item-to-item neighbor table.
+    
+    Args:
+        song_id (str): MSD song identifier
+        conn (sqlite3.Connection): Database connection
+        limit (int): Number of songs to retrieve (default: 10)
+        
+    Returns:
+        list: List of dicts with song details
+    """
+    if not COLLABORATIVE_AVAILABLE:
+        print("[COLLABORATIVE] collaborative module not available")
+        return []
+
+    try:
+        similar_ids = get_api_similar_songs(song_id, n=limit)
+        print(f"[COLLABORATIVE] API returned {len(similar_ids)} similar songs for {song_id}")
+        return fetch_songs(conn.cursor(), similar_ids)
+
+    except Exception as e:
+        print(f"[COLLABORATIVE] Error getting similar songs: {e}")
+        return []
+
+
+def fetch_songs(cursor, song_ids):
+    """
+    Get the metadata of the given songs, in the same order. Songs missing from the
+    database are skipped.
+    """
+    if not song_ids:
+        return []
+
+    placeholders = ','.join(['?'] * len(song_ids))
+    
+    query = f"SELECT song_id, title, artist, duration, release, year, tempo FROM songs WHERE song_id IN ({placeholders})"
+    cursor.execute(query, song_ids)
+    found_songs = cursor.fetchall()
+    
+    if not found_songs:
+        print("[COLLABORATIVE] No matching songs found in DB")
+        return []
+        
+    # Map back to preserve order of recommendation (since SQL IN doesn't preserve order)
+    songs_map = {
+        row[0]: {
+            "song_id": row[0],
+            "title": row[1],
+            "artist": row[2],
+            "duration": row[3],
+            "release": row[4],
+            "year": row[5],
+            "tempo": row[6]
+        } 
+        for row in found_songs
+    }
+    
+    # Reconstruct ordered list
+    return [songs_map[song_id] for song_id in song_ids if song_id in songs_map]
@@ -2,7 +2,7 @@
 Content-Based Recommender Utilities
 
 Handles loading and using the content-based recommendation model for the Flask backend.
-Provides functions to format database data and generate recommendations.
+Provides functions to generate recommendations from the database.
 """
 
 import os
@@ -16,6 +16,23 @@ content_based_dir = os.path.join(project_root, 'content_based')
 sys.path.insert(0, content_based_dir)
 
 from recommender import ContentBasedRecommender
+from embedding_store import EmbeddingStore
+from user_profiles import get_user_profile
+
+# 'brute' for exact search, 'ivf' for approximate search on large catalogs,
+# 'int8' for quantized embeddings (4x less memory) re-ranked exactly,
+# 'projected' for embeddings reduced by PCA to PROJECTED_N_COMPONENTS dimensions
+INDEX_TYPE = 'brute'
+# Number of IVF lists scanned per query, higher is slower with better recall
+IVF_N_PROBE = 8
+# Recall@5 against exact search the int8 index is calibrated to reach
+INT8_MIN_RECALL = 0.99
+# Dimensions kept by the projected index, fewer is faster with more reordering
+PROJECTED_N_COMPONENTS = 128
+# Nearest songs fetched per recommendation, to make up for the ones already listened to
+CANDIDATE_MARGIN = 4
+# Beyond this many candidates, the whole history is excluded in the search instead
+MAX_CANDIDATES = 640
 
 
 def load_content_recommender():
@@ -32,16 +49,19 @@ def load_content_recommender():
     project_root = os.path.join(backend_dir, '..', '..')
     data_dir = os.path.join(project_root, 'data')
     
-    embeddings_path = os.path.join(data_dir, 'song_embeddings.pkl')
+    # Memory-mapped embedding store, or the legacy pickle if it was not regenerated
+    embeddings_path = os.path.join(data_dir, 'song_embeddings')
+    if not EmbeddingStore.exists(embeddings_path):
+        embeddings_path += '.pkl'
     metadata_path = os.path.join(data_dir, 'songs_metadata.pkl')
     
     print(f"[CONTENT-BASED] Loading recommender...")
     print(f"  Embeddings: {embeddings_path}")
     print(f"  Metadata: {metadata_path}")
     
-    if not os.path.exists(embeddings_path):
+    if not EmbeddingStore.exists(embeddings_path) and not os.path.exists(embeddings_path):
         raise FileNotFoundError(
-            f"Embeddings file not found at {embeddings_path}. "
+            f"Embeddings not found at {embeddings_path}. "
             "Run embedding_generator.py first."
         )
     
@@ -53,97 +73,50 @@ def load_content_recommender():
     
     recommender = ContentBasedRecommender(
         embeddings_path=embeddings_path,
-        metadata_path=metadata_path
+        metadata_path=metadata_path,
+        index_type=INDEX_TYPE,
+        index_path=os.path.join(data_dir, f'song_embeddings_{INDEX_TYPE}.npz'),
+        n_probe=IVF_N_PROBE,
+        min_recall=INT8_MIN_RECALL,
+        n_components=PROJECTED_N_COMPONENTS
     )
     
     print("[CONTENT-BASED] ✓ Recommender loaded successfully!")
     return recommender
 
 
-def format_user_history_for_recommender(db_history_rows):
-    """
-    Format database listening history into the format expected by ContentBasedRecommender.
-    
-    The database now stores:
-        - song_id: MSD song ID (SOxxxxx format)
-        - listening_time: engagement score (0-10)
-    
-    The recommender expects:
-        - song_id: MSD song ID (SOxxxxx format)
-        - play_count: integer listening count
-    
-    Args:
-        db_history_rows (list): List of tuples from database query
-                               Format: [(song_id, listening_time), ...]
-    
-    Returns:
-        list: Formatted history as [{'song_id': 'SOxxxxx', 'play_count': score}, ...]
-              Returns empty list if no valid songs found
-    """
-    formatted_history = []
-    
-    for song_id, listening_time in db_history_rows:
-        # Database now stores proper MSD song IDs
-        if song_id and song_id.startswith('SO'):
-            formatted_history.append({
-                'song_id': song_id,
-                'play_count': int(listening_time) if listening_time else 1
-            })
-    
-    return formatted_history
-
-
 def get_content_based_recommendation(recommender, user_id, conn):
     """
     Get a content-based recommendation for a user.
     
+    The user embedding is read from the user's persisted content profile (see
+    `user_profiles`), so the cost doesn't grow with the length of their history.
+    
     Args:
         recommender (ContentBasedRecommender): Loaded recommender instance
         user_id (str): User identifier
         conn (sqlite3.Connection): Database connection
     
     Returns:
-        str: Recommended track in "Title - Artist" format
+        list: Recommended songs (dicts with song_id, title, artist_name, similarity)
         
     Raises:
         Exception: If recommendation fails
     """
-    cursor = conn.cursor()
-    
-    # Fetch user's listening history from database
-    cursor.execute('''
-        SELECT song_id, listening_time 
-        FROM listening_history 
-        WHERE user_id = ?
-        ORDER BY listening_time DESC
-    ''', (user_id,))
+    user_embedding, n_songs = get_user_profile(conn, recommender, user_id)
     
-    db_history = cursor.fetchall()
-    
-    if not db_history:
+    if n_songs == 0:
         print(f"[CONTENT-BASED] No history found for user {user_id}")
         return None
     
-    print(f"[CONTENT-BASED] Found {len(db_history)} tracks in user history")
-    
-    # Format history for the recommender
-    user_history = format_user_history_for_recommender(db_history)
-    
-    if not user_history:
-        print("[CONTENT-BASED] No valid song IDs found in history")
-        return None
-    
-    print(f"[CONTENT-BASED] Formatted {len(user_history)} tracks for recommender")
-    
-    # Calculate user embedding
-    user_embedding = recommender.calculate_user_embedding(user_history)
+    print(f"[CONTENT-BASED] Read content profile of user {user_id} ({n_songs} tracks in history)")
     
     if user_embedding is None:
         print("[CONTENT-BASED] Could not calculate user embedding")
         return None
     
-    # Get top 5 recommendations
-    recommendations = recommender.recommend(user_embedding, n_recommendations=5)
+    # Get top 5 recommendations, without the songs already in the history
+    recommendations = recommend_unheard(recommender, conn, user_id, user_embedding, n_songs)
     
     if not recommendations:
         print("[CONTENT-BASED] No recommendations generated")
@@ -154,3 +127,44 @@ def get_content_based_recommendation(recommender, user_id, conn):
         print(f"  {i}. {rec['title']} - {rec['artist_name']} (similarity: {rec['similarity']:.3f})")
     
     return recommendations
+
+
+def recommend_unheard(recommender, conn, user_id, user_embedding, n_songs, n_recommendations=5):
+    """
+    Recommends songs that are not in the user's history, without reading the history.
+    
+    Nearest songs are fetched with a margin and the listened ones dropped (primary key
+    lookups), fetching more until enough are left. Users who listened to most of their
+    nearest songs fall back to excluding their whole history in the search.
+    
+    Args:
+        recommender (ContentBasedRecommender): Loaded recommender instance
+        conn (sqlite3.Connection): Database connection
+        user_id (str): User identifier
+        user_embedding (np.array): The user's embedding
+        n_songs (int): Number of songs in the user's history (max number of drops)
+        n_recommendations (int): Number of songs to recommend
+    
+    Returns:
+        list: Recommended songs, as returned by `ContentBasedRecommender.recommend`
+    """
+    cursor = conn.cursor()
+    n_candidates = n_recommendations * CANDIDATE_MARGIN
+    while n_candidates <= MAX_CANDIDATES:
+        candidates = recommender.recommend(user_embedding, n_recommendations=n_candidates)
+        song_ids = [rec['song_id'] for rec in candidates]
+        cursor.execute(f'''
+            SELECT song_id FROM listening_history
+            WHERE user_id = ? AND song_id IN ({', '.join('?' * len(song_ids))})
+        ''', (user_id, *song_ids))
+        listened = {row[0] for row in cursor.fetchall()}
+        
+        unheard = [rec for rec in candidates if rec['song_id'] not in listened]
+        # Enough songs left, or every listened song was already dropped
+        if len(unheard) >= n_recommendations or len(candidates) < n_candidates or len(listened) == n_songs:
+            return unheard[:n_recommendations]
+        n_candidates *= 2
+    
+    cursor.execute("SELECT song_id FROM listening_history WHERE user_id = ?", (user_id,))
+    return recommender.recommend(user_embedding, n_recommendations=n_recommendations,
+                                 exclude_song_ids=[row[0] for row in cursor.fetchall()])
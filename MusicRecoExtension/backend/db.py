@@ -0,0 +1,115 @@
+"""
+SQLite Access Layer
+
+Shared connections to the backend database, tuned for concurrent requests:
+
+- WAL journal: readers don't block the writer and the writer doesn't block readers,
+  so feedback writes no longer stall recommendation reads.
+- synchronous=NORMAL (durable at each WAL checkpoint rather than at each commit,
+  never corrupted), a larger page cache, memory-mapped reads and in-memory temporary
+  tables.
+- Connections are pooled and reused across requests, so each keeps its cache of
+  prepared statements (sqlite3 caches them per connection, by SQL text).
+"""
+
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DB_NAME = "music_reco.db"
+# Max number of connections open at once, requests wait for a free one beyond it
+POOL_SIZE = 8
+# Prepared statements kept per connection
+CACHED_STATEMENTS = 256
+# Seconds a writer waits for the write lock before failing with "database is locked"
+BUSY_TIMEOUT = 10.0
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64_000,      # KiB (64 MB)
+    'mmap_size': 268_435_456,   # bytes (256 MB)
+    'temp_store': 'MEMORY',
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def connect(path=None):
+    """
+    Open a tuned connection to the database.
+
+    Args:
+        path (str, optional): Database file, defaults to DB_NAME
+
+    Returns:
+        sqlite3.Connection: Connection usable from any thread (one at a time)
+    """
+    conn = sqlite3.connect(path or DB_NAME, timeout=BUSY_TIMEOUT,
+                           cached_statements=CACHED_STATEMENTS, check_same_thread=False)
+    for name, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+class ConnectionPool:
+    """
+    Bounded pool of tuned connections to one database.
+
+    Connections are opened on demand up to `size`, then reused: a connection is
+    handed to one request at a time, and any transaction left open by it is rolled
+    back when it is returned.
+    """
+    def __init__(self, path=None, size=POOL_SIZE):
+        self.path = path or DB_NAME
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a `with` block."""
+        with self._slots:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = connect(self.path)
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                self._idle.put(conn)
+
+    def close(self):
+        """Close the idle connections."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def get_pool():
+    """The pool of the backend database (DB_NAME), created on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.path != DB_NAME:
+            if _pool is not None:
+                _pool.close()
+            _pool = ConnectionPool(DB_NAME)
+        return _pool
+
+
+def connection():
+    """
+    Borrow a pooled connection to the backend database.
+
+    Example:
+        with connection() as conn:
+            conn.execute(...)
+            conn.commit()
+    """
+    return get_pool().connection()
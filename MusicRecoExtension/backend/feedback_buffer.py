@@ -0,0 +1,223 @@
+"""
+Write-Behind Feedback Buffer
+
+Optional write-behind mode of /feedback/update (FEEDBACK_WRITE_BEHIND in server.py):
+feedback events are validated and scored by the request, then queued in memory and
+recorded by a background flusher thread in batches, one transaction (one history
+upsert `executemany`) per batch instead of one per request.
+
+- A batch is flushed every FLUSH_INTERVAL seconds, or as soon as FLUSH_BATCH_SIZE
+  events are pending. Requests block while MAX_PENDING_EVENTS are pending (the
+  database can't keep up).
+- Read-your-writes: before reading a user's history, `wait_for_user` flushes the
+  pending events of the user at once and waits for them to be recorded, for up to
+  WAIT_TIMEOUT seconds.
+- A batch failing with `sqlite3.OperationalError` (locked database, ...) is retried
+  up to MAX_ATTEMPTS times. After that, or on any other error, its events are
+  recorded one by one, and the ones that still fail are logged and dropped, so that
+  one bad event can't block the queue.
+- `close` drains the queue, for up to CLOSE_TIMEOUT seconds: the server registers it
+  to run at exit. Events still pending when the process is killed (SIGKILL, crash)
+  are lost.
+"""
+
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from user_profiles import update_user_profile
+from popularity import add_scores
+
+# Max seconds an event waits in the queue
+FLUSH_INTERVAL = 0.05
+# Pending events triggering a flush without waiting for the interval
+FLUSH_BATCH_SIZE = 500
+# Pending events beyond which new events wait for a flush
+MAX_PENDING_EVENTS = 10_000
+# Seconds before retrying a batch that failed
+RETRY_DELAY = 1.0
+# Attempts at recording a batch before recording its events one by one
+MAX_ATTEMPTS = 3
+# Max seconds `wait_for_user` waits for the events of a user to be recorded
+WAIT_TIMEOUT = 10.0
+# Max seconds `close` waits for the pending events to be recorded
+CLOSE_TIMEOUT = 30.0
+
+
+def apply_feedback(conn, recommender, events):
+    """
+    Records feedback events in one transaction: listening history, content profiles
+    and song popularity.
+
+    Args:
+        conn (sqlite3.Connection): Database connection
+        recommender (ContentBasedRecommender): Loaded recommender instance, or None
+        events (list): (user_id, song_id, score) triples, scored by `compute_score`
+    """
+    scores = {}
+    for user_id, song_id, score in events:
+        scores[user_id, song_id] = scores.get((user_id, song_id), 0) + score
+
+    cursor = conn.cursor()
+    # Take the write lock first, so that the previous scores read here are still
+    # current when the profiles are updated with the new ones
+    cursor.execute("BEGIN IMMEDIATE")
+    previous_times = {}
+    for user_id, song_id in scores:
+        cursor.execute("SELECT listening_time FROM listening_history WHERE user_id = ? AND song_id = ?",
+                       (user_id, song_id))
+        previous = cursor.fetchone()
+        previous_times[user_id, song_id] = previous[0] if previous else None
+
+    # Insert or update listening history (cumulative score)
+    cursor.executemany('''
+        INSERT INTO listening_history (user_id, song_id, listening_time)
+        VALUES (?, ?, ?)
+        ON CONFLICT(user_id, song_id)
+        DO UPDATE SET
+            listening_time = listening_history.listening_time + excluded.listening_time,
+            timestamp = CURRENT_TIMESTAMP
+    ''', [(user_id, song_id, score) for (user_id, song_id), score in scores.items()])
+
+    # Running content profiles of the users, updated in O(dim) per song
+    song_scores = Counter()
+    for (user_id, song_id), score in scores.items():
+        previous_time = previous_times[user_id, song_id]
+        update_user_profile(conn, recommender, user_id, song_id, previous_time, (previous_time or 0) + score)
+        song_scores[song_id] += score
+
+    # Cold start popularity of the songs
+    add_scores(cursor, song_scores.items())
+
+    conn.commit()
+
+
+class FeedbackBuffer:
+    """
+    Queue of feedback events recorded in batches by a background thread.
+
+    Args:
+        record (callable): Records a batch of (user_id, song_id, score) events, in one
+                           transaction
+        flush_interval (float): Max seconds an event waits in the queue
+        batch_size (int): Pending events triggering an immediate flush
+        max_pending (int): Pending events beyond which `submit` blocks
+    """
+    def __init__(self, record, flush_interval=FLUSH_INTERVAL, batch_size=FLUSH_BATCH_SIZE,
+                 max_pending=MAX_PENDING_EVENTS):
+        self.record = record
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._events = []
+        # Events of each user queued or being recorded
+        self._pending = Counter()
+        self._urgent = False
+        self._closed = False
+        self._changed = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='feedback-flusher', daemon=True)
+        self._thread.start()
+
+    def submit(self, user_id, song_id, score):
+        """Queues a scored event, waiting first if too many events are pending."""
+        with self._changed:
+            self._changed.wait_for(lambda: self._closed or len(self._events) < self.max_pending)
+            if self._closed:
+                raise RuntimeError("Feedback buffer is closed")
+            self._events.append((user_id, song_id, score))
+            self._pending[user_id] += 1
+            if len(self._events) >= self._flush_size:
+                self._changed.notify_all()
+
+    def wait_for_user(self, user_id, timeout=WAIT_TIMEOUT):
+        """
+        Flushes the pending events of a user (with all others) and waits for them to be
+        recorded. Call it before borrowing a pooled connection: the flusher needs one.
+
+        Returns:
+            bool: False if events of the user were still pending after `timeout` seconds.
+        """
+        return self._wait_until(lambda: not self._pending[user_id], timeout)
+
+    def flush(self, timeout=None):
+        """Flushes all pending events and waits for them to be recorded (False on timeout)."""
+        return self._wait_until(lambda: not self._pending, timeout)
+
+    def close(self, timeout=CLOSE_TIMEOUT):
+        """
+        Records all pending events, then stops the flusher, waiting for up to `timeout`
+        seconds. New events are refused.
+        """
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            print(f"[FEEDBACK] Gave up waiting for {len(self)} buffered events after {timeout}s")
+
+    @property
+    def _flush_size(self):
+        return min(self.batch_size, self.max_pending)
+
+    def __len__(self):
+        with self._changed:
+            return sum(self._pending.values())
+
+    def _wait_until(self, recorded, timeout=None):
+        with self._changed:
+            if recorded():
+                return True
+            self._urgent = True
+            self._changed.notify_all()
+            return self._changed.wait_for(recorded, timeout)
+
+    def _run(self):
+        while True:
+            with self._changed:
+                self._changed.wait_for(
+                    lambda: self._closed or self._urgent or len(self._events) >= self._flush_size,
+                    timeout=self.flush_interval
+                )
+                batch, self._events = self._events, []
+                self._urgent = False
+                if not batch and self._closed:
+                    return
+                if batch:
+                    # Room for the requests waiting in `submit`
+                    self._changed.notify_all()
+            if not batch:
+                continue
+
+            self._record(batch)
+            # Recorded or dropped
+            with self._changed:
+                self._pending -= Counter(user_id for user_id, _, _ in batch)
+                self._changed.notify_all()
+
+    def _record(self, batch):
+        """Records a batch, retried if the database is busy, else event by event."""
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                self.record(batch)
+                return
+            except sqlite3.OperationalError as e:
+                if attempt == MAX_ATTEMPTS:
+                    print(f"[FEEDBACK] Could not record {len(batch)} buffered events after "
+                          f"{attempt} attempts: {e}")
+                    break
+                print(f"[FEEDBACK] Could not record {len(batch)} buffered events, retrying: {e}")
+                time.sleep(RETRY_DELAY)
+            except Exception as e:
+                print(f"[FEEDBACK] Could not record {len(batch)} buffered events: {e}")
+                break
+
+        if len(batch) == 1:
+            print(f"[FEEDBACK] Dropped event {batch[0]}")
+            return
+        # Isolate the events that fail
+        for event in batch:
+            try:
+                self.record([event])
+            except Exception as e:
+                print(f"[FEEDBACK] Dropped event {event}: {e}")
@@ -0,0 +1,156 @@
+"""
+Song Popularity
+
+Materialized popularity of each song (sum of the engagement scores of its listening
+sessions), maintained incrementally by /feedback/update and /sync, so that the
+cold-start top songs are read from an index instead of aggregating the whole
+listening history on each request.
+
+Scores can decay with time (POPULARITY_HALF_LIFE_DAYS): each new score is added with a
+weight growing exponentially with its date, which orders songs as if all older scores
+had decayed, without rewriting them. Weights double every half-life after an origin
+(popularity_epoch table): before they can overflow, the origin is moved forward and
+the stored scores scaled down accordingly, in the transaction adding scores. After
+changing the half-life, rebuild the table from the history with:
+
+    python popularity.py [--db music_reco.db]
+"""
+
+import argparse
+import time
+
+# None: songs are ranked by their total score. Otherwise, scores lose half their
+# weight in this many days
+POPULARITY_HALF_LIFE_DAYS = None
+# Initial origin of the decay weights (2026-01-01 UTC), weights double every half-life after it
+DECAY_EPOCH = 1_767_225_600
+# Half-lives after the origin beyond which the origin is moved forward (weights stay
+# below 2 ** MAX_DECAY_HALF_LIVES, floats overflow past 2 ** 1023)
+MAX_DECAY_HALF_LIVES = 64
+
+
+def create_popularity_table(cursor):
+    """Creates the song_popularity table (and its ranking index) if it doesn't exist."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS song_popularity (
+            song_id TEXT PRIMARY KEY,
+            score REAL NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_song_popularity_score ON song_popularity (score DESC)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS popularity_epoch (epoch INTEGER NOT NULL)")
+    cursor.execute("INSERT INTO popularity_epoch SELECT ? WHERE NOT EXISTS (SELECT 1 FROM popularity_epoch)",
+                   (DECAY_EPOCH,))
+
+
+def decay_weight(timestamp=None, epoch=DECAY_EPOCH):
+    """Weight of a score recorded at `timestamp` (Unix seconds, default now), with the
+    decay origin `epoch`."""
+    if POPULARITY_HALF_LIFE_DAYS is None:
+        return 1.0
+    if timestamp is None:
+        timestamp = time.time()
+    return 2.0 ** ((timestamp - epoch) / (POPULARITY_HALF_LIFE_DAYS * 86400))
+
+
+def add_scores(cursor, song_scores):
+    """
+    Adds new engagement scores to the popularity of their songs, moving the decay
+    origin forward first if it is too old.
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor of the transaction recording the scores
+        song_scores (list): (song_id, score) pairs
+    """
+    weight = 1.0
+    if POPULARITY_HALF_LIFE_DAYS is not None:
+        now = time.time()
+        epoch = _move_epoch(cursor, now, MAX_DECAY_HALF_LIVES)
+        weight = decay_weight(now, epoch)
+    cursor.executemany('''
+        INSERT INTO song_popularity (song_id, score) VALUES (?, ?)
+        ON CONFLICT(song_id) DO UPDATE SET score = song_popularity.score + excluded.score
+    ''', [(song_id, float(score) * weight) for song_id, score in song_scores])
+
+
+def top_songs(cursor, limit=50):
+    """
+    Most popular songs with their metadata, most popular first.
+
+    Returns:
+        list: (song_id, title, artist, duration, release, year, tempo) rows, with None
+              metadata for songs missing from the songs table
+    """
+    cursor.execute('''
+        SELECT p.song_id, s.title, s.artist, s.duration, s.release, s.year, s.tempo
+        FROM song_popularity p
+        LEFT JOIN songs s ON p.song_id = s.song_id
+        ORDER BY p.score DESC
+        LIMIT ?
+    ''', (limit,))
+    return cursor.fetchall()
+
+
+def rebuild_popularity(conn):
+    """
+    Recomputes the popularity of all songs from the listening history (the date of
+    each entry is its last update). Doesn't commit: the caller commits it with the
+    change of the history.
+
+    Returns:
+        int: Number of songs written.
+    """
+    cursor = conn.cursor()
+    score = 'listening_time'
+    if POPULARITY_HALF_LIFE_DAYS is not None:
+        # Latest origin: weights of the history are below 2
+        epoch = _move_epoch(cursor, time.time(), 0, rescale=False)
+        conn.create_function('decay_weight', 2, decay_weight, deterministic=True)
+        score = f"listening_time * decay_weight(CAST(strftime('%s', timestamp) AS INTEGER), {epoch})"
+
+    cursor.execute("DELETE FROM song_popularity")
+    cursor.execute(f'''
+        INSERT INTO song_popularity (song_id, score)
+        SELECT song_id, COALESCE(SUM({score}), 0) FROM listening_history GROUP BY song_id
+    ''')
+    return cursor.rowcount
+
+
+def _move_epoch(cursor, now, max_half_lives, rescale=True):
+    """
+    Moves the decay origin forward by whole half-lives if `now` is more than
+    `max_half_lives` after it, halving the stored scores once per half-life (exact in
+    floating point, so their order is kept).
+
+    Returns:
+        int: The decay origin.
+    """
+    cursor.execute("SELECT epoch FROM popularity_epoch")
+    epoch = cursor.fetchone()[0]
+    half_life = POPULARITY_HALF_LIFE_DAYS * 86400
+    half_lives = int((now - epoch) // half_life)
+    if half_lives <= max_half_lives:
+        return epoch
+
+    epoch += int(half_lives * half_life)
+    if rescale:
+        cursor.execute("UPDATE song_popularity SET score = score * ?", (2.0 ** -half_lives,))
+    cursor.execute("UPDATE popularity_epoch SET epoch = ?", (epoch,))
+    print(f"[POPULARITY] Moved the decay origin forward by {half_lives} half-lives")
+    return epoch
+
+
+if __name__ == '__main__':
+    from db import DB_NAME, connect
+
+    parser = argparse.ArgumentParser(description="Rebuild the song popularity table from the listening history.")
+    parser.add_argument('--db', default=DB_NAME, help="Path of the SQLite database")
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    create_popularity_table(conn.cursor())
+    start = time.perf_counter()
+    n_songs = rebuild_popularity(conn)
+    conn.commit()
+    conn.close()
+    print(f"[POPULARITY] Rebuilt the popularity of {n_songs} songs in {time.perf_counter() - start:.1f}s")
@@ -1,11 +1,12 @@
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-import sqlite3
 import pandas as pd
 import os
 import random
 import math
 import sys
+import atexit
+import signal
 from pathlib import Path
 
 # Add project root to sys.path to allow importing from collaborative
@@ -15,12 +16,13 @@ if str(project_root) not in sys.path:
 
 # Import Recommenders
 try:
-    from collaborative_recommender import get_collaborative_recommendations, is_collaborative_available
+    from collaborative_recommender import get_collaborative_recommendations, get_similar_songs, is_collaborative_available
     print("[COLLABORATIVE] ✓ Wrapper loaded successfully")
 except ImportError as e:
     print(f"[COLLABORATIVE] ⚠ Could not import wrapper: {e}")
     def is_collaborative_available(): return False
     def get_collaborative_recommendations(*args, **kwargs): return []
+    def get_similar_songs(*args, **kwargs): return []
 
 try:
     from content_recommender_utils import load_content_recommender, get_content_based_recommendation
@@ -29,6 +31,12 @@ except ImportError as e:
     print(f"[WARNING] Could not import content_recommender_utils: {e}")
     CONTENT_RECOMMENDER_AVAILABLE = False
 
+from db import DB_NAME, connection
+from user_profiles import create_profile_table, rebuild_user_profiles
+from popularity import create_popularity_table, add_scores, top_songs, rebuild_popularity
+from song_resolver import create_song_index_tables, rebuild_song_index, resolve_song
+from feedback_buffer import FeedbackBuffer, apply_feedback
+
 try:
     from mix_recommender import get_mix_recommendation
     MIX_RECOMMENDER_AVAILABLE = True
@@ -41,15 +49,18 @@ CORS(app)  # Enable CORS for all routes
 
 # Global variable to hold the preloaded content-based recommender
 content_recommender = None
+# Write-behind queue of feedback events (FEEDBACK_WRITE_BEHIND), None when disabled
+feedback_buffer = None
 
 # =============================================================================
 # CONFIGURATION
 # =============================================================================
 
-DB_NAME = "music_reco.db"
+# Database file and connection settings: see db.py
 DEFAULT_SONG_DURATION = 210  # Default duration in seconds (3m 30s)
 MAX_SCORE = 10
 COLD_START_THRESHOLD = 5  # Minimum tracks needed before using collaborative filtering
+FEEDBACK_WRITE_BEHIND = False  # Queue feedback and record it in batches (see feedback_buffer.py)
 
 # =============================================================================
 # HELPER FUNCTIONS
@@ -91,39 +102,63 @@ def init_db():
     """
     Initialize SQLite database if it doesn't exist.
     
-    Creates two tables:
+    Creates six tables:
         - songs: Store song metadata (title, artist, duration)
         - listening_history: Track user listening sessions and engagement scores
+        - user_profiles: Running content-based embedding sums of each user
+        - song_popularity: Total engagement score of each song (cold start)
+        - song_keys, songs_fts: Title indexes resolving feedback sent by title
     """
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
-    # Songs metadata table (stores duration and track information)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS songs (
-            song_id TEXT PRIMARY KEY,
-            title TEXT,
-            artist TEXT,
-            duration REAL,
-            release TEXT,
-            year INTEGER,
-            tempo REAL
-        )
-    ''')
-
-    # Listening history table (tracks user engagement)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS listening_history (
-            user_id TEXT NOT NULL,
-            song_id TEXT NOT NULL,
-            listening_time INTEGER,
-            algo_type TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            PRIMARY KEY (user_id, song_id)
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        
+        # Songs metadata table (stores duration and track information)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS songs (
+                song_id TEXT PRIMARY KEY,
+                title TEXT,
+                artist TEXT,
+                duration REAL,
+                release TEXT,
+                year INTEGER,
+                tempo REAL
+            )
+        ''')
+
+        # Listening history table (tracks user engagement)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS listening_history (
+                user_id TEXT NOT NULL,
+                song_id TEXT NOT NULL,
+                listening_time INTEGER,
+                algo_type TEXT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, song_id)
+            )
+        ''')
+        
+        # Content profiles table (maintained from the listening history)
+        create_profile_table(cursor)
+        
+        # Song popularity table, filled from the history of databases created without it
+        create_popularity_table(cursor)
+        conn.commit()
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM song_popularity)")
+        if not cursor.fetchone()[0]:
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM listening_history)")
+            if cursor.fetchone()[0]:
+                print(f"[POPULARITY] Computed the popularity of {rebuild_popularity(conn)} songs")
+                conn.commit()
+
+        # Title indexes, built from the songs of databases created without them
+        create_song_index_tables(cursor)
+        conn.commit()
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM song_keys)")
+        if not cursor.fetchone()[0]:
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM songs)")
+            if cursor.fetchone()[0]:
+                print(f"[FEEDBACK] Indexed {rebuild_song_index(conn)} song title keys")
+                conn.commit()
     print(f"Database '{DB_NAME}' initialized successfully.")
 
 
@@ -149,6 +184,27 @@ def init_content_recommender():
         content_recommender = None
 
 
+def init_feedback_buffer():
+    """
+    Start the write-behind feedback queue if FEEDBACK_WRITE_BEHIND is set.
+    Queued events are recorded at exit, including on SIGTERM.
+    """
+    global feedback_buffer
+    
+    if not FEEDBACK_WRITE_BEHIND:
+        return
+    
+    def record(events):
+        with connection() as conn:
+            apply_feedback(conn, content_recommender, events)
+    
+    feedback_buffer = FeedbackBuffer(record)
+    atexit.register(feedback_buffer.close)
+    # Exit normally (running atexit) rather than being killed by SIGTERM
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print("[FEEDBACK] Write-behind mode: feedback is recorded in batches")
+
+
 # =============================================================================
 # API ENDPOINTS
 # =============================================================================
@@ -203,119 +259,112 @@ def recommend_next_track():
     track_details = {}
 
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        
-        # Check for cold start: Does user have sufficient listening history?
-        cursor.execute("SELECT COUNT(*) FROM listening_history WHERE user_id = ?", (user_id,))
-        history_count = cursor.fetchone()[0]
+        # Read-your-writes: record the user's queued feedback first
+        if feedback_buffer is not None and not feedback_buffer.wait_for_user(user_id):
+            print(f"[FEEDBACK] Queued feedback of user {user_id} not recorded yet, reading without it")
 
-        # Cold start scenario: Less than required tracks in history
-        if history_count < COLD_START_THRESHOLD:
-            algo_used = "cold_start_top50"
-            
-            # Get top 50 most popular tracks with metadata
-            cursor.execute('''
-                SELECT s.song_id, s.title, s.artist, s.duration, s.release, s.year, s.tempo 
-                FROM listening_history lh
-                LEFT JOIN songs s ON lh.song_id = s.song_id
-                GROUP BY lh.song_id
-                ORDER BY SUM(lh.listening_time) DESC
-                LIMIT 50
-            ''')
+        with connection() as conn:
+            cursor = conn.cursor()
             
-            rows = cursor.fetchall()
-            valid_rows = [row for row in rows if row[1] and row[2]]  # Ensure title and artist exist
-            
-            if valid_rows:
-                selected = random.choice(valid_rows)
-                suggestion = f"{selected[1]} - {selected[2]}"
-                track_details = {
-                    "song_id": selected[0],
-                    "title": selected[1],
-                    "artist": selected[2],
-                    "duration": selected[3],
-                    "release": selected[4],
-                    "year": selected[5],
-                    "tempo": selected[6]
-                }
-            else:
-                # No tracks in database at all - use fallback
-                suggestion = "Bohemian Rhapsody - Queen"
-                algo_used = "fallback_default"
-        else:
-            # User has sufficient history - use algorithm-specific logic
-            selected_track_obj = None
-            
-            if algo_type == 'content':
-                if CONTENT_RECOMMENDER_AVAILABLE and content_recommender:
-                    try:
-                        recs = get_content_based_recommendation(content_recommender, user_id, conn)
-                        if recs:
-                            # Content recommender returns list of dicts
-                            selected_track_obj = random.choice(recs)
-                            algo_used = "content_v1"
-                        else:
-                             algo_used = "content_empty"
-                    except Exception as e:
-                        print(f"[CONTENT] Error: {e}")
-                        algo_used = "content_error"
-                else:
-                    algo_used = "content_na"
-                    
-            elif algo_type == 'matriciel':
-                if is_collaborative_available():
-                    try:
-                        # Wrapper handles DB lookup
-                        recs = get_collaborative_recommendations(user_id, conn, limit=10)
-                        if recs:
-                            selected_track_obj = random.choice(recs)
-                            algo_used = "matriciel_v1"
-                        else:
-                            algo_used = "matriciel_empty"
-                    except Exception as e:
-                        print(f"[COLLAB] Error: {e}")
-                        algo_used = "matriciel_error"
+            # Check for cold start: Does user have sufficient listening history?
+            cursor.execute("SELECT COUNT(*) FROM listening_history WHERE user_id = ?", (user_id,))
+            history_count = cursor.fetchone()[0]
+
+            # Cold start scenario: Less than required tracks in history
+            if history_count < COLD_START_THRESHOLD:
+                algo_used = "cold_start_top50"
+                
+                # Get top 50 most popular tracks with metadata (materialized popularity)
+                rows = top_songs(cursor, limit=50)
+                valid_rows = [row for row in rows if row[1] and row[2]]  # Ensure title and artist exist
+                
+                if valid_rows:
+                    selected = random.choice(valid_rows)
+                    suggestion = f"{selected[1]} - {selected[2]}"
+                    track_details = {
+                        "song_id": selected[0],
+                        "title": selected[1],
+                        "artist": selected[2],
+                        "duration": selected[3],
+                        "release": selected[4],
+                        "year": selected[5],
+                        "tempo": selected[6]
+                    }
                 else:
-                    algo_used = "matriciel_na"
-                    
-            elif algo_type == 'mix':
-                 if MIX_RECOMMENDER_AVAILABLE:
-                     try:
-                         # mix recommender handles scoring and returns single winner
-                         rec, reason = get_mix_recommendation(user_id, conn, content_recommender)
-                         if rec:
-                             selected_track_obj = rec
-                             algo_used = reason
-                         else:
-                             algo_used = reason
-                     except Exception as e:
-                         print(f"[MIX] Error: {e}")
-                         algo_used = "mix_error"
-                 else:
-                     algo_used = "mix_na"
-            
-            # Fallback if no track selected
-            if selected_track_obj:
-               # Ensure we have required keys
-               title = selected_track_obj.get('title', 'Unknown Title')
-               artist = selected_track_obj.get('artist') or selected_track_obj.get('artist_name') or 'Unknown Artist'
-               suggestion = f"{title} - {artist}"
-               
-               track_details = {
-                    "song_id": selected_track_obj.get('song_id'),
-                    "title": title,
-                    "artist": artist,
-                    "duration": selected_track_obj.get('duration', DEFAULT_SONG_DURATION),
-                    "release": selected_track_obj.get('release'),
-                    "year": selected_track_obj.get('year', 0),
-                    "tempo": selected_track_obj.get('tempo', 0)
-                }
+                    # No tracks in database at all - use fallback
+                    suggestion = "Bohemian Rhapsody - Queen"
+                    algo_used = "fallback_default"
             else:
-                 suggestion = "Hotel California - The Eagles"
-                 algo_used += "_fallback"
-
-        conn.close()
+                # User has sufficient history - use algorithm-specific logic
+                selected_track_obj = None
+                
+                if algo_type == 'content':
+                    if CONTENT_RECOMMENDER_AVAILABLE and content_recommender:
+                        try:
+                            recs = get_content_based_recommendation(content_recommender, user_id, conn)
+                            if recs:
+                                # Content recommender returns list of dicts
+                                selected_track_obj = random.choice(recs)
+                                algo_used = "content_v1"
+                            else:
+                                 algo_used = "content_empty"
+                        except Exception as e:
+                            print(f"[CONTENT] Error: {e}")
+                            algo_used = "content_error"
+                    else:
+                        algo_used = "content_na"
+                        
+                elif algo_type == 'matriciel':
+                    if is_collaborative_available():
+                        try:
+                            # Wrapper handles DB lookup
+                            recs = get_collaborative_recommendations(user_id, conn, limit=10)
+                            if recs:
+                                selected_track_obj = random.choice(recs)
+                                algo_used = "matriciel_v1"
+                            else:
+                                algo_used = "matriciel_empty"
+                        except Exception as e:
+                            print(f"[COLLAB] Error: {e}")
+                            algo_used = "matriciel_error"
+                    else:
+                        algo_used = "matriciel_na"
+                        
+                elif algo_type == 'mix':
+                     if MIX_RECOMMENDER_AVAILABLE:
+                         try:
+                             # mix recommender handles scoring and returns single winner
+                             rec, reason = get_mix_recommendation(user_id, conn, content_recommender)
+                             if rec:
+                                 selected_track_obj = rec
+                                 algo_used = reason
+                             else:
+                                 algo_used = reason
+                         except Exception as e:
+                             print(f"[MIX] Error: {e}")
+                             algo_used = "mix_error"
+                     else:
+                         algo_used = "mix_na"
+                
+                # Fallback if no track selected
+                if selected_track_obj:
+                   # Ensure we have required keys
+                   title = selected_track_obj.get('title', 'Unknown Title')
+                   artist = selected_track_obj.get('artist') or selected_track_obj.get('artist_name') or 'Unknown Artist'
+                   suggestion = f"{title} - {artist}"
+                   
+                   track_details = {
+                        "song_id": selected_track_obj.get('song_id'),
+                        "title": title,
+                        "artist": artist,
+                        "duration": selected_track_obj.get('duration', DEFAULT_SONG_DURATION),
+                        "release": selected_track_obj.get('release'),
+                        "year": selected_track_obj.get('year', 0),
+                        "tempo": selected_track_obj.get('tempo', 0)
+                    }
+                else:
+                     suggestion = "Hotel California - The Eagles"
+                     algo_used += "_fallback"
 
     except Exception as e:
         print(f"[ERROR] Database error in /recommend/next: {e}")
@@ -331,6 +380,50 @@ def recommend_next_track():
 
     return jsonify(response_data)
 
+@app.route('/recommend/similar', methods=['GET'])
+def recommend_similar_tracks():
+    """
+    Get the tracks most similar to a given track ("more like this").
+    
+    Uses the precomputed collaborative item-to-item neighbor table.
+    
+    Query Parameters:
+        songId (str, required): MSD song identifier
+        limit (int): Number of tracks to return (default: 10)
+    
+    Returns:
+        JSON: {
+            "status": "success",
+            "song_id": str,
+            "similar": [list of tracks]
+        }
+    
+    Example:
+        GET /recommend/similar?songId=SOAUWYT12A81C206F1&limit=5
+    """
+    song_id = request.args.get('songId')
+    limit = request.args.get('limit', default=10, type=int)
+    
+    if not song_id:
+        return jsonify({"error": "songId parameter is required"}), 400
+    
+    if not is_collaborative_available():
+        return jsonify({"error": "Collaborative model not available"}), 503
+    
+    try:
+        with connection() as conn:
+            similar = get_similar_songs(song_id, conn, limit=limit)
+        
+        return jsonify({
+            "status": "success",
+            "song_id": song_id,
+            "similar": similar
+        })
+        
+    except Exception as e:
+        print(f"[ERROR] Error in /recommend/similar: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/user/history', methods=['GET'])
 def get_user_history():
     """
@@ -358,45 +451,47 @@ def get_user_history():
         return jsonify({"error": "userId parameter is required"}), 400
     
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        
-        # Retrieve listening history with scores
-        cursor.execute('''
-            SELECT 
-                lh.song_id,
-                lh.listening_time as score,
-                lh.algo_type,
-                lh.timestamp,
-                s.title,
-                s.artist,
-                s.duration
-            FROM listening_history lh
-            LEFT JOIN songs s ON lh.song_id = s.song_id
-            WHERE lh.user_id = ?
-            ORDER BY lh.timestamp DESC
-        ''', (user_id,))
-        
-        rows = cursor.fetchall()
-        
-        # Format results
-        history = []
-        for row in rows:
-            history.append({
-                "song_id": row[0],
-                "score": row[1],
-                "algo_type": row[2],
-                "timestamp": row[3],
-                "title": row[4],
-                "artist": row[5],
-                "duration": row[6]
-            })
-        
-        # Calculate statistics
-        total_score = sum(item['score'] for item in history)
-        unique_songs = len(set(item['song_id'] for item in history))
-        
-        conn.close()
+        # Read-your-writes: record the user's queued feedback first
+        if feedback_buffer is not None and not feedback_buffer.wait_for_user(user_id):
+            print(f"[FEEDBACK] Queued feedback of user {user_id} not recorded yet, reading without it")
+
+        with connection() as conn:
+            cursor = conn.cursor()
+            
+            # Retrieve listening history with scores
+            cursor.execute('''
+                SELECT 
+                    lh.song_id,
+                    lh.listening_time as score,
+                    lh.algo_type,
+                    lh.timestamp,
+                    s.title,
+                    s.artist,
+                    s.duration
+                FROM listening_history lh
+                LEFT JOIN songs s ON lh.song_id = s.song_id
+                WHERE lh.user_id = ?
+                ORDER BY lh.timestamp DESC
+            ''', (user_id,))
+            
+            rows = cursor.fetchall()
+            
+            # Format results
+            history = []
+            for row in rows:
+                history.append({
+                    "song_id": row[0],
+                    "score": row[1],
+                    "algo_type": row[2],
+                    "timestamp": row[3],
+                    "title": row[4],
+                    "artist": row[5],
+                    "duration": row[6]
+                })
+            
+            # Calculate statistics
+            total_score = sum(item['score'] for item in history)
+            unique_songs = len(set(item['song_id'] for item in history))
         
         return jsonify({
             "status": "success",
@@ -445,71 +540,64 @@ def update_user_feedback():
     time_listened = float(data.get('listeningTime') or request.args.get('listeningTime') or 0)
     
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        
-        final_song_id = None
-        
-        # 1. Check if raw_id_input is a valid song_id in our DB
-        if raw_id_input:
-             cursor.execute("SELECT song_id FROM songs WHERE song_id = ?", (raw_id_input,))
-             if cursor.fetchone():
-                 final_song_id = raw_id_input
-        
-        # 2. If valid ID not found, check if raw_id_input or song_title_input match a title/artist combination
-        if not final_song_id:
-             # Try to match by title
-             search_term = song_title_input if song_title_input else raw_id_input
-             if search_term:
-                 print(f"[FEEDBACK] '{search_term}' is not a known song_id. Searching by title...")
-                 # Try exact title match first
-                 cursor.execute("SELECT song_id FROM songs WHERE title = ? OR title || ' - ' || artist = ?", (search_term, search_term))
-                 row = cursor.fetchone()
-                 if row:
-                     final_song_id = row[0]
-                     print(f"[FEEDBACK] Resolved '{search_term}' to song_id: {final_song_id}")
-                 else:
-                     # Very loose search (risky but helps find something)
-                     cursor.execute("SELECT song_id FROM songs WHERE ? LIKE '%' || title || '%'", (search_term,))
-                     row = cursor.fetchone()
-                     if row:
-                        final_song_id = row[0]
-                        print(f"[FEEDBACK] Fuzzy resolved '{search_term}' to song_id: {final_song_id}")
-        
-        if not final_song_id:
-             print(f"[FEEDBACK] ERROR: Could not resolve '{raw_id_input or song_title_input}' to a valid song_id. Feedback ignored.")
-             conn.close()
-             return jsonify({
-                 "status": "error",
-                 "message": "Could not verify song_id. Only valid song_ids are stored."
-             }), 400
-
-        # Retrieve track duration for score logic using the FINAL song_id
-        cursor.execute("SELECT duration FROM songs WHERE song_id = ?", (final_song_id,))
-        row = cursor.fetchone()
-        
-        if row and row[0]:
-            total_duration = row[0]
-        else:
-            total_duration = DEFAULT_SONG_DURATION
+        with connection() as conn:
+            cursor = conn.cursor()
+            
+            final_song_id = None
+            
+            # 1. Check if raw_id_input is a valid song_id in our DB
+            if raw_id_input:
+                 cursor.execute("SELECT song_id FROM songs WHERE song_id = ?", (raw_id_input,))
+                 if cursor.fetchone():
+                     final_song_id = raw_id_input
+            
+            # 2. If valid ID not found, check if raw_id_input or song_title_input match a title/artist combination
+            if not final_song_id:
+                 # Try to match by title
+                 search_term = song_title_input if song_title_input else raw_id_input
+                 if search_term:
+                     print(f"[FEEDBACK] '{search_term}' is not a known song_id. Searching by title...")
+                     # Indexed title/artist resolution (exact, then contained, then token match)
+                     final_song_id, stage = resolve_song(cursor, search_term)
+                     if stage == 'exact':
+                         print(f"[FEEDBACK] Resolved '{search_term}' to song_id: {final_song_id}")
+                     elif final_song_id:
+                         print(f"[FEEDBACK] Fuzzy resolved ({stage}) '{search_term}' to song_id: {final_song_id}")
+            
+            if not final_song_id:
+                 print(f"[FEEDBACK] ERROR: Could not resolve '{raw_id_input or song_title_input}' to a valid song_id. Feedback ignored.")
+                 return jsonify({
+                     "status": "error",
+                     "message": "Could not verify song_id. Only valid song_ids are stored."
+                 }), 400
+
+            # Retrieve track duration for score logic using the FINAL song_id
+            cursor.execute("SELECT duration FROM songs WHERE song_id = ?", (final_song_id,))
+            row = cursor.fetchone()
+            
+            if row and row[0]:
+                total_duration = row[0]
+            else:
+                total_duration = DEFAULT_SONG_DURATION
 
-        print(f"[FEEDBACK] User {user_id} listened to '{final_song_id}' (Duration: {total_duration}s) for {time_listened}s")
+            print(f"[FEEDBACK] User {user_id} listened to '{final_song_id}' (Duration: {total_duration}s) for {time_listened}s")
 
-        # Calculate engagement score
-        interest_score = compute_score(time_listened, total_duration)
+            # Calculate engagement score
+            interest_score = compute_score(time_listened, total_duration)
 
-        # Insert or update listening history (cumulative score)
-        cursor.execute('''
-            INSERT INTO listening_history (user_id, song_id, listening_time) 
-            VALUES (?, ?, ?)
-            ON CONFLICT(user_id, song_id) 
-            DO UPDATE SET 
-                listening_time = listening_history.listening_time + excluded.listening_time,
-                timestamp = CURRENT_TIMESTAMP
-        ''', (user_id, final_song_id, interest_score))
-        
-        conn.commit()
-        conn.close()
+            if feedback_buffer is None:
+                apply_feedback(conn, content_recommender, [(user_id, final_song_id, interest_score)])
+
+        # Write-behind: recorded with the next batch (outside the `with`, the flusher may
+        # need this connection if the queue is full)
+        if feedback_buffer is not None:
+            feedback_buffer.submit(user_id, final_song_id, interest_score)
+            return jsonify({
+                "status": "success",
+                "message": "Feedback queued",
+                "score_computed": interest_score,
+                "resolved_song_id": final_song_id
+            })
         
         return jsonify({
             "status": "success", 
@@ -534,107 +622,122 @@ def sync_data():
         base_dir = os.path.dirname(os.path.abspath(__file__))
         data_dir = os.path.join(base_dir, '..', '..', 'data')
         
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        
-        results = {
-            "status": "success",
-            "songs_loaded": 0,
-            "history_loaded": 0,
-            "messages": []
-        }
-
-        # --- STEP 1: LOAD SONGS METADATA ---
-        metadata_path = os.path.join(data_dir, 'songs_metadata.pkl')
-        if os.path.exists(metadata_path):
-            print(f"[SYNC] Loading Songs Metadata from {metadata_path}...")
-            meta_df = pd.read_pickle(metadata_path)
-            print(f"[SYNC] Found {len(meta_df)} songs in metadata.")
+        with connection() as conn:
+            cursor = conn.cursor()
             
-            # Ensure required columns exist
-            if 'song_id' in meta_df.columns:
-                # Fill missing optional columns with defaults
-                if 'duration' not in meta_df.columns: meta_df['duration'] = DEFAULT_SONG_DURATION
-                if 'release' not in meta_df.columns: meta_df['release'] = None
-                if 'year' not in meta_df.columns: meta_df['year'] = 0
-                if 'tempo' not in meta_df.columns: meta_df['tempo'] = 0.0
-                if 'title' not in meta_df.columns: meta_df['title'] = "Unknown Title"
-                if 'artist_name' not in meta_df.columns: meta_df['artist_name'] = "Unknown Artist"
-
-                # Clean numeric types
-                meta_df['year'] = pd.to_numeric(meta_df['year'], errors='coerce').fillna(0).astype(int)
-                meta_df['tempo'] = pd.to_numeric(meta_df['tempo'], errors='coerce').fillna(0.0)
-                meta_df['duration'] = pd.to_numeric(meta_df['duration'], errors='coerce').fillna(DEFAULT_SONG_DURATION)
-                
-                # Prepare for insertion
-                # Columns: song_id, title, artist, duration, release, year, tempo
-                # Note: pickle has 'artist_name', db has 'artist'
-                song_records = meta_df[['song_id', 'title', 'artist_name', 'duration', 'release', 'year', 'tempo']].to_records(index=False).tolist()
+            results = {
+                "status": "success",
+                "songs_loaded": 0,
+                "history_loaded": 0,
+                "messages": []
+            }
+
+            # --- STEP 1: LOAD SONGS METADATA ---
+            metadata_path = os.path.join(data_dir, 'songs_metadata.pkl')
+            if os.path.exists(metadata_path):
+                print(f"[SYNC] Loading Songs Metadata from {metadata_path}...")
+                meta_df = pd.read_pickle(metadata_path)
+                print(f"[SYNC] Found {len(meta_df)} songs in metadata.")
                 
-                cursor.executemany('''
-                    INSERT OR REPLACE INTO songs (song_id, title, artist, duration, release, year, tempo)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', song_records)
-                
-                results["songs_loaded"] = len(song_records)
-                results["messages"].append(f"Imported {len(song_records)} from songs_metadata.pkl")
-            else:
-                 results["messages"].append("songs_metadata.pkl missing 'song_id' column")
-        else:
-            results["messages"].append("songs_metadata.pkl not found")
-
-        # --- STEP 2: LOAD LISTENING HISTORY ---
-        history_path = os.path.join(data_dir, 'merged_data.pkl')
-        # Fallback
-        if not os.path.exists(history_path):
-            history_path = os.path.join(data_dir, 'mixed_data.pkl')
-
-        if os.path.exists(history_path):
-            print(f"[SYNC] Loading User History from {history_path}...")
-            hist_df = pd.read_pickle(history_path)
-            print(f"[SYNC] Found {len(hist_df)} history records.")
-            
-            required_hist_cols = ['user_id', 'song_id', 'play_count']
-            if all(c in hist_df.columns for c in required_hist_cols):
-                # If we have no songs loaded yet (meta file missing), we must extract basic song info from history to satisfy eventual consistency
-                if results["songs_loaded"] == 0:
-                     print("[SYNC] Extracting basic song info from history (metadata missing)...")
-                     unique_songs = hist_df[['song_id', 'title', 'artist_name']].drop_duplicates(subset=['song_id']).copy()
-                     unique_songs['duration'] = DEFAULT_SONG_DURATION
-                     unique_songs['release'] = None
-                     unique_songs['year'] = 0
-                     unique_songs['tempo'] = 0
-                     
-                     fallback_songs = unique_songs.to_records(index=False).tolist()
-                     cursor.executemany('''
-                        INSERT OR IGNORE INTO songs (song_id, title, artist, duration, release, year, tempo)
+                # Ensure required columns exist
+                if 'song_id' in meta_df.columns:
+                    # Fill missing optional columns with defaults
+                    if 'duration' not in meta_df.columns: meta_df['duration'] = DEFAULT_SONG_DURATION
+                    if 'release' not in meta_df.columns: meta_df['release'] = None
+                    if 'year' not in meta_df.columns: meta_df['year'] = 0
+                    if 'tempo' not in meta_df.columns: meta_df['tempo'] = 0.0
+                    if 'title' not in meta_df.columns: meta_df['title'] = "Unknown Title"
+                    if 'artist_name' not in meta_df.columns: meta_df['artist_name'] = "Unknown Artist"
+
+                    # Clean numeric types
+                    meta_df['year'] = pd.to_numeric(meta_df['year'], errors='coerce').fillna(0).astype(int)
+                    meta_df['tempo'] = pd.to_numeric(meta_df['tempo'], errors='coerce').fillna(0.0)
+                    meta_df['duration'] = pd.to_numeric(meta_df['duration'], errors='coerce').fillna(DEFAULT_SONG_DURATION)
+                    
+                    # Prepare for insertion
+                    # Columns: song_id, title, artist, duration, release, year, tempo
+                    # Note: pickle has 'artist_name', db has 'artist'
+                    song_records = meta_df[['song_id', 'title', 'artist_name', 'duration', 'release', 'year', 'tempo']].to_records(index=False).tolist()
+                    
+                    cursor.executemany('''
+                        INSERT OR REPLACE INTO songs (song_id, title, artist, duration, release, year, tempo)
                         VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ''', fallback_songs)
-                     results["messages"].append(f"Extracted {len(fallback_songs)} songs from history file")
-
-                # Prepare history data
-                hist_df['listening_time'] = hist_df['play_count'].fillna(0).astype(int)
-                hist_df['algo_type'] = 'import_msd'
-                
-                history_records = hist_df[['user_id', 'song_id', 'listening_time', 'algo_type']].to_records(index=False).tolist()
-                
-                cursor.executemany('''
-                    INSERT INTO listening_history (user_id, song_id, listening_time, algo_type) 
-                    VALUES (?, ?, ?, ?)
-                    ON CONFLICT(user_id, song_id) 
-                    DO UPDATE SET 
-                        listening_time = listening_history.listening_time + excluded.listening_time
-                ''', history_records)
+                    ''', song_records)
+                    
+                    results["songs_loaded"] = len(song_records)
+                    results["messages"].append(f"Imported {len(song_records)} from songs_metadata.pkl")
+                else:
+                     results["messages"].append("songs_metadata.pkl missing 'song_id' column")
+            else:
+                results["messages"].append("songs_metadata.pkl not found")
+
+            # --- STEP 2: LOAD LISTENING HISTORY ---
+            songs_extracted = False
+            history_path = os.path.join(data_dir, 'merged_data.pkl')
+            # Fallback
+            if not os.path.exists(history_path):
+                history_path = os.path.join(data_dir, 'mixed_data.pkl')
+
+            if os.path.exists(history_path):
+                print(f"[SYNC] Loading User History from {history_path}...")
+                hist_df = pd.read_pickle(history_path)
+                print(f"[SYNC] Found {len(hist_df)} history records.")
                 
-                results["history_loaded"] = len(history_records)
-                results["messages"].append(f"Imported {len(history_records)} from {os.path.basename(history_path)}")
+                required_hist_cols = ['user_id', 'song_id', 'play_count']
+                if all(c in hist_df.columns for c in required_hist_cols):
+                    # If we have no songs loaded yet (meta file missing), we must extract basic song info from history to satisfy eventual consistency
+                    if results["songs_loaded"] == 0:
+                         print("[SYNC] Extracting basic song info from history (metadata missing)...")
+                         unique_songs = hist_df[['song_id', 'title', 'artist_name']].drop_duplicates(subset=['song_id']).copy()
+                         unique_songs['duration'] = DEFAULT_SONG_DURATION
+                         unique_songs['release'] = None
+                         unique_songs['year'] = 0
+                         unique_songs['tempo'] = 0
+                         
+                         fallback_songs = unique_songs.to_records(index=False).tolist()
+                         cursor.executemany('''
+                            INSERT OR IGNORE INTO songs (song_id, title, artist, duration, release, year, tempo)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)
+                        ''', fallback_songs)
+                         results["messages"].append(f"Extracted {len(fallback_songs)} songs from history file")
+                         songs_extracted = True
+
+                    # Prepare history data
+                    hist_df['listening_time'] = hist_df['play_count'].fillna(0).astype(int)
+                    hist_df['algo_type'] = 'import_msd'
+                    
+                    history_records = hist_df[['user_id', 'song_id', 'listening_time', 'algo_type']].to_records(index=False).tolist()
+                    
+                    cursor.executemany('''
+                        INSERT INTO listening_history (user_id, song_id, listening_time, algo_type) 
+                        VALUES (?, ?, ?, ?)
+                        ON CONFLICT(user_id, song_id) 
+                        DO UPDATE SET 
+                            listening_time = listening_history.listening_time + excluded.listening_time
+                    ''', history_records)
+                    add_scores(cursor, hist_df.groupby('song_id')['listening_time'].sum().items())
+                    
+                    results["history_loaded"] = len(history_records)
+                    results["messages"].append(f"Imported {len(history_records)} from {os.path.basename(history_path)}")
+                else:
+                     results["messages"].append("History file missing required columns")
             else:
-                 results["messages"].append("History file missing required columns")
-        else:
-            results["messages"].append("History pickle file not found")
+                results["messages"].append("History pickle file not found")
+
+            # Imported songs change the title indexes
+            if results["songs_loaded"] or songs_extracted:
+                n_keys = rebuild_song_index(conn)
+                results["messages"].append(f"Indexed {n_keys} song title keys")
+
+            # Imported history changes the content profiles of its users
+            if results["history_loaded"]:
+                if content_recommender is not None:
+                    n_profiles = rebuild_user_profiles(conn, content_recommender)
+                    results["messages"].append(f"Rebuilt {n_profiles} user content profiles")
+                else:
+                    cursor.execute("DELETE FROM user_profiles")
 
-        conn.commit()
-        conn.close()
+            conn.commit()
         
         print(f"[SYNC] Complete. {results}")
         return jsonify(results)
@@ -653,6 +756,7 @@ def sync_data():
 if __name__ == '__main__':
     init_db()
     init_content_recommender()
+    init_feedback_buffer()
     print("\n" + "="*60)
     print(" SoundCloud Music Recommender API")
     print(" Server starting on http://localhost:5000")
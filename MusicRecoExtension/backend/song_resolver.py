@@ -0,0 +1,197 @@
+"""
+Song Resolution
+
+Resolves the free-text song references sent by the client instead of song IDs (a
+title, "Title - Artist", "Artist - Title (Official Video)", ...) with indexes built
+during /sync, instead of scanning the songs table:
+
+- song_keys: normalized (case, accents and punctuation folded) title, "title artist"
+  and "artist title" keys of each song, indexed.
+- songs_fts: FTS5 full-text index of the titles and artists.
+
+Resolution stages, the first one finding songs wins:
+
+1. exact: the normalized reference is a key.
+2. contained: a run of consecutive words of the reference is a key (the reference
+   contains a title, the former `LIKE '%' || title || '%'` match).
+3. tokens: every word of the reference appears in a song's title or artist, and at
+   least one in its title (an artist alone doesn't name a song).
+
+Ties are broken deterministically: title and artist matches first, then longer
+matches, then more popular songs (as of the last build of the keys, so that they are
+ranked from the index alone), then song IDs. The indexes are rebuilt by /sync, or with:
+
+    python song_resolver.py [--db music_reco.db] [reference ...]
+"""
+
+import argparse
+import re
+import unicodedata
+
+# References are cut to this many words for the contained stage (n * (n + 1) / 2 keys)
+MAX_REFERENCE_WORDS = 16
+# Kinds of keys, the ones matching the title and the artist first
+TITLE_ARTIST_KEY = 0
+TITLE_KEY = 1
+
+_NON_ALPHANUMERIC = re.compile(r'[\W_]+')
+
+
+def normalize(text):
+    """Folds case, accents and punctuation: 'Beyoncé - Halo!' -> 'beyonce halo'."""
+    if not text:
+        return ''
+    text = str(text)
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(char for char in text if not unicodedata.combining(char))
+    return _NON_ALPHANUMERIC.sub(' ', text.casefold()).strip()
+
+
+def create_song_index_tables(cursor):
+    """Creates the song_keys and songs_fts tables if they don't exist."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS song_keys (
+            key TEXT NOT NULL,
+            song_id TEXT NOT NULL,
+            kind INTEGER NOT NULL,
+            artist_key TEXT NOT NULL,
+            popularity REAL NOT NULL
+        )
+    ''')
+    # Covering index: keys are resolved without reading the table
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_song_keys_key
+        ON song_keys (key, kind, artist_key, popularity, song_id)
+    ''')
+    # External content table: the text is read from songs, only the index is stored
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS songs_fts USING fts5(
+            title, artist, content='songs', tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+
+
+def rebuild_song_index(conn):
+    """
+    Rebuilds the keys (with the current popularity of their songs) and the full-text
+    index from the songs table, after it changed. Doesn't commit: the caller commits
+    them with the change of the songs.
+
+    Returns:
+        int: Number of keys written.
+    """
+    conn.create_function('normalize_text', 1, normalize, deterministic=True)
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM song_keys")
+    cursor.execute('''
+        WITH normalized AS MATERIALIZED (
+            SELECT s.song_id, normalize_text(s.title) AS title, normalize_text(s.artist) AS artist,
+                   COALESCE(p.score, 0) AS popularity
+            FROM songs s LEFT JOIN song_popularity p ON p.song_id = s.song_id
+        )
+        INSERT INTO song_keys (key, song_id, kind, artist_key, popularity)
+        SELECT title, song_id, ?, ' ' || artist || ' ', popularity
+        FROM normalized WHERE title != ''
+        UNION ALL
+        SELECT title || ' ' || artist, song_id, ?, ' ' || artist || ' ', popularity
+        FROM normalized WHERE title != '' AND artist != ''
+        UNION ALL
+        SELECT artist || ' ' || title, song_id, ?, ' ' || artist || ' ', popularity
+        FROM normalized WHERE title != '' AND artist != ''
+    ''', (TITLE_KEY, TITLE_ARTIST_KEY, TITLE_ARTIST_KEY))
+    n_keys = cursor.execute("SELECT COUNT(*) FROM song_keys").fetchone()[0]
+    cursor.execute("INSERT INTO songs_fts (songs_fts) VALUES ('rebuild')")
+    return n_keys
+
+
+def resolve_song(cursor, reference):
+    """
+    Resolves a free-text song reference to a song ID.
+
+    Args:
+        cursor (sqlite3.Cursor): Database cursor
+        reference (str): Title, "Title - Artist", ... sent by the client
+
+    Returns:
+        tuple: (song_id, stage), with the stage ('exact', 'contained' or 'tokens') that
+               matched, or (None, None) if no song matches
+    """
+    words = normalize(reference).split()
+    if not words:
+        return None, None
+
+    song_id = _best_key_match(cursor, [' '.join(words)])
+    if song_id:
+        return song_id, 'exact'
+
+    words = words[:MAX_REFERENCE_WORDS]
+    runs = {
+        ' '.join(words[start:end])
+        for start in range(len(words))
+        for end in range(start + 1, len(words) + 1)
+    }
+    song_id = _best_key_match(cursor, sorted(runs))
+    if song_id:
+        return song_id, 'contained'
+
+    phrases = [f'"{word}"' for word in words]
+    cursor.execute('''
+        SELECT s.song_id FROM songs_fts
+        JOIN songs s ON s.rowid = songs_fts.rowid
+        LEFT JOIN song_popularity p ON p.song_id = s.song_id
+        WHERE songs_fts MATCH ?
+        ORDER BY bm25(songs_fts), COALESCE(p.score, 0) DESC, s.song_id
+        LIMIT 1
+    ''', (f"{' '.join(phrases)} AND title : ({' OR '.join(phrases)})",))
+    row = cursor.fetchone()
+    if row:
+        return row[0], 'tokens'
+    return None, None
+
+
+def _best_key_match(cursor, keys):
+    """Best song among the ones with one of `keys`, see the module docstring for the order."""
+    placeholders = ', '.join('?' * len(keys))
+    ranking = "ORDER BY key_length DESC, popularity DESC, song_id LIMIT 1"
+    # Title and artist keys, and title keys whose artist is elsewhere in the reference
+    cursor.execute(f'''
+        SELECT song_id, length(key) AS key_length, popularity FROM song_keys
+        WHERE key IN ({placeholders}) AND kind = ?
+        UNION ALL
+        SELECT song_id, length(key) AS key_length, popularity FROM song_keys
+        WHERE key IN ({placeholders}) AND kind = ? AND artist_key IN ({placeholders})
+        {ranking}
+    ''', (*keys, TITLE_ARTIST_KEY, *keys, TITLE_KEY, *[f" {key} " for key in keys]))
+    row = cursor.fetchone()
+    if row is None:
+        cursor.execute(f'''
+            SELECT song_id, length(key) AS key_length, popularity FROM song_keys
+            WHERE key IN ({placeholders}) AND kind = ?
+            {ranking}
+        ''', (*keys, TITLE_KEY))
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+if __name__ == '__main__':
+    import time
+    from db import DB_NAME, connect
+    from popularity import create_popularity_table
+
+    parser = argparse.ArgumentParser(description="Rebuild the song title indexes, then resolve references.")
+    parser.add_argument('--db', default=DB_NAME, help="Path of the SQLite database")
+    parser.add_argument('references', nargs='*', help="Song references to resolve")
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    create_popularity_table(conn.cursor())
+    create_song_index_tables(conn.cursor())
+    start = time.perf_counter()
+    n_keys = rebuild_song_index(conn)
+    conn.commit()
+    print(f"[FEEDBACK] Indexed {n_keys} song title keys in {time.perf_counter() - start:.1f}s")
+    for reference in args.references:
+        song_id, stage = resolve_song(conn.cursor(), reference)
+        print(f"{reference!r}: {song_id} ({stage})")
+    conn.close()
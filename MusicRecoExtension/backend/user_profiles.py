@@ -0,0 +1,245 @@
+"""
+Per-User Content Profiles
+
+Persists, for each user, the running weighted sum of the embeddings of the songs in
+their listening history and its total weight, so that the content-based user
+embedding (their weighted mean) is read in O(dim) instead of being recomputed from the
+whole history on every request.
+
+Profiles are updated in place by each feedback, and tagged with the version of the
+embedding store they were computed with: a stale or missing profile is rebuilt from the
+history when the user is next recommended to, or in bulk with:
+
+    python user_profiles.py [--db music_reco.db]
+"""
+
+import argparse
+import os
+import numpy as np
+from scipy import sparse
+
+# History rows per batch of the bulk rebuild (the profiles of a batch are held in memory)
+REBUILD_BATCH_ROWS = 50_000
+# `play_weight` of the listening_history rows, in SQL
+PLAY_WEIGHT_SQL = "COALESCE(NULLIF(listening_time, 0), 1)"
+
+
+def create_profile_table(cursor):
+    """Creates the user_profiles table if it doesn't exist."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_profiles (
+            user_id TEXT PRIMARY KEY,
+            weighted_sum BLOB NOT NULL,
+            total_weight REAL NOT NULL,
+            n_songs INTEGER NOT NULL,
+            store_version TEXT NOT NULL
+        )
+    ''')
+
+
+def store_version(recommender):
+    """
+    Identifies the embeddings of a recommender: profiles computed with other embeddings
+    (regenerated or extended store) are stale.
+    """
+    store = recommender.store
+    if not store.path or not os.path.exists(store.path):
+        return f"{len(store)}:memory"
+    return f"{len(store)}:{os.stat(store.path).st_mtime_ns}"
+
+
+def play_weight(listening_time):
+    """Weight of a history entry in its user's profile: missing (or zero) engagement
+    scores count as a single play (PLAY_WEIGHT_SQL in queries)."""
+    return listening_time or 1
+
+
+def get_user_profile(conn, recommender, user_id):
+    """
+    Reads the profile of a user, rebuilding it from their history if missing or stale.
+
+    Args:
+        conn (sqlite3.Connection): Database connection
+        recommender (ContentBasedRecommender): Loaded recommender instance
+        user_id (str): User identifier
+
+    Returns:
+        tuple: (user_embedding, n_songs), the float32 weighted mean embedding (None if no
+               song of the history has an embedding) and the number of songs in the history.
+    """
+    version = store_version(recommender)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT weighted_sum, total_weight, n_songs FROM user_profiles
+        WHERE user_id = ? AND store_version = ?
+    ''', (user_id, version))
+    row = cursor.fetchone()
+
+    if row is None:
+        print(f"[PROFILES] Building content profile of user {user_id} from their history")
+        # Take the write lock before reading the history, as feedback does, so that no
+        # feedback is recorded between this read and the save of the profile (its
+        # update would find no profile to update, and be missing from the saved one)
+        if not conn.in_transaction:
+            cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(f'''
+            SELECT user_id, song_id, {PLAY_WEIGHT_SQL}
+            FROM listening_history WHERE user_id = ?
+        ''', (user_id,))
+        profiles = _compute_profiles(recommender, cursor.fetchall())
+        if not profiles:
+            conn.commit()
+            return None, 0
+        _save_profiles(conn, profiles, version)
+        conn.commit()
+        row = profiles[0][1:]
+
+    weighted_sum, total_weight, n_songs = row
+    if total_weight == 0:
+        return None, n_songs
+    weighted_sum = np.frombuffer(weighted_sum, dtype=np.float64)
+    return (weighted_sum / total_weight).astype(np.float32), n_songs
+
+
+def update_user_profile(conn, recommender, user_id, song_id, previous_time, listening_time):
+    """
+    Applies a change of a listening history entry to the user's profile, in O(dim).
+
+    Must run in the transaction that changes the history (after its write lock is
+    taken), so that concurrent feedbacks cannot interleave. Missing or stale profiles
+    are left to be rebuilt when read; without a recommender, the profile is dropped.
+
+    Args:
+        conn (sqlite3.Connection): Database connection
+        recommender (ContentBasedRecommender): Loaded recommender instance, or None
+        user_id (str): User identifier
+        song_id (str): Song of the history entry
+        previous_time (int): Listening time before the change, None for a new entry
+        listening_time (int): Listening time after the change
+    """
+    cursor = conn.cursor()
+    if recommender is None:
+        cursor.execute("DELETE FROM user_profiles WHERE user_id = ?", (user_id,))
+        return
+
+    version = store_version(recommender)
+    cursor.execute('''
+        SELECT weighted_sum, total_weight, n_songs FROM user_profiles
+        WHERE user_id = ? AND store_version = ?
+    ''', (user_id, version))
+    row = cursor.fetchone()
+    if row is None:
+        return
+
+    weighted_sum = np.frombuffer(row[0], dtype=np.float64).copy()
+    total_weight, n_songs = row[1], row[2]
+    if previous_time is None:
+        n_songs += 1
+
+    song_row = recommender.store.row(song_id)
+    if song_row >= 0:
+        delta = play_weight(listening_time) - (0 if previous_time is None else play_weight(previous_time))
+        weighted_sum += delta * recommender.embedding_matrix[song_row]
+        total_weight += delta
+
+    cursor.execute('''
+        UPDATE user_profiles SET weighted_sum = ?, total_weight = ?, n_songs = ?
+        WHERE user_id = ?
+    ''', (weighted_sum.tobytes(), total_weight, n_songs, user_id))
+
+
+def rebuild_user_profiles(conn, recommender):
+    """
+    Recomputes the profiles of all users from the listening history, in bulk (one sparse
+    product with the embedding matrix per batch of users), e.g. after the embedding
+    store was regenerated or the history imported. Doesn't commit: the caller commits
+    them with the change of the history.
+
+    Returns:
+        int: Number of profiles written.
+    """
+    version = store_version(recommender)
+    read_cursor = conn.cursor()
+    # Write lock first, for the same reason as in `get_user_profile`
+    if not conn.in_transaction:
+        read_cursor.execute("BEGIN IMMEDIATE")
+    read_cursor.execute(f'''
+        SELECT user_id, song_id, {PLAY_WEIGHT_SQL}
+        FROM listening_history ORDER BY user_id
+    ''')
+    conn.execute("DELETE FROM user_profiles")
+
+    n_profiles = 0
+    pending = []
+    while True:
+        rows = read_cursor.fetchmany(REBUILD_BATCH_ROWS)
+        batch = pending + rows
+        if rows:
+            # The last user may continue in the next batch
+            last_user = batch[-1][0]
+            split = len(batch)
+            while split > 0 and batch[split - 1][0] == last_user:
+                split -= 1
+            if split == 0:
+                pending = batch
+                continue
+            batch, pending = batch[:split], batch[split:]
+
+        profiles = _compute_profiles(recommender, batch)
+        _save_profiles(conn, profiles, version)
+        n_profiles += len(profiles)
+        if not rows:
+            break
+
+    return n_profiles
+
+
+def _compute_profiles(recommender, history_rows):
+    """(user_id, weighted_sum, total_weight, n_songs) of the users of (user_id, song_id, weight) rows."""
+    if not history_rows:
+        return []
+
+    user_ids, song_ids, weights = zip(*history_rows)
+    users, user_index = np.unique(np.array(user_ids, dtype=object).astype(str), return_inverse=True)
+    rows = recommender.store.rows(np.array([song_id or '' for song_id in song_ids], dtype=str))
+    weights = np.asarray(weights, dtype=np.float64)
+
+    known = rows >= 0
+    histories = sparse.csr_matrix(
+        (weights[known], (user_index[known], rows[known])),
+        shape=(len(users), len(recommender.embedding_matrix))
+    )
+    weighted_sums = np.asarray(histories @ recommender.embedding_matrix, dtype=np.float64)
+    total_weights = np.bincount(user_index[known], weights=weights[known], minlength=len(users))
+    n_songs = np.bincount(user_index, minlength=len(users))
+
+    return [
+        (user_id, weighted_sum.tobytes(), float(total_weight), int(count))
+        for user_id, weighted_sum, total_weight, count in zip(users, weighted_sums, total_weights, n_songs)
+    ]
+
+
+def _save_profiles(conn, profiles, version):
+    conn.executemany('''
+        INSERT OR REPLACE INTO user_profiles (user_id, weighted_sum, total_weight, n_songs, store_version)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(*profile, version) for profile in profiles])
+
+
+if __name__ == '__main__':
+    import time
+    from content_recommender_utils import load_content_recommender
+    from db import DB_NAME, connect
+
+    parser = argparse.ArgumentParser(description="Rebuild the content profiles of all users.")
+    parser.add_argument('--db', default=DB_NAME, help="Path of the SQLite database")
+    args = parser.parse_args()
+
+    recommender = load_content_recommender()
+    conn = connect(args.db)
+    create_profile_table(conn.cursor())
+    start = time.perf_counter()
+    n_profiles = rebuild_user_profiles(conn, recommender)
+    conn.commit()
+    conn.close()
+    print(f"[PROFILES] Rebuilt {n_profiles} user profiles in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,139 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from .model import Model
+from .train import LearningStats, evaluate, print_throughput
+
+
+def train_als(
+    l: int,
+    lbd: float,
+    n_epochs: int,
+    train_set: np.ndarray,
+    validation_set: np.ndarray,
+    model: Model,
+    n_workers: int | None = None,
+    chunk_size: int = 1024,
+) -> tuple[Model, LearningStats]:
+    """
+    Alternating least squares: each epoch solves every user row of p (with b_user)
+    given q and b_song, then every song row of q (with b_song) given p and b_user.
+
+    It minimizes the same regularized loss as `train.train`, hence the regularization
+    of a row is scaled by its number of listenings. Row solves are spread over a
+    thread pool of `n_workers` threads, `chunk_size` rows at a time.
+    """
+    (q, p, b_song, b_user) = model
+    n_workers = n_workers or os.cpu_count() or 1
+
+    learning_stats: LearningStats = {
+        "losses_train": [np.nan] * n_epochs,
+        "losses_validation": [np.nan] * n_epochs,
+        "accuracy_train": [np.nan] * n_epochs,
+        "accuracy_validation": [np.nan] * n_epochs,
+    }
+
+    print(
+        f"Training (ALS, {n_workers} workers) with l={l}, lambda={lbd} for {n_epochs} epochs."
+    )
+
+    average_listening_count = train_set["Listening count"].mean()
+
+    # Shape: (#USERS, #SONGS), rows are users
+    by_user = csr_matrix(
+        (
+            train_set["Listening count"],
+            (train_set["User index"], train_set["Song index"]),
+        ),
+        shape=(len(p), len(q)),
+    )
+    # Same matrix, compressed by song
+    by_song = by_user.tocsc()
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        for epoch in range(n_epochs):
+            print(f"Epoch {epoch+1}")
+            epoch_start = time.perf_counter()
+
+            _solve_side(
+                executor,
+                by_user,
+                by_user.data - average_listening_count - b_song[by_user.indices],
+                q,
+                p,
+                b_user,
+                lbd,
+                chunk_size,
+            )
+            _solve_side(
+                executor,
+                by_song,
+                by_song.data - average_listening_count - b_user[by_song.indices],
+                p,
+                q,
+                b_song,
+                lbd,
+                chunk_size,
+            )
+
+            print_throughput(len(train_set), time.perf_counter() - epoch_start)
+
+            for name, dataset in (("train", train_set), ("validation", validation_set)):
+                loss_sum, squared_error_sum = evaluate(
+                    (q, p, b_song, b_user), average_listening_count, lbd, dataset
+                )
+                learning_stats[f"losses_{name}"][epoch] = loss_sum
+                learning_stats[f"accuracy_{name}"][epoch] = np.sqrt(
+                    squared_error_sum / len(dataset)
+                )
+
+            print(
+                f"Loss (train): {learning_stats['losses_train'][epoch]}, loss (validation): {learning_stats['losses_validation'][epoch]}"
+            )
+            print(
+                f"Accuracy (train): {learning_stats['accuracy_train'][epoch]}, Accuracy (validation): {learning_stats['accuracy_validation'][epoch]}"
+            )
+
+    return (q, p, b_song, b_user), learning_stats
+
+
+def _solve_side(
+    executor: ThreadPoolExecutor,
+    matrix,
+    targets: np.ndarray,
+    fixed: np.ndarray,
+    solved: np.ndarray,
+    solved_bias: np.ndarray,
+    lbd: float,
+    chunk_size: int,
+):
+    """
+    Solves in place every row of `solved` (and `solved_bias`), `fixed` being the
+    factors of the other side. `matrix` is compressed along the solved side (CSR
+    for users, CSC for songs) and `targets` follows its data layout.
+    """
+    # A constant 1 column makes the bias part of the solution
+    fixed_with_bias = np.hstack((fixed, np.ones((len(fixed), 1))))
+
+    def solve_chunk(start: int):
+        rows = range(start, min(start + chunk_size, len(solved)))
+        k = fixed_with_bias.shape[1]
+        gram = np.empty((len(rows), k, k))
+        rhs = np.empty((len(rows), k))
+        for j, row in enumerate(rows):
+            begin, end = matrix.indptr[row], matrix.indptr[row + 1]
+            x = fixed_with_bias[matrix.indices[begin:end]]
+            gram[j] = x.T @ x
+            # Rows without listenings get a zero solution instead of a singular system
+            gram[j].flat[:: k + 1] += lbd * max(end - begin, 1)
+            rhs[j] = x.T @ targets[begin:end]
+
+        solution = np.linalg.solve(gram, rhs[..., np.newaxis])[..., 0]
+        solved[rows.start : rows.stop] = solution[:, :-1]
+        solved_bias[rows.start : rows.stop] = solution[:, -1]
+
+    # Chunks cover disjoint rows, so workers never write to the same memory
+    list(executor.map(solve_chunk, range(0, len(solved), chunk_size)))
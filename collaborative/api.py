@@ -1,97 +1,153 @@
+import threading
 import numpy as np
-from pathlib import Path
-import pickle
 
-from .dataset import load as load_dataset, normalize
-from .model import load as load_model
-from .test_train import DATASET_SIZE, l
-
-# Should load full dataset!
-dataset, USER_MAPPING, SONG_MAPPING = load_dataset(DATASET_SIZE)
-average_listening_count = dataset["Listening count"].mean()
-dataset = normalize(dataset)
+from . import bundle, neighbors
+from .serving import (
+    fold_in_predictions,
+    fold_in_recommendations,
+    nearest_user_predictions,
+    top_n,
+)
+
+# "fold_in" solves the caller's own latent vector, "nearest_user" uses the
+# predictions of the closest training user (scans all of them)
+SERVING_MODE = "fold_in"
+FOLD_IN_LAMBDA = 0.05
+
+# Loaded on first use, see `get_bundle`
+_bundle: bundle.ServingBundle | None = None
+_bundle_lock = threading.Lock()
+
+
+def is_available() -> bool:
+    """
+    Whether the serving bundle has been exported (`python -m collaborative.bundle`).
+    """
+    return (bundle.BUNDLE_PATH / "stats.json").exists()
+
+
+def get_bundle() -> bundle.ServingBundle:
+    global _bundle
+    if _bundle is None:
+        with _bundle_lock:
+            if _bundle is None:
+                _bundle = bundle.load()
+                print("[COLLABORATIVE] Serving bundle loaded")
+    return _bundle
+
+
+def get_recommendations(
+    users_listenings: list[tuple[str, int]], n: int = 5
+) -> list[str]:
+    serving = get_bundle()
+    print(f"[COLLAB_API] Analyzing {len(users_listenings)} input songs")
+    song_indexes, listening_counts = _to_indexes(serving, users_listenings)
 
-#load songs_metadata.pkl
-with open(Path(__file__).parent / "../data/songs_metadata.pkl", "rb") as f:
-    songs_metadata = pickle.load(f)
+    if len(song_indexes) == 0:
+        print("[COLLAB_API] No valid known songs in input")
+        return []
+    
+    print(f"[COLLAB_API] Found {len(song_indexes)} known songs in input")
+
+    if SERVING_MODE == "fold_in":
+        predictions = fold_in_predictions(
+            serving.model,
+            song_indexes,
+            _standardize(serving, listening_counts),
+            FOLD_IN_LAMBDA,
+        )
+    else:
+        predictions = nearest_user_predictions(
+            serving.model,
+            serving.average_listening_count,
+            song_indexes,
+            listening_counts,
+        )
 
-songs_metadata_indices = set((SONG_MAPPING[song_id] for song_id in songs_metadata["song_id"] if song_id in SONG_MAPPING))
+    # Keep the best n songs with metadata that the user has not listened to yet
+    top_songs = top_n(predictions, n, serving.metadata_mask, song_indexes)
+    return serving.song_mapping.ids(top_songs)
+
+
+def get_recommendations_batch(
+    list_of_histories: list[list[tuple[str, int]]], n: int = 5
+) -> list[list[str]]:
+    """
+    `get_recommendations` for several users at once, in the same order. In fold-in
+    mode the users are scored together with one matrix product against q.
+    """
+    if SERVING_MODE != "fold_in":
+        return [get_recommendations(history, n) for history in list_of_histories]
+
+    serving = get_bundle()
+    print(f"[COLLAB_API] Analyzing {len(list_of_histories)} users")
+    histories = [_to_indexes(serving, history) for history in list_of_histories]
+    known_users = [user for user, (song_indexes, _) in enumerate(histories) if len(song_indexes)]
+
+    recommendations = fold_in_recommendations(
+        serving.model,
+        [
+            (histories[user][0], _standardize(serving, histories[user][1]))
+            for user in known_users
+        ],
+        FOLD_IN_LAMBDA,
+        n,
+        serving.metadata_mask,
+    )
 
-print("[COLLABORATIVE] Dataset ready")
+    results: list[list[str]] = [[] for _ in list_of_histories]
+    for user, top_songs in zip(known_users, recommendations):
+        results[user] = serving.song_mapping.ids(top_songs)
+    return results
 
-from pathlib import Path
 
-SONG_MAPPING_REVERT = {
-    song_index: song_id for song_id, song_index in SONG_MAPPING.items()
-}
+def get_similar_songs(song_id: str, n: int = 10) -> list[str]:
+    """
+    The n songs most similar to the given one ("more like this"), from the
+    precomputed neighbor table. Costs O(n).
+    """
+    serving = get_bundle()
+    if serving.neighbors is None:
+        print("[COLLAB_API] No neighbor table, run `python -m collaborative.neighbors`")
+        return []
 
-model_path = Path(__file__).parent / f"model-{DATASET_SIZE}-{l}"
-q, p, b_song, b_user = load_model(str(model_path))
+    song_index = serving.song_mapping.get(song_id)
+    if song_index is None:
+        print(f"[COLLAB_API] Unknown song {song_id}")
+        return []
 
-print("[COLLABORATIVE] Model loaded")
+    similar_songs, _ = neighbors.neighbors(serving.neighbors, song_index, n)
+    return serving.song_mapping.ids(similar_songs)
 
 
-def get_recommendations(users_listenings: list[tuple[str, int]]) -> list[str]:
-    print(f"[COLLAB_API] Analyzing {len(users_listenings)} input songs")
+def _to_indexes(
+    serving: bundle.ServingBundle, users_listenings: list[tuple[str, int]]
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Known songs of the listenings as (song indexes, listening counts), sorted by
+    song index.
+    """
     # User songs as indexes w.r.t. song mapping
+    song_indexes = serving.song_mapping.indexes(
+        [song_id for song_id, _ in users_listenings]
+    )
     user_song_indexes = {
-        SONG_MAPPING[song_id]: listening_count
-        for song_id, listening_count in users_listenings
-        if song_id in SONG_MAPPING
+        int(song_index): listening_count
+        for song_index, (_, listening_count) in zip(song_indexes, users_listenings)
+        if song_index >= 0
     }
 
-    if not user_song_indexes:
-        print("[COLLAB_API] No valid known songs in input")
-        return []
-    
-    print(f"[COLLAB_API] Found {len(user_song_indexes)} known songs in input")
-
-    # Restrict q to songs listened by the given user
-    user_songs_selector = [
-        True if idx in user_song_indexes else False for idx in range(len(q))
-    ]
-    q_user_songs = q[user_songs_selector]
-    b_song_user_songs = b_song[user_songs_selector]
-
-    p_user_songs = (
-        # Shape: (#USERS, len(users_listenings))
-        (p @ q_user_songs.T)
-        + average_listening_count
-        # Shape: (#USERs, 1)
-        + b_user[:, np.newaxis]
-        # Shape: (len(users_listenings))
-        + b_song_user_songs
-    )
-    user_vector = normalize(
-        np.array(
-            [
-                listening_count
-                for _, listening_count in
-                # Sort by song index
-                sorted(user_song_indexes.items(), key=lambda key_value: key_value[0])
-            ],
-            dtype=[("Listening count", np.float64)],
-        )
-    )
-
-    # Similarity (L2) of predictions of given songs for users in the dataset
-    p_user_songs_dist = ((p_user_songs - user_vector["Listening count"]) ** 2).sum(
-        axis=1
+    song_indexes = np.array(sorted(user_song_indexes), dtype=np.int64)
+    listening_counts = np.array(
+        [user_song_indexes[song_index] for song_index in song_indexes], dtype=np.float64
     )
+    return song_indexes, listening_counts
 
-    # Keep the most similar one
-    most_similar_user_index = p_user_songs_dist.argsort()[0]
-
-    # Compute predictions of this most similar user for all songs
-    most_similar_user_predictions = (
-        (p[most_similar_user_index] @ q.T)
-        + average_listening_count
-        + b_user[most_similar_user_index]
-        + b_song
-    )
 
-    # Keep the best 5 songs for this most similar user
-    # Filter predictions to only songs in metadata, then get top 5
-    valid_indices = np.array([idx for idx in range(len(most_similar_user_predictions)) if idx in songs_metadata_indices])
-    top_songs = valid_indices[most_similar_user_predictions[valid_indices].argsort()[-5:][::-1]]
-    return [SONG_MAPPING_REVERT[song] for song in top_songs]
+def _standardize(
+    serving: bundle.ServingBundle, listening_counts: np.ndarray
+) -> np.ndarray:
+    # Standardized the same way as the training set
+    return (
+        listening_counts - serving.average_listening_count
+    ) / serving.listening_count_std
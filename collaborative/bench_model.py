@@ -0,0 +1,93 @@
+import multiprocessing
+import tempfile
+import numpy as np
+
+from .bench_serving import synthetic_history, synthetic_model, N_SONGS
+from .model import load, load_mmap, save, save_mmap
+from .serving import fold_in_predictions, fold_in_recommendations
+
+N_USERS = 1_000_000
+N_WORKERS = 4
+# Accepted differences of float32 recommendations w.r.t. float64 ones
+MAX_SCORE_ERROR = 1e-4
+MIN_TOP_10_OVERLAP = 0.99
+
+
+def memory_kb() -> dict[str, int]:
+    """
+    Resident (Rss) and proportional (Pss, shared pages divided among the processes
+    mapping them) memory of the current process. Linux only.
+    """
+    with open("/proc/self/smaps_rollup") as f:
+        fields = dict(line.split(":", 1) for line in f if ":" in line)
+    return {name: int(fields[name].split()[0]) for name in ("Rss", "Pss")}
+
+
+def serve(args: tuple[str, str, multiprocessing.Barrier]) -> dict[str, int]:
+    """
+    Worker: loads the model, serves a few requests, and reports its memory once all
+    workers are loaded.
+    """
+    prefix, loader, barrier = args
+    model = load_mmap(prefix) if loader == "mmap" else load(prefix)
+    for _ in range(10):
+        song_indexes, listening_counts = synthetic_history()
+        fold_in_predictions(model, song_indexes, listening_counts, 0.05)
+    # Requests read all of q, also touch p and b_user as the nearest-user mode does
+    float(model[1].sum() + model[3].sum())
+    barrier.wait()
+    return memory_kb()
+
+
+def worker_memory(prefix: str, loader: str) -> dict[str, float]:
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager:
+        barrier = manager.Barrier(N_WORKERS)
+        with context.Pool(N_WORKERS) as pool:
+            reports = pool.map(serve, [(prefix, loader, barrier)] * N_WORKERS)
+    return {name: np.mean([report[name] for report in reports]) for name in reports[0]}
+
+
+def tolerance(model64, model32) -> tuple[float, float]:
+    """
+    Max absolute score difference and mean top-10 overlap between the two models.
+    """
+    available = np.ones(N_SONGS, dtype=bool)
+    histories = [synthetic_history() for _ in range(200)]
+    histories = [(song_indexes, (counts - 2.9) / 6.0) for song_indexes, counts in histories]
+
+    max_error = max(
+        np.abs(
+            fold_in_predictions(model64, song_indexes, targets, 0.05)
+            - fold_in_predictions(model32, song_indexes, targets, 0.05)
+        ).max()
+        for song_indexes, targets in histories[:20]
+    )
+    overlaps = [
+        len(np.intersect1d(top64, top32)) / len(top64)
+        for top64, top32 in zip(
+            fold_in_recommendations(model64, histories, 0.05, 10, available),
+            fold_in_recommendations(model32, histories, 0.05, 10, available),
+        )
+    ]
+    return float(max_error), float(np.mean(overlaps))
+
+
+if __name__ == "__main__":
+    np.random.seed(123456)
+    model = synthetic_model(N_SONGS, N_USERS)
+    with tempfile.TemporaryDirectory() as directory:
+        save(f"{directory}/float64", model)
+        save_mmap(f"{directory}/float32", model)
+
+        for loader, prefix in (("np.load float64", "float64"), ("mmap", "float32")):
+            memory = worker_memory(f"{directory}/{prefix}", loader)
+            print(
+                f"{loader:>16}: {N_WORKERS} workers, per worker Rss {memory['Rss'] / 1024:.0f} MiB, Pss {memory['Pss'] / 1024:.0f} MiB"
+            )
+
+        max_error, overlap = tolerance(model, load_mmap(f"{directory}/float32"))
+        print(
+            f"float32 vs float64: max score error {max_error:.2e} (tolerance {MAX_SCORE_ERROR:.0e}), top-10 overlap {overlap:.3f} (tolerance {MIN_TOP_10_OVERLAP})"
+        )
+        assert max_error <= MAX_SCORE_ERROR and overlap >= MIN_TOP_10_OVERLAP
@@ -0,0 +1,98 @@
+import time
+import numpy as np
+
+from .serving import (
+    fold_in_predictions,
+    fold_in_recommendations,
+    nearest_user_predictions,
+    top_n,
+)
+
+N_SONGS = 100_000
+USER_COUNTS = (10_000, 100_000, 500_000)
+HISTORY_LENGTH = 20
+N_CALLS = 50
+BATCH_USERS = 512
+l = 40
+
+
+def synthetic_model(n_songs: int, n_users: int):
+    return (
+        np.random.normal(0, 0.1, (n_songs, l)),
+        np.random.normal(0, 0.1, (n_users, l)),
+        np.random.normal(0, 0.1, n_songs),
+        np.random.normal(0, 0.1, n_users),
+    )
+
+
+def synthetic_history() -> tuple[np.ndarray, np.ndarray]:
+    song_indexes = np.sort(np.random.choice(N_SONGS, HISTORY_LENGTH, replace=False))
+    listening_counts = np.random.geometric(0.3, HISTORY_LENGTH).astype(np.float64)
+    return song_indexes, listening_counts
+
+
+def latencies(predict, n_calls: int = N_CALLS) -> np.ndarray:
+    """
+    Latencies (ms) of `n_calls` calls of `predict` on random histories.
+    """
+    results = np.empty(n_calls)
+    for call in range(n_calls):
+        song_indexes, listening_counts = synthetic_history()
+        start = time.perf_counter()
+        predict(song_indexes, listening_counts)
+        results[call] = (time.perf_counter() - start) * 1000
+    return results
+
+
+def print_latencies(name: str, results: np.ndarray):
+    p50, p99 = np.percentile(results, [50, 99])
+    print(f"{name:>36}: p50 {p50:8.2f} ms, p99 {p99:8.2f} ms")
+
+
+def users_per_second(n_users: int = BATCH_USERS) -> dict[str, float]:
+    """
+    Throughput of the looped single-user fold-in against the batched one.
+    """
+    model = synthetic_model(N_SONGS, 1000)
+    available = np.random.random_sample(N_SONGS) < 0.8
+    histories = [synthetic_history() for _ in range(n_users)]
+    histories = [
+        (song_indexes, (listening_counts - 2.9) / 6.0)
+        for song_indexes, listening_counts in histories
+    ]
+
+    start = time.perf_counter()
+    for song_indexes, targets in histories:
+        top_n(fold_in_predictions(model, song_indexes, targets, 0.05), 10, available, song_indexes)
+    looped = n_users / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    fold_in_recommendations(model, histories, 0.05, 10, available)
+    batched = n_users / (time.perf_counter() - start)
+
+    return {"looped": looped, "batched": batched}
+
+
+if __name__ == "__main__":
+    np.random.seed(123456)
+    for n_users in USER_COUNTS:
+        model = synthetic_model(N_SONGS, n_users)
+        print_latencies(
+            f"nearest user ({n_users} users)",
+            latencies(
+                lambda song_indexes, listening_counts: nearest_user_predictions(
+                    model, 2.9, song_indexes, listening_counts
+                )
+            ),
+        )
+        print_latencies(
+            f"fold-in ({n_users} users)",
+            latencies(
+                lambda song_indexes, listening_counts: fold_in_predictions(
+                    model, song_indexes, (listening_counts - 2.9) / 6.0, 0.05
+                )
+            ),
+        )
+
+    for name, throughput in users_per_second().items():
+        print(f"{name + ' fold-in':>36}: {throughput:8.0f} users/s")
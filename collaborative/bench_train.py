@@ -0,0 +1,77 @@
+import os
+import time
+import numpy as np
+
+from .dataset import normalize
+from .als import train_als
+from .hogwild import train_hogwild
+from .model import init
+from .config import DATASET_SIZE
+from .train import train, train_minibatch
+
+N_USERS = 20_000
+N_SONGS = 10_000
+# Same size as the real training run
+N_TRIPLETS = DATASET_SIZE
+# The per-row path is too slow to run on the whole set
+PER_ROW_TRIPLETS = 20_000
+l = 40
+
+
+def synthetic_dataset(n_triplets: int, n_users: int, n_songs: int) -> np.ndarray:
+    """
+    Random triplets with the same dtype as `dataset.load`, already normalized.
+    """
+    dataset = np.empty(
+        n_triplets,
+        dtype=[
+            ("User index", np.uint32),
+            ("Song index", np.uint32),
+            ("Listening count", np.float64),
+        ],
+    )
+    dataset["User index"] = np.random.randint(0, n_users, n_triplets)
+    dataset["Song index"] = np.random.randint(0, n_songs, n_triplets)
+    dataset["Listening count"] = np.random.geometric(0.3, n_triplets)
+    return normalize(dataset)
+
+
+def throughput(trainer, train_set: np.ndarray, *hyperparameters, **kwargs) -> float:
+    """
+    Triplets per second of a single epoch of `trainer`.
+    """
+    hyperparameters = hyperparameters or (0.001, 0.0005)
+    start = time.perf_counter()
+    trainer(
+        l,
+        *hyperparameters,
+        1,
+        train_set,
+        train_set[:1000],
+        init(N_SONGS, N_USERS),
+        **kwargs,
+    )
+    return len(train_set) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    np.random.seed(123456)
+    dataset = synthetic_dataset(N_TRIPLETS, N_USERS, N_SONGS)
+
+    results = {
+        "per-row": throughput(train, dataset[:PER_ROW_TRIPLETS].copy()),
+    }
+    for batch_size in (256, 4096, 65536):
+        results[f"mini-batch {batch_size}"] = throughput(
+            train_minibatch, dataset.copy(), batch_size=batch_size
+        )
+    results["als"] = throughput(train_als, dataset.copy(), 0.05)
+    # Hogwild scaling, should be close to linear up to the core count
+    for n_workers in sorted({1, 2, 4, os.cpu_count() or 1}):
+        results[f"hogwild {n_workers} workers"] = throughput(
+            train_hogwild, dataset.copy(), n_workers=n_workers
+        )
+
+    print()
+    for name, triplets_per_second in results.items():
+        print(f"{name:>20}: {triplets_per_second:>12.0f} triplets/s")
@@ -0,0 +1,96 @@
+import json
+import pickle
+import shutil
+from pathlib import Path
+from typing import NamedTuple
+import numpy as np
+
+from . import neighbors
+from .config import DATASET_SIZE, l
+from .model import Model, load as load_model, load_mmap, save_mmap
+from .vocabulary import Vocabulary
+
+MODEL_PATH = Path(__file__).parent / f"model-{DATASET_SIZE}-{l}"
+METADATA_PATH = Path(__file__).parent / "../data/songs_metadata.pkl"
+BUNDLE_PATH = Path(__file__).parent / f"serving-{DATASET_SIZE}-{l}"
+
+
+class ServingBundle(NamedTuple):
+    """
+    Everything `api` needs to serve recommendations, without the training data.
+    """
+
+    model: Model
+    song_mapping: Vocabulary
+    # Shape: (#SONGS), whether a song can be recommended (has metadata)
+    metadata_mask: np.ndarray
+    # Statistics of the raw listening counts used to standardize the training set
+    average_listening_count: float
+    listening_count_std: float
+    # Item-to-item table, computed separately by `python -m collaborative.neighbors`
+    neighbors: neighbors.NeighborTable | None
+
+
+def export(
+    path: Path = BUNDLE_PATH,
+    model_path: Path = MODEL_PATH,
+    dataset_size: int = DATASET_SIZE,
+):
+    """
+    Writes the serving bundle of a trained model into the `path` directory.
+    """
+    # Not at module level: serving imports this module without the training stack
+    from .dataset import load as load_dataset
+
+    dataset, _, SONG_MAPPING = load_dataset(dataset_size)
+    average_listening_count = float(dataset["Listening count"].mean())
+    listening_count_std = float(dataset["Listening count"].std())
+    del dataset
+
+    with open(METADATA_PATH, "rb") as f:
+        songs_metadata = pickle.load(f)
+    metadata_mask = np.zeros(len(SONG_MAPPING), dtype=bool)
+    songs_metadata_indices = SONG_MAPPING.indexes(songs_metadata["song_id"])
+    metadata_mask[songs_metadata_indices[songs_metadata_indices >= 0]] = True
+    del songs_metadata
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+
+    save_mmap(str(tmp_path / "model"), load_model(str(model_path)))
+    SONG_MAPPING.save(str(tmp_path / "songs"))
+    np.save(tmp_path / "metadata_mask.npy", metadata_mask)
+    with open(tmp_path / "stats.json", "w") as f:
+        json.dump(
+            {
+                "average_listening_count": average_listening_count,
+                "listening_count_std": listening_count_std,
+            },
+            f,
+        )
+
+    shutil.rmtree(path, ignore_errors=True)
+    tmp_path.rename(path)
+    print(f"Serving bundle exported to {path}")
+
+
+def load(path: Path = BUNDLE_PATH) -> ServingBundle:
+    with open(path / "stats.json") as f:
+        stats = json.load(f)
+    return ServingBundle(
+        model=load_mmap(str(path / "model")),
+        song_mapping=Vocabulary.load(str(path / "songs")),
+        metadata_mask=np.load(path / "metadata_mask.npy"),
+        average_listening_count=stats["average_listening_count"],
+        listening_count_std=stats["listening_count_std"],
+        neighbors=(
+            neighbors.load(str(path / "neighbors"))
+            if neighbors.exists(str(path / "neighbors"))
+            else None
+        ),
+    )
+
+
+if __name__ == "__main__":
+    export()
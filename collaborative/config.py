@@ -0,0 +1,3 @@
+# Training set and model shared by training (`test_train`) and serving (`bundle`)
+DATASET_SIZE = 4_000_000
+l = 40
@@ -1,42 +1,56 @@
+import json
+import os
+import shutil
 from pathlib import Path
 import numpy as np
+import pandas as pd
 
+from .vocabulary import Vocabulary
 
-def load(max_size: int) -> tuple[np.ndarray, dict[str, int], dict[str, int]]:
+SOURCE_PATH = (Path(__file__).parent / "../train_triplets.txt").resolve()
+# Binary cache of the source, see `convert`
+CACHE_PATH = (Path(__file__).parent / "../train_triplets_cache").resolve()
+
+# It's a list of tuples (user, song, listening count)
+dataset_triplet_dtype = np.dtype(
+    [
+        ("User index", np.uint32),
+        ("Song index", np.uint32),
+        ("Listening count", np.float64),
+    ]
+)
+
+
+def load(max_size: int) -> tuple[np.ndarray, Vocabulary, Vocabulary]:
     """
     Loads the max_size first triplets of `../train_triplets`.
+
+    Triplets are read from the binary cache, which is (re)built first if it is
+    missing or older than the text file. The returned dataset is a copy-on-write
+    memory map: nothing is read until used, and in place changes (`normalize`,
+    shuffling) stay private to the process.
     """
-    # Maps users and songs to their unique index for further referencing as matrix index
-    USER_MAPPING: dict[str, int] = {}
-    SONG_MAPPING: dict[str, int] = {}
+    if _is_stale():
+        convert()
 
-    # It's a list of tuples (user, song, listening count)
-    dataset_triplet_dtype = np.dtype(
-        [
-            ("User index", np.uint32),
-            ("Song index", np.uint32),
-            ("Listening count", np.float64),
-        ]
+    with open(CACHE_PATH / "meta.json") as f:
+        n_triplets = json.load(f)["n_triplets"]
+    dataset = np.memmap(
+        CACHE_PATH / "triplets.bin",
+        dtype=dataset_triplet_dtype,
+        mode="c",
+        shape=(n_triplets,),
+    )[:max_size].view(np.ndarray)
+
+    # Maps users and songs to their unique index for further referencing as matrix index.
+    # Indexes are given by order of first appearance, so the users and songs of the
+    # first triplets are the first ones of the vocabularies.
+    USER_MAPPING = Vocabulary.load(
+        str(CACHE_PATH / "users"), _n_indexes(dataset["User index"])
+    )
+    SONG_MAPPING = Vocabulary.load(
+        str(CACHE_PATH / "songs"), _n_indexes(dataset["Song index"])
     )
-    dataset_raw: list[tuple[int, int, int]] = []
-    with open(
-        (Path(__file__).parent / "../train_triplets.txt").resolve(), "r"
-    ) as dataset_file:
-        for line in dataset_file:
-            user_id, song_id, listening_count = line.split("\t")
-
-            dataset_raw.append(
-                (
-                    USER_MAPPING.setdefault(user_id, len(USER_MAPPING)),
-                    SONG_MAPPING.setdefault(song_id, len(SONG_MAPPING)),
-                    int(listening_count),
-                )
-            )
-
-            if len(dataset_raw) >= max_size:
-                break
-
-    dataset = np.array(dataset_raw, dtype=dataset_triplet_dtype)
 
     # print(
     #     f"Parsed {len(SONG_MAPPING)} and {len(USER_MAPPING)} users, for a total of {len(dataset)} triplets."
@@ -45,6 +59,93 @@ def load(max_size: int) -> tuple[np.ndarray, dict[str, int], dict[str, int]]:
     return (dataset, USER_MAPPING, SONG_MAPPING)
 
 
+def convert(chunk_size: int = 5_000_000):
+    """
+    Parses `../train_triplets.txt` into `../train_triplets_cache/`:
+    - `triplets.bin`: raw records of `dataset_triplet_dtype`
+    - `users_*.npy` and `songs_*.npy`: `Vocabulary` of the users and songs
+    - `meta.json`: number of triplets, and size & modification time of the source
+      to detect changes
+
+    The source is read `chunk_size` lines at a time so memory stays bounded.
+    """
+    print(f"Converting {SOURCE_PATH} to {CACHE_PATH}...")
+    USER_MAPPING: dict[str, int] = {}
+    SONG_MAPPING: dict[str, int] = {}
+
+    tmp_path = CACHE_PATH.with_name(CACHE_PATH.name + ".tmp")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+
+    source_stat = os.stat(SOURCE_PATH)
+    n_triplets = 0
+    with open(tmp_path / "triplets.bin", "wb") as triplets_file:
+        for chunk in pd.read_csv(
+            SOURCE_PATH,
+            sep="\t",
+            header=None,
+            names=["user_id", "song_id", "listening_count"],
+            dtype={"user_id": str, "song_id": str, "listening_count": np.int64},
+            chunksize=chunk_size,
+        ):
+            records = np.empty(len(chunk), dtype=dataset_triplet_dtype)
+            records["User index"] = _index(chunk["user_id"], USER_MAPPING)
+            records["Song index"] = _index(chunk["song_id"], SONG_MAPPING)
+            records["Listening count"] = chunk["listening_count"]
+            records.tofile(triplets_file)
+            n_triplets += len(records)
+
+    Vocabulary.from_ids(USER_MAPPING).save(str(tmp_path / "users"))
+    Vocabulary.from_ids(SONG_MAPPING).save(str(tmp_path / "songs"))
+    with open(tmp_path / "meta.json", "w") as f:
+        json.dump(
+            {
+                "n_triplets": n_triplets,
+                "source_size": source_stat.st_size,
+                "source_mtime_ns": source_stat.st_mtime_ns,
+            },
+            f,
+        )
+
+    shutil.rmtree(CACHE_PATH, ignore_errors=True)
+    tmp_path.rename(CACHE_PATH)
+    print(f"Converted {n_triplets} triplets.")
+
+
+def _index(ids: pd.Series, mapping: dict[str, int]) -> np.ndarray:
+    """
+    Indexes of the given IDs, new IDs being added to the mapping by order of first
+    appearance.
+    """
+    codes, uniques = pd.factorize(ids)
+    return np.array(
+        [mapping.setdefault(unique, len(mapping)) for unique in uniques], dtype=np.uint32
+    )[codes]
+
+
+def _n_indexes(indexes: np.ndarray) -> int:
+    return int(indexes.max()) + 1 if len(indexes) else 0
+
+
+def _is_stale() -> bool:
+    """
+    Whether the cache is missing, or built from another version of the source. A
+    cache without its source is still used.
+    """
+    try:
+        with open(CACHE_PATH / "meta.json") as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        return True
+    if not SOURCE_PATH.exists():
+        return False
+    source_stat = os.stat(SOURCE_PATH)
+    return (meta["source_size"], meta["source_mtime_ns"]) != (
+        source_stat.st_size,
+        source_stat.st_mtime_ns,
+    )
+
+
 def normalize(dataset: np.ndarray) -> np.ndarray:
     """
     Modifies the dataset in place (and returns it too).
@@ -57,3 +158,7 @@ def normalize(dataset: np.ndarray) -> np.ndarray:
     # print(dataset["Listening count"])
 
     return dataset
+
+
+if __name__ == "__main__":
+    convert()
@@ -0,0 +1,142 @@
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+import os
+import time
+import numpy as np
+
+from .model import Model
+from .train import LearningStats, evaluate, print_throughput, sgd_step
+
+# Views over the shared memory, set up in each worker by `_attach`
+_shared: dict[str, np.ndarray] = {}
+_blocks: list[SharedMemory] = []
+
+
+def train_hogwild(
+    l: int,
+    lbd: float,
+    gamma: float,
+    n_epochs: int,
+    train_set: np.ndarray,
+    validation_set: np.ndarray,
+    model: Model,
+    n_workers: int | None = None,
+    batch_size: int = 256,
+) -> tuple[Model, LearningStats]:
+    """
+    Hogwild! SGD: `n_workers` processes each run `train.sgd_step` over their own
+    shard of the shuffled training set, updating q, p, b_song and b_user in shared
+    memory without any lock. Racy updates are rare on sparse listening data and do
+    not hurt convergence.
+
+    See https://arxiv.org/abs/1106.5730.
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+
+    learning_stats: LearningStats = {
+        "losses_train": [np.nan] * n_epochs,
+        "losses_validation": [np.nan] * n_epochs,
+        "accuracy_train": [np.nan] * n_epochs,
+        "accuracy_validation": [np.nan] * n_epochs,
+    }
+
+    print(
+        f"Training (Hogwild, {n_workers} workers) with l={l}, lambda={lbd}, gamma={gamma} for {n_epochs} epochs."
+    )
+
+    average_listening_count = train_set["Listening count"].mean()
+
+    arrays = dict(zip(("q", "p", "b_song", "b_user"), model), train_set=train_set)
+    blocks = {name: SharedMemory(create=True, size=array.nbytes) for name, array in arrays.items()}
+    layouts = {
+        name: (blocks[name].name, array.shape, array.dtype) for name, array in arrays.items()
+    }
+    try:
+        shared = {
+            name: np.ndarray(array.shape, array.dtype, buffer=blocks[name].buf)
+            for name, array in arrays.items()
+        }
+        for name, array in arrays.items():
+            shared[name][...] = array
+        shared_model = (shared["q"], shared["p"], shared["b_song"], shared["b_user"])
+        shards = np.linspace(0, len(train_set), n_workers + 1, dtype=np.int64)
+
+        with Pool(n_workers, initializer=_attach, initargs=(layouts,)) as pool:
+            for epoch in range(n_epochs):
+                print(f"Epoch {epoch+1}")
+                epoch_start = time.perf_counter()
+
+                np.random.shuffle(shared["train_set"])  # Reorder each epoch
+                shard_sums = pool.starmap(
+                    _train_shard,
+                    [
+                        (start, stop, average_listening_count, lbd, gamma, batch_size)
+                        for start, stop in zip(shards[:-1], shards[1:])
+                    ],
+                )
+                loss_sum, accuracy_sum = np.sum(shard_sums, axis=0)
+
+                print_throughput(len(train_set), time.perf_counter() - epoch_start)
+
+                learning_stats["losses_train"][epoch] = loss_sum
+                learning_stats["accuracy_train"][epoch] = np.sqrt(
+                    accuracy_sum / len(train_set)
+                )
+
+                loss_validation_sum, accuracy_validation_sum = evaluate(
+                    shared_model, average_listening_count, lbd, validation_set
+                )
+                learning_stats["losses_validation"][epoch] = loss_validation_sum
+                learning_stats["accuracy_validation"][epoch] = np.sqrt(
+                    accuracy_validation_sum / len(validation_set)
+                )
+
+                print(
+                    f"Loss (train): {learning_stats['losses_train'][epoch]}, loss (validation): {learning_stats['losses_validation'][epoch]}"
+                )
+                print(
+                    f"Accuracy (train): {learning_stats['accuracy_train'][epoch]}, Accuracy (validation): {learning_stats['accuracy_validation'][epoch]}"
+                )
+
+        # Copy back, like the other trainers that update the given model in place
+        for name, array in arrays.items():
+            array[...] = shared[name]
+        del shared, shared_model
+    finally:
+        for block in blocks.values():
+            block.close()
+            block.unlink()
+
+    return model, learning_stats
+
+
+def _attach(layouts: dict[str, tuple[str, tuple[int, ...], np.dtype]]):
+    for name, (block_name, shape, dtype) in layouts.items():
+        block = SharedMemory(name=block_name)
+        # Keep a reference, the views are invalid once the block is garbage collected
+        _blocks.append(block)
+        _shared[name] = np.ndarray(shape, dtype, buffer=block.buf)
+
+
+def _train_shard(
+    start: int,
+    stop: int,
+    average_listening_count: float,
+    lbd: float,
+    gamma: float,
+    batch_size: int,
+) -> tuple[float, float]:
+    model = (_shared["q"], _shared["p"], _shared["b_song"], _shared["b_user"])
+    loss_sum: float = 0
+    accuracy_sum: float = 0
+    for batch_start in range(start, stop, batch_size):
+        batch_loss, batch_accuracy = sgd_step(
+            model,
+            average_listening_count,
+            lbd,
+            gamma,
+            _shared["train_set"][batch_start : min(batch_start + batch_size, stop)],
+        )
+        loss_sum += batch_loss
+        accuracy_sum += batch_accuracy
+    return loss_sum, accuracy_sum
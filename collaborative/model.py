@@ -1,14 +1,20 @@
+import json
 from typing import Any
 import numpy as np
 
 # Model is a tuple (q,p,b_song,b_user) of shapes (#SONGS, l), (#USERS, l) and (#SONGS), (#USERS)
+# Training uses float64, serving float32 (see `save_mmap`)
 Model = tuple[
-    np.ndarray[tuple[Any, ...], np.dtype[np.float64]],
-    np.ndarray[tuple[Any, ...], np.dtype[np.float64]],
-    np.ndarray[tuple[Any, ...], np.dtype[np.float64]],
-    np.ndarray[tuple[Any, ...], np.dtype[np.float64]],
+    np.ndarray[tuple[Any, ...], np.dtype[np.floating[Any]]],
+    np.ndarray[tuple[Any, ...], np.dtype[np.floating[Any]]],
+    np.ndarray[tuple[Any, ...], np.dtype[np.floating[Any]]],
+    np.ndarray[tuple[Any, ...], np.dtype[np.floating[Any]]],
 ]
 
+# Version of the format written by `save_mmap`
+MMAP_FORMAT_VERSION = 1
+MODEL_ARRAYS = ("q", "p", "b_song", "b_user")
+
 
 def init(n_songs: int, n_users: int) -> Model:
     l = 100
@@ -38,3 +44,54 @@ def load(prefix: str) -> Model:
     b_user = np.load(prefix + "_b_user.npy")
 
     return (q, p, b_song, b_user)
+
+
+def save_mmap(prefix: str, model: Model):
+    """
+    Saves the model as float32 arrays, with a `_header.json` describing them, to be
+    opened by `load_mmap`.
+    """
+    q, p, b_song, b_user = model
+    header = {
+        "version": MMAP_FORMAT_VERSION,
+        "dtype": "float32",
+        "n_songs": len(q),
+        "n_users": len(p),
+        "l": q.shape[1],
+    }
+    for name, array in zip(MODEL_ARRAYS, model):
+        np.save(prefix + f"_{name}.npy", np.ascontiguousarray(array, dtype=np.float32))
+    with open(prefix + "_header.json", "w") as f:
+        json.dump(header, f)
+
+
+def load_mmap(prefix: str) -> Model:
+    """
+    Opens a model saved by `save_mmap` as read-only memory maps: processes loading
+    the same model share a single page-cached copy of it.
+
+    Raises ValueError if the arrays do not match their header.
+    """
+    with open(prefix + "_header.json") as f:
+        header = json.load(f)
+    if header["version"] != MMAP_FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported model format version {header['version']} (expected {MMAP_FORMAT_VERSION})"
+        )
+
+    expected_shapes = {
+        "q": (header["n_songs"], header["l"]),
+        "p": (header["n_users"], header["l"]),
+        "b_song": (header["n_songs"],),
+        "b_user": (header["n_users"],),
+    }
+    model = []
+    for name in MODEL_ARRAYS:
+        array = np.load(prefix + f"_{name}.npy", mmap_mode="r")
+        if array.shape != expected_shapes[name] or array.dtype != np.dtype(header["dtype"]):
+            raise ValueError(
+                f"Model array {name} is {array.dtype}{array.shape}, expected {header['dtype']}{expected_shapes[name]}"
+            )
+        model.append(array)
+
+    return (model[0], model[1], model[2], model[3])
@@ -0,0 +1,135 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+from pathlib import Path
+import numpy as np
+
+# CSR-style table (indptr, indices, similarities): the neighbors of song i are
+# indices[indptr[i]:indptr[i + 1]], most similar first
+NeighborTable = tuple[np.ndarray, np.ndarray, np.ndarray]
+
+# Temporary memory of one worker: a float32 tile of similarities and the int64
+# positions of its `argpartition`, 12 bytes per (song, candidate) pair
+BLOCK_BYTES = 32 * 2**20
+# Temporary memory of all workers, which caps their number
+MAX_BYTES = 512 * 2**20
+
+
+def compute(
+    q: np.ndarray,
+    b_song: np.ndarray,
+    k: int,
+    available: np.ndarray,
+    n_workers: int | None = None,
+    block_size: int = 128,
+    block_bytes: int = BLOCK_BYTES,
+    max_bytes: int = MAX_BYTES,
+) -> NeighborTable:
+    """
+    Top-k most similar songs of every song, by cosine similarity of their factors
+    with the song bias as an extra component. Only songs marked in the `available`
+    mask can be neighbors.
+
+    Songs are processed by blocks of `block_size` rows, scanning the candidates in
+    tiles of about `block_bytes` of temporaries while keeping a running top-k, so
+    memory doesn't grow with the catalog. Blocks are spread over `n_workers` threads,
+    at most `max_bytes // block_bytes` of them.
+    """
+    n_workers = min(n_workers or os.cpu_count() or 1, max(max_bytes // block_bytes, 1))
+
+    vectors = np.hstack((q, b_song[:, np.newaxis])).astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors /= np.where(norms > 0, norms, 1)
+    candidates = vectors[available]
+    candidate_indexes = np.flatnonzero(available).astype(np.int32)
+
+    k = min(k, max(len(candidates) - 1, 0))
+    indices = np.empty((len(vectors), k), dtype=np.int32)
+    similarities = np.empty((len(vectors), k), dtype=np.float32)
+    tile_size = max(block_bytes // (12 * block_size), k)
+
+    def compute_block(start: int):
+        stop = min(start + block_size, len(vectors))
+        # A song is not its own neighbor
+        songs = np.arange(start, stop)
+        positions = np.minimum(
+            np.searchsorted(candidate_indexes, songs), len(candidate_indexes) - 1
+        )
+        is_candidate = candidate_indexes[positions] == songs
+
+        # Running top-k: positions in `candidates` and similarities
+        best = np.empty((stop - start, 0), dtype=np.int64)
+        best_similarities = np.empty((stop - start, 0), dtype=np.float32)
+        for tile_start in range(0, len(candidates), tile_size):
+            tile_stop = min(tile_start + tile_size, len(candidates))
+            # Shape: (block_size, tile_size)
+            tile = vectors[start:stop] @ candidates[tile_start:tile_stop].T
+            in_tile = is_candidate & (positions >= tile_start) & (positions < tile_stop)
+            tile[np.flatnonzero(in_tile), positions[in_tile] - tile_start] = -np.inf
+
+            if tile.shape[1] > k:
+                tile_best = np.argpartition(tile, -k, axis=1)[:, -k:]
+                tile_similarities = np.take_along_axis(tile, tile_best, axis=1)
+            else:
+                tile_best = np.broadcast_to(np.arange(tile.shape[1]), tile.shape)
+                tile_similarities = tile
+            best = np.hstack((best, tile_best + tile_start))
+            best_similarities = np.hstack((best_similarities, tile_similarities))
+            del tile, tile_best, tile_similarities
+
+            if best.shape[1] > k:
+                kept = np.argpartition(best_similarities, -k, axis=1)[:, -k:]
+                best = np.take_along_axis(best, kept, axis=1)
+                best_similarities = np.take_along_axis(best_similarities, kept, axis=1)
+
+        order = np.argsort(best_similarities, axis=1)[:, ::-1]
+        indices[start:stop] = candidate_indexes[np.take_along_axis(best, order, axis=1)]
+        similarities[start:stop] = np.take_along_axis(best_similarities, order, axis=1)
+
+    if k > 0:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            # Blocks cover disjoint rows, so workers never write to the same memory
+            list(executor.map(compute_block, range(0, len(vectors), block_size)))
+
+    indptr = np.arange(len(vectors) + 1, dtype=np.int64) * k
+    return indptr, indices.ravel(), similarities.ravel()
+
+
+def save(prefix: str, table: NeighborTable):
+    indptr, indices, similarities = table
+    np.save(prefix + "_indptr.npy", indptr)
+    np.save(prefix + "_indices.npy", indices)
+    np.save(prefix + "_similarities.npy", similarities)
+
+
+def load(prefix: str) -> NeighborTable:
+    return (
+        np.load(prefix + "_indptr.npy", mmap_mode="r"),
+        np.load(prefix + "_indices.npy", mmap_mode="r"),
+        np.load(prefix + "_similarities.npy", mmap_mode="r"),
+    )
+
+
+def exists(prefix: str) -> bool:
+    return Path(prefix + "_indptr.npy").exists()
+
+
+def neighbors(table: NeighborTable, song_index: int, n: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    (indexes, similarities) of the n most similar songs of a song, in O(n).
+    """
+    indptr, indices, similarities = table
+    start, stop = indptr[song_index], min(indptr[song_index + 1], indptr[song_index] + n)
+    return indices[start:stop], similarities[start:stop]
+
+
+if __name__ == "__main__":
+    from .bundle import BUNDLE_PATH, load as load_bundle
+
+    serving = load_bundle()
+    q, _, b_song, _ = serving.model
+    print(f"Computing neighbors of {len(q)} songs...")
+    save(
+        str(BUNDLE_PATH / "neighbors"),
+        compute(np.asarray(q), np.asarray(b_song), 50, serving.metadata_mask),
+    )
+    print(f"Neighbors saved to {BUNDLE_PATH}")
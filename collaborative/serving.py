@@ -0,0 +1,185 @@
+import numpy as np
+
+from .model import Model
+
+
+def nearest_user_predictions(
+    model: Model,
+    average_listening_count: float,
+    song_indexes: np.ndarray,
+    listening_counts: np.ndarray,
+) -> np.ndarray:
+    """
+    Predictions for all songs of the training user whose predictions on the given
+    songs are the closest to the given listening counts.
+
+    `song_indexes` must be sorted. Cost grows with the number of training users.
+    """
+    (q, p, b_song, b_user) = model
+
+    # Restrict q to songs listened by the given user
+    q_user_songs = q[song_indexes]
+    b_song_user_songs = b_song[song_indexes]
+
+    p_user_songs = (
+        # Shape: (#USERS, len(users_listenings))
+        (p @ q_user_songs.T)
+        + average_listening_count
+        # Shape: (#USERs, 1)
+        + b_user[:, np.newaxis]
+        # Shape: (len(users_listenings))
+        + b_song_user_songs
+    )
+    # Standardized like the training set (`dataset.normalize`)
+    user_vector = np.asarray(listening_counts, dtype=np.float64)
+    user_vector = (user_vector - user_vector.mean()) / user_vector.std()
+
+    # Similarity (L2) of predictions of given songs for users in the dataset
+    p_user_songs_dist = ((p_user_songs - user_vector) ** 2).sum(axis=1)
+
+    # Keep the most similar one
+    most_similar_user_index = p_user_songs_dist.argsort()[0]
+
+    # Compute predictions of this most similar user for all songs
+    return (
+        (p[most_similar_user_index] @ q.T)
+        + average_listening_count
+        + b_user[most_similar_user_index]
+        + b_song
+    )
+
+
+def fold_in(
+    model: Model, song_indexes: np.ndarray, targets: np.ndarray, lbd: float
+) -> tuple[np.ndarray, float]:
+    """
+    Latent vector and bias (p_u, b_u) of a user that is not in the training set,
+    given its normalized listening counts on some songs.
+
+    It is the regularized least squares solution of an ALS user step
+    (see `als.train_als`) with q and b_song fixed, so it only costs
+    O(len(song_indexes) * l^2 + l^3).
+    """
+    p_users, b_users = fold_in_batch(model, [(song_indexes, targets)], lbd)
+    return p_users[0], b_users[0]
+
+
+def fold_in_batch(
+    model: Model, histories: list[tuple[np.ndarray, np.ndarray]], lbd: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    `fold_in` of several users, given as (song indexes, normalized listening counts)
+    pairs, with a single batched solve. Returns p_users (#USERS, l) and
+    b_users (#USERS).
+    """
+    (q, _, b_song, _) = model
+    k = q.shape[1] + 1
+
+    gram = np.empty((len(histories), k, k))
+    rhs = np.empty((len(histories), k))
+    for j, (song_indexes, targets) in enumerate(histories):
+        # A constant 1 column makes the bias part of the solution
+        x = np.hstack((q[song_indexes], np.ones((len(song_indexes), 1))))
+        gram[j] = x.T @ x
+        gram[j].flat[:: k + 1] += lbd * max(len(song_indexes), 1)
+        rhs[j] = x.T @ (targets - b_song[song_indexes])
+
+    solution = np.linalg.solve(gram, rhs[..., np.newaxis])[..., 0]
+    return solution[:, :-1], solution[:, -1]
+
+
+def fold_in_predictions(
+    model: Model, song_indexes: np.ndarray, targets: np.ndarray, lbd: float
+) -> np.ndarray:
+    """
+    Predictions for all songs of the user folded in from its listening counts.
+    Cost does not depend on the number of training users.
+    """
+    (q, _, b_song, _) = model
+    p_u, b_u = fold_in(model, song_indexes, targets, lbd)
+    # Scored in the model's precision, mixing it with float64 would copy q
+    return q @ p_u.astype(q.dtype) + b_u + b_song
+
+
+def fold_in_recommendations(
+    model: Model,
+    histories: list[tuple[np.ndarray, np.ndarray]],
+    lbd: float,
+    n: int,
+    available: np.ndarray,
+    chunk_size: int = 16,
+) -> list[np.ndarray]:
+    """
+    `top_n` of `fold_in_predictions` for several users, heard songs excluded.
+
+    Users are scored `chunk_size` at a time with one matrix product against q,
+    written into a reused (chunk_size, #SONGS) buffer that stays small enough for
+    the CPU caches.
+    """
+    (q, _, b_song, _) = model
+    # Song biases, with unavailable songs pushed out of any top
+    song_offsets = np.where(available, b_song, -np.inf).astype(q.dtype)
+
+    recommendations: list[np.ndarray] = []
+    # Scored in the model's precision, mixing it with float64 would copy q
+    scores = np.empty((min(chunk_size, len(histories)), len(q)), dtype=q.dtype)
+    for start in range(0, len(histories), chunk_size):
+        chunk = histories[start : start + chunk_size]
+        p_users, b_users = fold_in_batch(model, chunk, lbd)
+
+        chunk_scores = scores[: len(chunk)]
+        np.matmul(p_users.astype(q.dtype), q.T, out=chunk_scores)
+        chunk_scores += song_offsets
+        chunk_scores += b_users[:, np.newaxis].astype(q.dtype)
+        recommendations += _best(
+            chunk_scores, n, [song_indexes for song_indexes, _ in chunk]
+        )
+    return recommendations
+
+
+def top_n(
+    predictions: np.ndarray,
+    n: int,
+    available: np.ndarray,
+    excluded_indexes: np.ndarray,
+) -> np.ndarray:
+    """
+    Indexes of the (at most) n best predictions, best first, among songs marked in
+    the `available` boolean mask and not in `excluded_indexes` (e.g. already heard).
+    """
+    return top_n_batch(predictions[np.newaxis], n, available, [excluded_indexes])[0]
+
+
+def top_n_batch(
+    predictions: np.ndarray,
+    n: int,
+    available: np.ndarray,
+    excluded_indexes: list[np.ndarray],
+) -> list[np.ndarray]:
+    """
+    `top_n` of each row of `predictions` (#USERS, #SONGS), with the excluded
+    indexes of each user.
+    """
+    return _best(np.where(available, predictions, -np.inf), n, excluded_indexes)
+
+
+def _best(
+    scores: np.ndarray, n: int, excluded_indexes: list[np.ndarray]
+) -> list[np.ndarray]:
+    """
+    Indexes of the n best finite scores of each row, best first. Excluded indexes
+    are overwritten in place.
+    """
+    for row, excluded in enumerate(excluded_indexes):
+        scores[row, excluded] = -np.inf
+
+    n = min(n, scores.shape[1])
+    if n <= 0:
+        return [np.empty(0, dtype=np.int64) for _ in range(len(scores))]
+    # Unordered n best in O(#SONGS), then sorting only them
+    best = np.argpartition(scores, -n, axis=1)[:, -n:]
+    best_scores = np.take_along_axis(scores, best, axis=1)
+    order = np.argsort(best_scores, axis=1)[:, ::-1]
+    best = np.take_along_axis(best, order, axis=1)
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+    return [row[np.isfinite(row_scores)] for row, row_scores in zip(best, best_scores)]
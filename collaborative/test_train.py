@@ -1,12 +1,16 @@
 import json
 import numpy as np
 
+from .config import DATASET_SIZE, l
 from .dataset import load as load_dataset, normalize
 from .model import init, save
-from .train import train
+from .als import train_als
+from .hogwild import train_hogwild
+from .train import train, train_minibatch
 
-DATASET_SIZE = 4_000_000
-l = 40
+# One of "sgd" (per-row), "minibatch", "hogwild" or "als"
+TRAINER = "minibatch"
+BATCH_SIZE = 4096
 
 if __name__ == "__main__":
     dataset, USER_MAPPING, SONG_MAPPING = load_dataset(DATASET_SIZE)
@@ -22,15 +26,28 @@ if __name__ == "__main__":
     train_set = dataset_shuffled[:training_set_size]
     validation_set = dataset_shuffled[training_set_size:]
 
-    model, stats = train(
-        l,
-        0.001,
-        0.0005,
-        200,
-        train_set,
-        validation_set,
-        init(len(SONG_MAPPING), len(USER_MAPPING)),
-    )
+    initial_model = init(len(SONG_MAPPING), len(USER_MAPPING))
+    if TRAINER == "als":
+        # Each ALS epoch is a full solve, a few of them are enough
+        model, stats = train_als(
+            l, 0.05, 10, train_set, validation_set, initial_model
+        )
+    else:
+        training_args = (
+            l,
+            0.001,
+            0.0005,
+            200,
+            train_set,
+            validation_set,
+            initial_model,
+        )
+        if TRAINER == "sgd":
+            model, stats = train(*training_args)
+        elif TRAINER == "hogwild":
+            model, stats = train_hogwild(*training_args)
+        else:
+            model, stats = train_minibatch(*training_args, batch_size=BATCH_SIZE)
 
     print("Training done")
 
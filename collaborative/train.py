@@ -1,4 +1,5 @@
 from collections.abc import Iterable
+import time
 import numpy as np
 from typing import TypedDict, cast
 
@@ -43,6 +44,7 @@ def train(
         loss_sum: float = 0
         accuracy_sum: float = 0
 
+        epoch_start = time.perf_counter()
         np.random.shuffle(train_set)  # Reorder each epoch
         # user \in [0, #USERS - 1]
         # song \in [0, #SONGS - 1]
@@ -76,6 +78,8 @@ def train(
             accuracy = e_ui**2
             accuracy_sum += accuracy
 
+        print_throughput(len(train_set), time.perf_counter() - epoch_start)
+
         learning_stats["losses_train"][epoch] = loss_sum
         learning_stats["accuracy_train"][epoch] = np.sqrt(accuracy_sum / len(train_set))
 
@@ -115,3 +119,162 @@ def train(
         )
 
     return (q, p, b_song, b_user), learning_stats
+
+
+def train_minibatch(
+    l: int,
+    lbd: float,
+    gamma: float,
+    n_epochs: int,
+    train_set: np.ndarray,
+    validation_set: np.ndarray,
+    model: Model,
+    batch_size: int = 4096,
+) -> tuple[Model, LearningStats]:
+    """
+    Same SGD as `train`, but the errors and updates of `batch_size` triplets are
+    computed at once with NumPy. All triplets of a batch see the model as it was at
+    the start of the batch; updates hitting the same user or song are summed
+    (scatter-add).
+    """
+    (q, p, b_song, b_user) = model
+
+    learning_stats: LearningStats = {
+        "losses_train": [np.nan] * n_epochs,
+        "losses_validation": [np.nan] * n_epochs,
+        "accuracy_train": [np.nan] * n_epochs,
+        "accuracy_validation": [np.nan] * n_epochs,
+    }
+
+    print(
+        f"Training (mini-batch of {batch_size}) with l={l}, lambda={lbd}, gamma={gamma} for {n_epochs} epochs."
+    )
+
+    average_listening_count = train_set["Listening count"].mean()
+
+    for epoch in range(n_epochs):
+        print(f"Epoch {epoch+1}")
+        loss_sum: float = 0
+        accuracy_sum: float = 0
+
+        epoch_start = time.perf_counter()
+        np.random.shuffle(train_set)  # Reorder each epoch
+        for start in range(0, len(train_set), batch_size):
+            batch_loss, batch_accuracy = sgd_step(
+                (q, p, b_song, b_user),
+                average_listening_count,
+                lbd,
+                gamma,
+                train_set[start : start + batch_size],
+            )
+            loss_sum += batch_loss
+            accuracy_sum += batch_accuracy
+
+        print_throughput(len(train_set), time.perf_counter() - epoch_start)
+
+        learning_stats["losses_train"][epoch] = loss_sum
+        learning_stats["accuracy_train"][epoch] = np.sqrt(accuracy_sum / len(train_set))
+
+        loss_validation_sum, accuracy_validation_sum = evaluate(
+            (q, p, b_song, b_user),
+            average_listening_count,
+            lbd,
+            validation_set,
+            batch_size,
+        )
+        learning_stats["losses_validation"][epoch] = loss_validation_sum
+        learning_stats["accuracy_validation"][epoch] = np.sqrt(
+            accuracy_validation_sum / len(validation_set)
+        )
+
+        print(
+            f"Loss (train): {learning_stats['losses_train'][epoch]}, loss (validation): {learning_stats['losses_validation'][epoch]}"
+        )
+        print(
+            f"Accuracy (train): {learning_stats['accuracy_train'][epoch]}, Accuracy (validation): {learning_stats['accuracy_validation'][epoch]}"
+        )
+
+    return (q, p, b_song, b_user), learning_stats
+
+
+def sgd_step(
+    model: Model,
+    average_listening_count: float,
+    lbd: float,
+    gamma: float,
+    batch: np.ndarray,
+) -> tuple[float, float]:
+    """
+    Updates the model in place with one SGD step over a batch of triplets.
+    Returns the (loss sum, squared error sum) of the batch before the update.
+    """
+    (q, p, b_song, b_user) = model
+    users = batch["User index"]
+    songs = batch["Song index"]
+
+    # Gathered copies, shapes (B, l) and (B)
+    p_u = p[users]
+    q_i = q[songs]
+    b_u = b_user[users]
+    b_i = b_song[songs]
+
+    listenings_hat = (
+        np.einsum("ij,ij->i", p_u, q_i) + average_listening_count + b_u + b_i
+    )
+
+    # Prediction errors, shape (B)
+    e_ui = batch["Listening count"] - listenings_hat
+
+    # This is the learning part, repeated indexes accumulate
+    np.add.at(q, songs, gamma * (e_ui[:, np.newaxis] * p_u - lbd * q_i))
+    np.add.at(p, users, gamma * (e_ui[:, np.newaxis] * q_i - lbd * p_u))
+    np.add.at(b_user, users, gamma * (e_ui - lbd * b_u))
+    np.add.at(b_song, songs, gamma * (e_ui - lbd * b_i))
+
+    squared_error_sum = (e_ui**2).sum()
+    loss_sum = squared_error_sum + lbd * (
+        np.einsum("ij,ij->", q_i, q_i) + np.einsum("ij,ij->", p_u, p_u)
+    )
+    return loss_sum, squared_error_sum
+
+
+def evaluate(
+    model: Model,
+    average_listening_count: float,
+    lbd: float,
+    dataset: np.ndarray,
+    batch_size: int = 65536,
+) -> tuple[float, float]:
+    """
+    Returns the (loss sum, squared error sum) of the model over the dataset,
+    computed batch by batch.
+    """
+    (q, p, b_song, b_user) = model
+
+    loss_sum: float = 0
+    squared_error_sum: float = 0
+    for start in range(0, len(dataset), batch_size):
+        batch = dataset[start : start + batch_size]
+        users = batch["User index"]
+        songs = batch["Song index"]
+
+        p_u = p[users]
+        q_i = q[songs]
+        listenings_hat = (
+            np.einsum("ij,ij->i", p_u, q_i)
+            + average_listening_count
+            + b_user[users]
+            + b_song[songs]
+        )
+        squared_errors = (batch["Listening count"] - listenings_hat) ** 2
+
+        loss_sum += squared_errors.sum() + lbd * (
+            np.einsum("ij,ij->", q_i, q_i) + np.einsum("ij,ij->", p_u, p_u)
+        )
+        squared_error_sum += squared_errors.sum()
+
+    return loss_sum, squared_error_sum
+
+
+def print_throughput(n_triplets: int, elapsed: float):
+    print(f"Trained on {n_triplets} triplets in {elapsed:.2f}s ({n_triplets / elapsed:.0f} triplets/s)")
@@ -0,0 +1,111 @@
+from collections.abc import Iterable
+import numpy as np
+
+
+class Vocabulary:
+    """
+    Bidirectional mapping between IDs (MSD user or song IDs) and matrix indexes.
+
+    IDs are stored as a sorted array of fixed-width bytes, looked up by binary search,
+    with the permutations between sorted positions and indexes. Saved arrays are
+    memory-mapped, so processes loading the same vocabulary share its pages.
+
+    It behaves like the former `dict[str, int]` mappings (`in`, `[]`, `get`, `len`),
+    and `indexes`/`ids` do bulk lookups.
+    """
+
+    def __init__(
+        self,
+        sorted_ids: np.ndarray,
+        order: np.ndarray,
+        ranks: np.ndarray,
+        size: int | None = None,
+    ):
+        """
+        Args:
+            sorted_ids: IDs (bytes) in sorted order.
+            order: Index of each ID of `sorted_ids`.
+            ranks: Position in `sorted_ids` of each index.
+            size: Restricts the vocabulary to its `size` first indexes.
+        """
+        self._sorted_ids = sorted_ids
+        self._order = order
+        self._ranks = ranks
+        self._size = len(ranks) if size is None else min(size, len(ranks))
+
+    @classmethod
+    def from_ids(cls, ids: Iterable[str]) -> "Vocabulary":
+        """
+        Builds the vocabulary of the given IDs, the index of an ID being its position.
+        """
+        ids_bytes = _encode(list(ids))
+        order = np.argsort(ids_bytes, kind="stable").astype(np.uint32)
+        ranks = np.empty_like(order)
+        ranks[order] = np.arange(len(order), dtype=np.uint32)
+        return cls(ids_bytes[order], order, ranks)
+
+    def save(self, prefix: str):
+        np.save(prefix + "_sorted_ids.npy", self._sorted_ids)
+        np.save(prefix + "_order.npy", self._order)
+        np.save(prefix + "_ranks.npy", self._ranks[: self._size])
+
+    @classmethod
+    def load(cls, prefix: str, size: int | None = None) -> "Vocabulary":
+        return cls(
+            np.load(prefix + "_sorted_ids.npy", mmap_mode="r"),
+            np.load(prefix + "_order.npy", mmap_mode="r"),
+            np.load(prefix + "_ranks.npy", mmap_mode="r"),
+            size,
+        )
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, id: str) -> bool:
+        return self.indexes([id])[0] >= 0
+
+    def __getitem__(self, id: str) -> int:
+        index = self.indexes([id])[0]
+        if index < 0:
+            raise KeyError(id)
+        return int(index)
+
+    def get(self, id: str, default: int | None = None) -> int | None:
+        index = self.indexes([id])[0]
+        return default if index < 0 else int(index)
+
+    def indexes(self, ids: Iterable[str] | np.ndarray) -> np.ndarray:
+        """
+        Indexes of the given IDs, -1 for unknown ones.
+        """
+        query = _encode(ids)
+        positions = np.searchsorted(self._sorted_ids, query)
+        positions = np.minimum(positions, len(self._sorted_ids) - 1)
+
+        indexes = np.full(len(query), -1, dtype=np.int64)
+        if len(self._sorted_ids) == 0:
+            return indexes
+        # IDs wider than the vocabulary's ones are truncated by the search, the
+        # comparison is done at full width
+        found = self._sorted_ids[positions] == query
+        indexes[found] = self._order[positions[found]]
+        indexes[indexes >= self._size] = -1
+        return indexes
+
+    def ids(self, indexes: Iterable[int] | np.ndarray) -> list[str]:
+        """
+        IDs of the given indexes.
+        """
+        indexes = np.asarray(indexes, dtype=np.int64)
+        if np.any((indexes < 0) | (indexes >= self._size)):
+            raise IndexError("Index out of vocabulary")
+        return [id.decode() for id in self._sorted_ids[self._ranks[indexes]]]
+
+
+def _encode(ids: Iterable[str] | np.ndarray) -> np.ndarray:
+    ids = np.asarray(ids if isinstance(ids, np.ndarray) else list(ids))
+    if ids.dtype.kind == "S":
+        return ids
+    if len(ids) == 0:
+        return np.array([], dtype="S1")
+    return np.char.encode(ids.astype(str), "utf-8")
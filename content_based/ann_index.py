@@ -0,0 +1,141 @@
+import os
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+
+
+class IVFIndex:
+    """
+    Approximate nearest neighbors index for cosine similarity (inverted file).
+
+    Embeddings are clustered with k-means into `n_lists` coarse centroids, and each
+    one is stored in the list of its closest centroid. A query only scans the
+    `n_probe` lists whose centroids are the closest to it: raising `n_probe`
+    improves recall at the cost of latency (`n_probe == n_lists` is exact search).
+    """
+    def __init__(self, n_lists=256, n_probe=8, train_size=100_000, random_state=0):
+        """
+        Initialize an empty index.
+        
+        Args:
+            n_lists (int): Number of coarse centroids (inverted lists).
+            n_probe (int): Number of lists scanned per query.
+            train_size (int): Max number of embeddings sampled to fit the centroids.
+            random_state (int): Seed of the sampling and k-means.
+        """
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.train_size = train_size
+        self.random_state = random_state
+        
+        self.centroids = None
+        # Normalized embeddings ordered by list, with their original row
+        self.vectors = None
+        self.row_ids = None
+        # Vectors of list i are vectors[list_offsets[i]:list_offsets[i + 1]]
+        self.list_offsets = None
+
+    def fit(self, embeddings):
+        """
+        Builds the index over the rows of an embedding matrix.
+        
+        Args:
+            embeddings (np.array): Matrix (n_songs, dim) of embeddings.
+            
+        Returns:
+            IVFIndex: The index itself.
+        """
+        vectors = normalize(np.asarray(embeddings, dtype=np.float32))
+        n_lists = min(self.n_lists, len(vectors))
+        
+        rng = np.random.default_rng(self.random_state)
+        sample = vectors[rng.choice(len(vectors), min(self.train_size, len(vectors)), replace=False)]
+        kmeans = MiniBatchKMeans(n_clusters=n_lists, random_state=self.random_state, n_init=3)
+        kmeans.fit(sample)
+        self.centroids = normalize(kmeans.cluster_centers_.astype(np.float32))
+        
+        # Assign by blocks to bound the (block, n_lists) similarity matrix
+        assignments = np.concatenate([
+            np.argmax(vectors[start:start + 65536] @ self.centroids.T, axis=1)
+            for start in range(0, len(vectors), 65536)
+        ])
+        order = np.argsort(assignments, kind='stable')
+        self.vectors = np.ascontiguousarray(vectors[order])
+        self.row_ids = order.astype(np.int64)
+        self.list_offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=n_lists))))
+        return self
+
+    def kneighbors(self, queries, n_neighbors=5):
+        """
+        Approximate nearest neighbors, with the same output as sklearn's
+        `NearestNeighbors(metric='cosine').kneighbors`.
+        
+        Args:
+            queries (np.array): Matrix (n_queries, dim) of query vectors.
+            n_neighbors (int): Number of neighbors per query.
+            
+        Returns:
+            tuple: (distances, indices), both of shape (n_queries, n_neighbors), with
+                   cosine distances and rows of the indexed matrix, nearest first.
+                   Rows are padded with inf distances and -1 indices if the probed
+                   lists hold fewer candidates.
+        """
+        queries = normalize(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        n_probe = min(self.n_probe, len(self.centroids))
+        
+        distances = np.full((len(queries), n_neighbors), np.inf)
+        indices = np.full((len(queries), n_neighbors), -1, dtype=np.int64)
+        
+        probed_lists = np.argpartition(-(queries @ self.centroids.T), n_probe - 1, axis=1)[:, :n_probe]
+        for i, (query, lists) in enumerate(zip(queries, probed_lists)):
+            candidates = np.concatenate([
+                np.arange(self.list_offsets[list_id], self.list_offsets[list_id + 1])
+                for list_id in lists
+            ])
+            similarities = self.vectors[candidates] @ query
+            
+            k = min(n_neighbors, len(candidates))
+            best = np.argpartition(-similarities, k - 1)[:k] if k > 0 else np.empty(0, dtype=np.int64)
+            best = best[np.argsort(-similarities[best])]
+            distances[i, :k] = 1.0 - similarities[best]
+            indices[i, :k] = self.row_ids[candidates[best]]
+        
+        return distances, indices
+
+    def save(self, path):
+        """Saves the index to a .npz file."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez(
+            path,
+            centroids=self.centroids,
+            vectors=self.vectors,
+            row_ids=self.row_ids,
+            list_offsets=self.list_offsets,
+            params=np.array([self.n_lists, self.n_probe, self.train_size, self.random_state]),
+        )
+
+    @classmethod
+    def load(cls, path, n_probe=None):
+        """
+        Loads an index saved by `save`.
+        
+        Args:
+            path (str): Path of the .npz file.
+            n_probe (int, optional): Overrides the saved number of probed lists.
+        """
+        with np.load(path) as data:
+            n_lists, saved_n_probe, train_size, random_state = data['params'].tolist()
+            index = cls(n_lists, n_probe or saved_n_probe, train_size, random_state)
+            index.centroids = data['centroids']
+            index.vectors = data['vectors']
+            index.row_ids = data['row_ids']
+            index.list_offsets = data['list_offsets']
+        return index
+
+    def __len__(self):
+        return 0 if self.row_ids is None else len(self.row_ids)
+
+
+def normalize(vectors):
+    """L2-normalizes the rows of `vectors`, zero rows are left as they are."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
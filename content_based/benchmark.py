@@ -0,0 +1,283 @@
+"""
+Benchmarks of the content-based recommender on synthetic embeddings.
+
+Usage: python benchmark.py [name ...] (all benchmarks when no name is given)
+"""
+
+import multiprocessing
+import os
+import pickle
+import sys
+import tempfile
+import time
+import numpy as np
+from sklearn.neighbors import NearestNeighbors
+
+from ann_index import IVFIndex
+from embedding_store import EmbeddingStore
+from encoders import HashingEncoder, SentenceTransformerEncoder
+from recommender import ContentBasedRecommender
+
+N_SONGS = 200_000
+DIM = 384
+N_QUERIES = 200
+K = 10
+# Transformer of the encoder benchmark, a model name or the path of a saved model
+TRANSFORMER_MODEL = "all-MiniLM-L6-v2"
+
+
+def synthetic_embeddings(n_songs=N_SONGS, dim=DIM, n_clusters=1000, seed=0):
+    """Clustered float32 embeddings, closer to real text embeddings than pure noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim)).astype(np.float32)
+    embeddings = centers[rng.integers(0, n_clusters, n_songs)]
+    embeddings += rng.normal(scale=0.6, size=(n_songs, dim)).astype(np.float32)
+    return embeddings
+
+
+def synthetic_anisotropic_embeddings(n_songs=N_SONGS, dim=DIM, decay=1.0, seed=0):
+    """Clustered embeddings whose variance decays with the dimension (power law, after a
+    random rotation), like text embeddings, unlike `synthetic_embeddings` which spread
+    it evenly."""
+    rng = np.random.default_rng(seed)
+    scales = np.sqrt(dim) * np.arange(1, dim + 1) ** -decay
+    rotation = np.linalg.qr(rng.normal(size=(dim, dim)))[0]
+    return ((synthetic_embeddings(n_songs, dim, seed=seed) * scales) @ rotation).astype(np.float32)
+
+
+def synthetic_queries(embeddings, n_queries=N_QUERIES, seed=1):
+    """Weighted means of random songs, like user embeddings."""
+    rng = np.random.default_rng(seed)
+    histories = rng.integers(0, len(embeddings), (n_queries, 20))
+    weights = rng.integers(1, 10, (n_queries, 20, 1))
+    return (embeddings[histories] * weights).sum(axis=1) / weights.sum(axis=1)
+
+
+def recall_at_k(exact_indices, approximate_indices):
+    """Mean fraction of the exact top-k found by the approximate search."""
+    return np.mean([
+        len(np.intersect1d(exact, approximate)) / len(exact)
+        for exact, approximate in zip(exact_indices, approximate_indices)
+    ])
+
+
+def timed(function, queries):
+    """Runs `function` on each query, returns (results, mean latency in ms)."""
+    start = time.perf_counter()
+    results = [function(query) for query in queries]
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def bench_ann(embeddings, queries):
+    """Recall@k vs latency of the IVF index against the exact brute-force search."""
+    brute = NearestNeighbors(metric='cosine', algorithm='brute').fit(embeddings)
+    exact, latency = timed(lambda query: brute.kneighbors(query[np.newaxis], K)[1][0], queries)
+    print(f"{'brute force (sklearn)':>28}: recall@{K} 1.000, {latency:7.2f} ms/query")
+    
+    for n_lists in (256, 1024):
+        start = time.perf_counter()
+        index = IVFIndex(n_lists=n_lists).fit(embeddings)
+        print(f"IVF index with {n_lists} lists built in {time.perf_counter() - start:.1f}s")
+        for n_probe in (1, 4, 16, 64):
+            index.n_probe = n_probe
+            approximate, latency = timed(lambda query: index.kneighbors(query, K)[1][0], queries)
+            print(f"{f'ivf {n_lists} lists, probe {n_probe}':>28}: recall@{K} {recall_at_k(exact, approximate):.3f}, {latency:7.2f} ms/query")
+
+
+def song_ids(n_songs):
+    return [f'SO{i:016X}' for i in range(n_songs)]
+
+
+def exact_recommender(embeddings, **options):
+    """ContentBasedRecommender on `embeddings`, saved to a temporary store (no metadata).
+    Exact search unless `options` (recommender arguments) choose another index."""
+    with tempfile.TemporaryDirectory() as directory:
+        prefix = os.path.join(directory, 'song_embeddings')
+        EmbeddingStore.from_arrays(song_ids(len(embeddings)), embeddings).save(prefix)
+        # The memory maps stay valid once the files are removed
+        return ContentBasedRecommender(prefix, os.path.join(directory, 'missing.pkl'), **options)
+
+
+def memory_usage():
+    """Resident memory (MiB) of the process: anonymous, file-backed, and peak."""
+    with open('/proc/self/status') as f:
+        status = dict(line.split(':', 1) for line in f)
+    return tuple(int(status[field].split()[0]) / 1024 for field in ('RssAnon', 'RssFile', 'VmHWM'))
+
+
+def startup(embeddings_path):
+    """Loads a recommender (run in a fresh process), returns (seconds, memory usage)."""
+    start = time.perf_counter()
+    recommender = ContentBasedRecommender(embeddings_path, 'missing.pkl')
+    return time.perf_counter() - start, memory_usage()
+
+
+def bench_exact(embeddings, queries):
+    """Latency of the exact NumPy kernel, per query and batched, against sklearn's brute force."""
+    brute = NearestNeighbors(metric='cosine', algorithm='brute').fit(embeddings)
+    exact, latency = timed(lambda query: brute.kneighbors(query[np.newaxis], K)[1][0], queries)
+    print(f"{'brute force (sklearn)':>28}: {latency:7.2f} ms/query")
+    
+    recommender = exact_recommender(embeddings)
+    results, latency = timed(lambda query: recommender.recommend(query, K), queries)
+    found = [[int(rec['song_id'][2:], 16) for rec in recs] for recs in results]
+    print(f"{'recommend':>28}: {latency:7.2f} ms/query, recall@{K} {recall_at_k(exact, found):.3f}")
+    
+    for batch_size in (10, len(queries)):
+        batches = [queries[i:i + batch_size] for i in range(0, len(queries), batch_size)]
+        _, latency = timed(lambda batch: recommender.recommend_batch(batch, K), batches)
+        print(f"{f'recommend_batch ({batch_size} users)':>28}: {latency / batch_size:7.2f} ms/query")
+
+
+def bench_store(embeddings, queries):
+    """Startup time and resident memory of the recommender, legacy pickle vs memory-mapped store."""
+    with tempfile.TemporaryDirectory() as directory:
+        pickle_path = os.path.join(directory, 'song_embeddings.pkl')
+        with open(pickle_path, 'wb') as f:
+            pickle.dump(dict(zip(song_ids(len(embeddings)), embeddings)), f)
+        prefix = os.path.join(directory, 'song_embeddings')
+        EmbeddingStore.from_arrays(song_ids(len(embeddings)), embeddings).save(prefix)
+        
+        context = multiprocessing.get_context('spawn')
+        for name, path in (('pickled dict', pickle_path), ('memory-mapped store', prefix)):
+            with context.Pool(1) as pool:
+                seconds, (anonymous, file_backed, peak) = pool.apply(startup, (path,))
+            print(f"{name:>28}: startup {seconds:6.2f}s, RSS anon {anonymous:6.0f} MiB, "
+                  f"file {file_backed:6.0f} MiB (shared), peak {peak:6.0f} MiB")
+
+
+def recommended_rows(recommender, queries, n_recommendations):
+    """Rows of the songs recommended to each query, with the mean latency in ms."""
+    results, latency = timed(lambda query: recommender.recommend(query, n_recommendations), queries)
+    return [[int(rec['song_id'][2:], 16) for rec in recs] for recs in results], latency
+
+
+def bench_quant(embeddings, queries):
+    """Recall@5, latency and index memory of the int8 index for several recall targets."""
+    recommender = exact_recommender(embeddings)
+    exact, latency = recommended_rows(recommender, queries, 5)
+    print(f"{'exact (float32)':>28}: recall@5 1.000, {latency:7.2f} ms/query, "
+          f"{embeddings.nbytes / 2**20:6.0f} MiB (float64: {embeddings.nbytes / 2**19:.0f} MiB)")
+    
+    for min_recall in (0.9, 0.95, 0.99, 0.999):
+        start = time.perf_counter()
+        recommender = exact_recommender(embeddings, index_type='int8', n_rerank=8, min_recall=min_recall)
+        index = recommender.knn_model
+        build = time.perf_counter() - start
+        found, latency = recommended_rows(recommender, queries, 5)
+        print(f"{f'int8, target {min_recall}':>28}: recall@5 {recall_at_k(exact, found):.3f}, {latency:7.2f} ms/query, "
+              f"{index.codes.nbytes / 2**20:6.0f} MiB, re-ranks {index.n_rerank}, built in {build:.1f}s")
+
+
+def bench_projection(embeddings, queries):
+    """Latency, index memory and top-k overlap with full-dimension results of projected indexes
+    (on anisotropic embeddings: evenly spread variance has no principal components to keep)."""
+    embeddings = synthetic_anisotropic_embeddings(len(embeddings), embeddings.shape[1])
+    queries = synthetic_queries(embeddings, len(queries))
+    recommender = exact_recommender(embeddings)
+    exact, latency = recommended_rows(recommender, queries, K)
+    print(f"{f'exact ({embeddings.shape[1]} dims)':>28}: overlap@{K} 1.000, {latency:7.2f} ms/query, "
+          f"{embeddings.nbytes / 2**20:6.0f} MiB")
+    
+    for projection in ('pca', 'random'):
+        for n_components in (32, 64, 128, 192):
+            start = time.perf_counter()
+            recommender = exact_recommender(embeddings, index_type='projected', projection=projection,
+                                            n_components=n_components)
+            build = time.perf_counter() - start
+            found, latency = recommended_rows(recommender, queries, K)
+            print(f"{f'{projection}, {n_components} dims':>28}: overlap@{K} {recall_at_k(exact, found):.3f}, "
+                  f"{latency:7.2f} ms/query, {recommender.knn_model.vectors.nbytes / 2**20:6.0f} MiB, built in {build:.1f}s")
+
+
+def loop_user_embedding(embedding_map, user_history):
+    """Former per-item implementation of `calculate_user_embedding`, as a baseline."""
+    weighted_sum = np.zeros(len(next(iter(embedding_map.values()))))
+    total_weight = 0
+    for song_id, count in user_history:
+        if song_id in embedding_map:
+            weighted_sum += embedding_map[song_id] * count
+            total_weight += count
+    return weighted_sum / total_weight
+
+
+def bench_profile(embeddings, queries):
+    """User embedding computation time by history length: per-item loop vs vectorized."""
+    recommender = exact_recommender(embeddings)
+    ids = song_ids(len(embeddings))
+    embedding_map = dict(zip(ids, embeddings))
+    rng = np.random.default_rng(2)
+    
+    for history_size in (10, 1_000, 100_000):
+        rows = rng.integers(0, len(embeddings), history_size)
+        history_ids = np.array(ids)[rows]
+        play_counts = rng.integers(1, 20, history_size)
+        history = list(zip(history_ids.tolist(), play_counts.tolist()))
+        repeats = [None] * max(1, 10_000 // history_size)
+        
+        _, loop = timed(lambda _: loop_user_embedding(embedding_map, history), repeats)
+        _, tuples = timed(lambda _: recommender.calculate_user_embedding(history), repeats)
+        _, arrays = timed(lambda _: recommender.calculate_user_embedding(history_ids, play_counts), repeats)
+        print(f"{f'{history_size} songs':>28}: loop {loop:8.3f} ms, vectorized {tuples:8.3f} ms (tuples), "
+              f"{arrays:8.3f} ms (arrays)")
+
+
+def synthetic_descriptions(n_songs, seed=3):
+    """Descriptions shaped like `SongEmbeddingGenerator._create_text_representations` ones."""
+    rng = np.random.default_rng(seed)
+    terms = ['rock', 'pop', 'indie', 'jazz', 'hip hop', 'electronic', 'soul', 'folk', 'metal', 'blues']
+    return [
+        f"Song: Title {i}. Artist: Artist {rng.integers(5000)}. Album: Album {rng.integers(20000)}. "
+        f"Year: {rng.integers(1960, 2011)}. Tempo: {rng.integers(60, 200)} BPM. "
+        f"Tags: {', '.join(rng.choice(terms, 5, replace=False))}."
+        for i in range(n_songs)
+    ]
+
+
+def bench_encoder(embeddings, queries):
+    """
+    Encoding throughput on one CPU core each (the generator runs one encoder process per
+    core) of the hashing encoder, with and without character n-grams, and of the
+    transformer if installed.
+    """
+    descriptions = synthetic_descriptions(50_000)
+    encoders = [
+        ('hashing', HashingEncoder(), descriptions),
+        ('hashing, char_weight=0', HashingEncoder(char_weight=0), descriptions),
+    ]
+    try:
+        import sentence_transformers
+        encoders.append(('sentence-transformer', SentenceTransformerEncoder(TRANSFORMER_MODEL), descriptions[:2_000]))
+    except ImportError:
+        print("sentence-transformers is not installed, only the hashing encoder is measured.")
+
+    throughputs = {}
+    for name, encoder, texts in encoders:
+        encoder.load(threads=1)
+        encoder.encode(texts[:64])  # Warm-up
+        start = time.perf_counter()
+        vectors = encoder.encode(texts)
+        throughputs[name] = len(texts) / (time.perf_counter() - start)
+        print(f"{name:>28}: {throughputs[name]:9.0f} songs/s ({vectors.shape[1]} dimensions)")
+
+    if 'sentence-transformer' in throughputs:
+        for name, throughput in throughputs.items():
+            print(f"{name:>28}: {throughput / throughputs['sentence-transformer']:6.1f}x the transformer")
+
+
+BENCHMARKS = {
+    'ann': bench_ann,
+    'exact': bench_exact,
+    'store': bench_store,
+    'profile': bench_profile,
+    'encoder': bench_encoder,
+    'quant': bench_quant,
+    'projection': bench_projection,
+}
+
+if __name__ == "__main__":
+    embeddings = synthetic_embeddings()
+    queries = synthetic_queries(embeddings)
+    for name in sys.argv[1:] or BENCHMARKS:
+        print(f"=== {name} ({len(embeddings)} songs, dim {embeddings.shape[1]}) ===")
+        BENCHMARKS[name](embeddings, queries)
@@ -1,102 +1,313 @@
 import pandas as pd
 import numpy as np
+import argparse
+import hashlib
+import json
+import multiprocessing
 import os
-import pickle
-from sentence_transformers import SentenceTransformer
+from collections import deque
 from tqdm import tqdm
 
+from embedding_store import EmbeddingStore, write_rows
+from encoders import ENCODERS, SentenceTransformerEncoder
+
 class SongEmbeddingGenerator:
     """
-    Generates embeddings for songs based on their metadata using SentenceTransformer.
+    Generates embeddings for songs based on their metadata, with a `TextEncoder`
+    (SentenceTransformer by default).
+
+    Songs are processed in chunks: their descriptions are built, encoded by a pool of
+    worker processes (each with its own encoder) and written straight into the embedding
+    store, so memory does not grow with the catalog. An interrupted generation resumes
+    from its last completed chunk.
     """
-    def __init__(self, model_name="all-MiniLM-L6-v2", data_path="../data/songs_metadata.pkl", output_path="../data/song_embeddings.pkl"):
+    def __init__(self, model_name="all-MiniLM-L6-v2", data_path="../data/songs_metadata.pkl", output_path="../data/song_embeddings",
+                 chunk_size=10_000, n_workers=None, encoder=None):
         """
         Initialize the generator.
-        
+
         Args:
-            model_name (str): The name of the SentenceTransformer model to use.
+            model_name (str): The name of the SentenceTransformer model to use, without `encoder`.
             data_path (str): Path to the pickle file containing song metadata.
-            output_path (str): Path where the generated embeddings will be saved.
+            output_path (str): Prefix of the `EmbeddingStore` files the embeddings are saved to.
+            chunk_size (int): Number of songs described, encoded and written at once.
+            n_workers (int, optional): Number of encoding processes (one encoder each), all
+                                       CPUs by default. With 1, songs are encoded in this process.
+            encoder (TextEncoder, optional): Encoder of the descriptions, e.g. the fast
+                                             `HashingEncoder`. Its name is part of the text
+                                             hashes, so switching encoders re-encodes everything.
         """
-        self.model_name = model_name
+        self.encoder = encoder or SentenceTransformerEncoder(model_name)
         self.data_path = data_path
         self.output_path = output_path
-        self.model = SentenceTransformer(model_name)
-        
-    def _create_text_representation(self, row):
+        self.chunk_size = chunk_size
+        self.n_workers = n_workers or os.cpu_count()
+
+    def _create_text_representations(self, df):
         """
-        Creates a textual representation of a song from its metadata.
+        Creates textual representations of songs from their metadata, column by column.
         Features used: title, artist_name, release, year, tempo, artist_terms, genre.
+
+        Args:
+            df (pd.DataFrame): Metadata of the songs (Million Song Dataset columns).
+
+        Returns:
+            list: One description per row, e.g. "Song: X. Artist: Y. Year: 1999."
         """
-        parts = []
-        
-        # specific to Million Song Dataset columns
-        title = row.get('title', 'Unknown Title')
-        artist = row.get('artist_name', 'Unknown Artist')
-        parts.append(f"Song: {title}")
-        parts.append(f"Artist: {artist}")
-        
-        album = row.get('release')
-        if pd.notna(album) and album != title:
-            parts.append(f"Album: {album}")
-            
-        year = row.get('year')
-        if pd.notna(year) and year != 0:
-            parts.append(f"Year: {int(year)}")
-            
+        title = _column(df, 'title', 'Unknown Title')
+        artist = _column(df, 'artist_name', 'Unknown Artist')
+        texts = "Song: " + title.map(str) + ". Artist: " + artist.map(str)
+
+        album = _column(df, 'release', None)
+        texts += np.where(album.notna() & (album != title), ". Album: " + album.map(str), "")
+
+        year = pd.to_numeric(_column(df, 'year', None), errors='coerce')
+        texts += np.where(year.notna() & (year != 0), ". Year: " + year.fillna(0).astype(np.int64).astype(str), "")
+
         # Add audio features if available and meaningful
         # MSD often has these
-        tempo = row.get('tempo')
-        if pd.notna(tempo) and tempo > 0:
-            parts.append(f"Tempo: {int(tempo)} BPM")
-            
-        # Add genre context using artist terms (tags)
+        tempo = pd.to_numeric(_column(df, 'tempo', None), errors='coerce')
+        texts += np.where(tempo > 0, ". Tempo: " + tempo.fillna(0).astype(np.int64).astype(str) + " BPM", "")
+
+        # Add genre context using artist terms (tags), the top 5 of them
         # MSD uses 'artist_terms' instead of a single genre field
-        terms = row.get('artist_terms')
-        if isinstance(terms, (list, np.ndarray)) and len(terms) > 0:
-            # Take top 5 terms
-            top_terms = ", ".join(terms[:5])
-            parts.append(f"Tags: {top_terms}")
-        elif pd.notna(row.get('genre')):
-             parts.append(f"Genre: {row.get('genre')}")
-             
+        tags = pd.Series([
+            ", ".join(terms[:5]) if isinstance(terms, (list, np.ndarray)) and len(terms) > 0 else None
+            for terms in _column(df, 'artist_terms', None)
+        ], index=df.index, dtype=object)
+        genre = _column(df, 'genre', None)
+        texts += np.where(tags.notna(), ". Tags: " + tags.map(str),
+                          np.where(genre.notna(), ". Genre: " + genre.map(str), ""))
+
         # Create a sentence
-        return ". ".join(parts) + "."
+        return (texts + ".").tolist()
 
-    def generate(self):
+    def generate(self, incremental=True):
         """
         Loads data, generates embeddings, and saves them.
+
+        Args:
+            incremental (bool): Reuse the vectors of the existing store for songs whose
+                                text is unchanged, and only encode the others. Falls back
+                                to a full generation if there is no store with text hashes.
         """
         if not os.path.exists(self.data_path):
             raise FileNotFoundError(f"Data file not found at {self.data_path}. Please run data_cleaning_script.ipynb first.")
-            
+
         print(f"Loading songs metadata from {self.data_path}...")
         df = pd.read_pickle(self.data_path)
-        
-        print(f"Generating textual descriptions for {len(df)} songs...")
-        descriptions = df.apply(self._create_text_representation, axis=1).tolist()
-        
-        print(f"Encoding descriptions with {self.model_name}...")
-        # Encode in batches to show progress
-        embeddings = self.model.encode(descriptions, show_progress_bar=True, convert_to_numpy=True)
-        
-        # Create a dictionary mapping song_id to embedding
-        # This assumes song_id is unique and present
+
+        # This assumes song_id is present, the last row of a duplicated ID is kept
         if 'song_id' not in df.columns:
             raise ValueError("DataFrame missing required 'song_id' column.")
-            
-        embedding_map = {
-            song_id: emb 
-            for song_id, emb in zip(df['song_id'], embeddings)
-        }
-        
-        print(f"Saving embeddings to {self.output_path}...")
-        os.makedirs(os.path.dirname(self.output_path), exist_ok=True)
-        with open(self.output_path, 'wb') as f:
-            pickle.dump(embedding_map, f)
-            
+        df = df.drop_duplicates('song_id', keep='last')
+        if len(df) == 0:
+            raise ValueError("No songs in the metadata.")
+        song_ids = df['song_id'].to_numpy(dtype=str)
+
+        print(f"Hashing textual descriptions of {len(df)} songs...")
+        text_hashes = np.concatenate([np.empty(0, dtype=np.uint64)] + [
+            self._hash_texts(self._create_text_representations(df.iloc[start:start + self.chunk_size]))
+            for start in tqdm(range(0, len(df), self.chunk_size))
+        ])
+
+        previous = self._load_previous_store() if incremental else None
+        todo = np.arange(len(df))
+        append = False
+        if previous is not None:
+            previous_rows = previous.rows(song_ids)
+            unchanged = previous_rows >= 0
+            unchanged[unchanged] = previous.text_hashes[previous_rows[unchanged]] == text_hashes[unchanged]
+            n_unchanged = np.count_nonzero(unchanged)
+            print(f"{n_unchanged} songs unchanged, {len(df) - n_unchanged} new or changed, "
+                  f"{len(previous) - n_unchanged} changed or removed from the store.")
+
+            # Only new songs: their vectors are appended to the store. Otherwise the store is
+            # rewritten (compacted) without stale rows, copying the vectors of unchanged texts.
+            append = n_unchanged == len(previous)
+            if append:
+                todo = np.flatnonzero(~unchanged)
+                if len(todo) == 0:
+                    print("Embeddings are up to date.")
+                    return
+
+        # Songs sharing a text end up next to each other, and are encoded once per chunk
+        todo = todo[np.lexsort((song_ids[todo], text_hashes[todo]))]
+        if append:
+            vectors_path, start_row = previous.path, len(previous)
+        else:
+            vectors_path, start_row = self.output_path + '_vectors.partial.npy', 0
+
+        fingerprint = hashlib.blake2b(digest_size=16)
+        for part in (self.encoder.name, vectors_path, str(start_row), song_ids[todo].tobytes(), text_hashes[todo].tobytes()):
+            fingerprint.update(part.encode('utf-8') if isinstance(part, str) else part)
+        completed = self._completed_songs(fingerprint.hexdigest(), vectors_path, start_row)
+        if completed:
+            print(f"Resuming after {completed} of {len(todo)} songs.")
+        elif not append and os.path.exists(vectors_path):
+            os.remove(vectors_path)
+
+        reused_rows = np.full(len(todo), -1, dtype=np.int64)
+        if previous is not None:
+            reused_rows = _rows_of_hashes(previous.text_hashes, text_hashes[todo])
+        describe = lambda rows: self._create_text_representations(df.iloc[rows])
+
+        print(f"Embedding {len(todo) - completed} songs into {self.output_path}_*.npy...")
+        chunk_starts = range(completed, len(todo), self.chunk_size)
+        plans = (
+            _ChunkPlan(todo[start:start + self.chunk_size], text_hashes, reused_rows[start:start + self.chunk_size], describe)
+            for start in chunk_starts
+        )
+        with tqdm(total=len(todo), initial=completed) as progress:
+            for plan, encoded in self._encode_chunks(plans):
+                write_rows(vectors_path, plan.vectors(encoded, previous), start_row + completed)
+                completed += len(plan.rows)
+                self._save_progress(fingerprint.hexdigest(), completed)
+                progress.update(len(plan.rows))
+
+        if append:
+            EmbeddingStore.commit(self.output_path, list(previous.song_ids) + song_ids[todo].tolist(),
+                                  np.concatenate([previous.text_hashes, text_hashes[todo]]))
+        else:
+            EmbeddingStore.commit(self.output_path, song_ids[todo], text_hashes[todo], vectors_path=vectors_path)
+        os.remove(self.output_path + '_progress.json')
         print("Done.")
 
+    def _hash_texts(self, descriptions):
+        """64-bit hash of each description, salted with the encoder name (a new encoder re-encodes everything)."""
+        salt = self.encoder.name.encode('utf-8') + b'\0'
+        return np.array([
+            int.from_bytes(hashlib.blake2b(salt + text.encode('utf-8'), digest_size=8).digest(), 'little')
+            for text in descriptions
+        ], dtype=np.uint64)
+
+    def _load_previous_store(self):
+        """The existing store, if it has the text hashes incremental generation needs."""
+        if not EmbeddingStore.exists(self.output_path):
+            return None
+        store = EmbeddingStore.load(self.output_path)
+        if store.text_hashes is None:
+            print("Existing embeddings have no text hashes, regenerating all of them.")
+            return None
+        return store
+
+    def _completed_songs(self, fingerprint, vectors_path, start_row):
+        """Songs already written by an interrupted generation of the same songs, 0 if none."""
+        try:
+            with open(self.output_path + '_progress.json') as f:
+                progress = json.load(f)
+            written_rows = np.load(vectors_path, mmap_mode='r').shape[0]
+        except (OSError, ValueError):
+            return 0
+        if progress.get('fingerprint') != fingerprint or written_rows < start_row + progress['completed']:
+            return 0
+        return progress['completed']
+
+    def _save_progress(self, fingerprint, completed):
+        path = self.output_path + '_progress.json'
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'fingerprint': fingerprint, 'completed': completed}, f)
+        os.replace(path + '.tmp', path)
+
+    def _encode_chunks(self, plans):
+        """
+        Encodes the texts of each chunk plan, yielding (plan, vectors) in order. With
+        workers, at most two chunks per worker are in flight, which bounds memory.
+        """
+        if self.n_workers <= 1:
+            for plan in plans:
+                yield plan, _encode(self.encoder, plan.texts)
+            return
+
+        threads = max(1, os.cpu_count() // self.n_workers)
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(self.n_workers, initializer=_init_worker, initargs=(self.encoder, threads)) as pool:
+            pending = deque()
+            for plan in plans:
+                pending.append((plan, pool.apply_async(_encode_worker_texts, (plan.texts,))))
+                if len(pending) >= 2 * self.n_workers:
+                    plan, result = pending.popleft()
+                    yield plan, result.get()
+            while pending:
+                plan, result = pending.popleft()
+                yield plan, result.get()
+
+
+class _ChunkPlan:
+    """
+    What a chunk of songs needs: vectors of texts already in the previous store are
+    copied, each other distinct text is encoded once.
+    """
+    def __init__(self, rows, text_hashes, reused_rows, describe):
+        """
+        Args:
+            rows (np.array): Metadata rows of the chunk's songs.
+            text_hashes (np.array): Hash of the description of every metadata row.
+            reused_rows (np.array): Row of the previous store with the same text, or -1.
+            describe (callable): Descriptions of metadata rows.
+        """
+        self.rows = rows
+        self.reused_rows = reused_rows
+        self.missing = np.flatnonzero(reused_rows < 0)
+        _, first, self.inverse = np.unique(text_hashes[rows[self.missing]], return_index=True, return_inverse=True)
+        self.texts = describe(rows[self.missing[first]])
+
+    def vectors(self, encoded, previous):
+        """Vectors of the chunk's songs, from the encoded texts and the previous store."""
+        dim = encoded.shape[1] if len(self.texts) else previous.dim
+        vectors = np.empty((len(self.rows), dim), dtype=np.float32)
+        reused = self.reused_rows >= 0
+        if reused.any():
+            vectors[reused] = previous.vectors[self.reused_rows[reused]]
+        if len(self.missing):
+            vectors[self.missing] = encoded[self.inverse.reshape(-1)]
+        return vectors
+
+
+def _column(df, name, default):
+    """A metadata column, or `default` for every row if the column is missing."""
+    if name in df.columns:
+        return df[name]
+    return pd.Series([default] * len(df), index=df.index, dtype=object)
+
+
+def _rows_of_hashes(stored_hashes, text_hashes):
+    """A row of `stored_hashes` holding each of `text_hashes`, -1 for unknown ones."""
+    if len(stored_hashes) == 0:
+        return np.full(len(text_hashes), -1, dtype=np.int64)
+    order = np.argsort(stored_hashes)
+    sorted_hashes = stored_hashes[order]
+    positions = np.searchsorted(sorted_hashes, text_hashes).clip(max=len(order) - 1)
+    return np.where(sorted_hashes[positions] == text_hashes, order[positions], -1)
+
+
+def _encode(encoder, texts):
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+    return encoder.encode(texts)
+
+
+_worker_encoder = None
+
+
+def _init_worker(encoder, threads):
+    """Loads the encoder of an encoding process, limiting its threads to its share of the CPUs."""
+    global _worker_encoder
+    encoder.load(threads)
+    _worker_encoder = encoder
+
+
+def _encode_worker_texts(texts):
+    return _encode(_worker_encoder, texts)
+
+
 if __name__ == "__main__":
-    generator = SongEmbeddingGenerator()
-    generator.generate()
+    parser = argparse.ArgumentParser(description="Generates the song embedding store.")
+    parser.add_argument('--full', action='store_true', help="re-encode every song")
+    parser.add_argument('--encoder', choices=ENCODERS, default='sentence-transformer',
+                        help="'hashing' is much faster and needs no model download")
+    parser.add_argument('--workers', type=int, default=None, help="encoding processes (all CPUs by default)")
+    args = parser.parse_args()
+    
+    generator = SongEmbeddingGenerator(encoder=ENCODERS[args.encoder](), n_workers=args.workers)
+    generator.generate(incremental=not args.full)
@@ -0,0 +1,462 @@
+import io
+import json
+import os
+import pickle
+import re
+import sys
+import numpy as np
+
+# 64-bit FNV-1a, the hash of the song ID index
+FNV_OFFSET = 0xcbf29ce484222325
+FNV_PRIME = 0x100000001b3
+UINT64_MASK = 0xffffffffffffffff
+
+
+class EmbeddingStore:
+    """
+    Song embeddings stored as columns: a float32 matrix (one row per song), the song IDs
+    of the rows (fixed-width bytes) and an open-addressing hash table from song ID to row.
+
+    The three arrays are `.npy` files sharing a prefix (`<prefix>_vectors.<generation>.npy`,
+    `<prefix>_song_ids.<generation>.npy`, `<prefix>_index.<generation>.npy`), listed by
+    `<prefix>_manifest.json` with the number of songs and the dimension. They are
+    memory-mapped on load, so nothing is copied and processes serving the same store
+    share its pages. An optional text hashes file holds the hash of the text each vector
+    was encoded from, for incremental generation.
+
+    Each save writes a new generation of the files, then replaces the manifest, so an
+    interrupted save leaves the previous store whole. An append writes its rows into
+    the current vectors file, past the ones of the store, and a new generation of the
+    other files: rows beyond the manifest's number of songs are ignored on load, so an
+    interrupted append leaves the previous store readable. Stores saved before
+    manifests (`<prefix>_vectors.npy`, ...) are still loaded.
+    """
+    def __init__(self, vectors, song_ids, table, path=None, text_hashes=None):
+        """
+        Args:
+            vectors (np.array): Matrix (n_songs, dim) of float32 embeddings.
+            song_ids (np.array): Song ID (bytes) of each row.
+            table (np.array): Hash table of rows (-1 for empty slots), its size is a power of 2.
+            path (str, optional): File the vectors were read from, for staleness checks.
+            text_hashes (np.array, optional): uint64 hash of the encoded text of each row.
+        """
+        self.vectors = vectors
+        self.song_ids = song_ids
+        self.table = table
+        self.path = path
+        self.text_hashes = text_hashes
+
+    @classmethod
+    def from_arrays(cls, song_ids, vectors, text_hashes=None):
+        """
+        Builds a store in memory.
+
+        Args:
+            song_ids (list): Song IDs (str), unique.
+            vectors (np.array): Matrix (n_songs, dim) of embeddings, in the order of `song_ids`.
+            text_hashes (np.array, optional): Hash of the encoded text of each song.
+
+        Returns:
+            EmbeddingStore: The store, with its hash index built.
+        """
+        song_ids = _encode_ids(song_ids)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if len(np.unique(song_ids)) != len(song_ids):
+            raise ValueError("Song IDs of an embedding store must be unique.")
+        if text_hashes is not None:
+            text_hashes = np.asarray(text_hashes, dtype=np.uint64)
+        return cls(vectors, song_ids, _build_table(song_ids), text_hashes=text_hashes)
+
+    @classmethod
+    def from_embedding_map(cls, embedding_map):
+        """Builds a store from a legacy `{song_id: embedding}` dict."""
+        song_ids = list(embedding_map.keys())
+        return cls.from_arrays(song_ids, np.array([embedding_map[sid] for sid in song_ids]))
+
+    @staticmethod
+    def exists(prefix):
+        return os.path.exists(_manifest_path(prefix)) or all(os.path.exists(path) for path in _legacy_paths(prefix))
+
+    def save(self, prefix):
+        """
+        Writes the store as a new generation of `.npy` files named after `prefix`.
+
+        Processes still mapping the previous store keep reading it (and this store may
+        itself be mapped from the files it replaces).
+        """
+        directory = os.path.dirname(prefix)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        generation = os.urandom(8).hex()
+        files = {'vectors': _generation_path(prefix, 'vectors', generation)}
+        _save_atomic(files['vectors'], self.vectors)
+        files.update(_save_columns(prefix, generation, self.song_ids, self.table, self.text_hashes))
+        _swap_manifest(prefix, files, len(self), self.dim)
+
+    def append(self, prefix, song_ids, vectors, text_hashes=None):
+        """
+        Adds songs to the store saved at `prefix` (this store, loaded from it), writing
+        only the new vectors: they are appended to the vectors file, whose header is
+        rewritten in place. The small ID, index and text hash files are rewritten.
+
+        Args:
+            prefix (str): Prefix the store was loaded from.
+            song_ids (list): IDs (str) of the new songs, not already in the store.
+            vectors (np.array): Matrix (n_new_songs, dim) of their embeddings.
+            text_hashes (np.array, optional): Hash of their encoded texts, required if
+                                              and only if the store has text hashes.
+
+        Returns:
+            EmbeddingStore: The grown store, memory-mapped.
+        """
+        new_ids = _encode_ids(song_ids)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(len(new_ids), self.dim)
+        if (self.rows(new_ids) >= 0).any() or len(np.unique(new_ids)) != len(new_ids):
+            raise ValueError("Appended song IDs must be new and unique.")
+        if (text_hashes is None) != (self.text_hashes is None):
+            raise ValueError("Text hashes must be appended if and only if the store has text hashes.")
+
+        write_rows(_read_manifest(prefix)[0]['vectors'], vectors, len(self))
+        if self.text_hashes is not None:
+            text_hashes = np.concatenate([self.text_hashes, np.asarray(text_hashes, dtype=np.uint64)])
+        return EmbeddingStore.commit(prefix, np.concatenate([self.song_ids, new_ids]), text_hashes)
+
+    @classmethod
+    def commit(cls, prefix, song_ids, text_hashes=None, vectors_path=None):
+        """
+        Completes a store whose vectors were written with `write_rows`: writes a new
+        generation of its ID, index and text hash files, then the manifest.
+
+        Args:
+            prefix (str): Prefix of the store.
+            song_ids (list or np.array): Song ID of each row of the vectors.
+            text_hashes (np.array, optional): Hash of the encoded text of each row.
+            vectors_path (str, optional): Vectors written to another file than the ones of
+                                          the saved store (appended to otherwise).
+
+        Returns:
+            EmbeddingStore: The store, memory-mapped.
+        """
+        song_ids = _encode_ids(song_ids)
+        if text_hashes is not None:
+            text_hashes = np.asarray(text_hashes, dtype=np.uint64)
+        generation = os.urandom(8).hex()
+        if vectors_path is None:
+            files = {'vectors': _read_manifest(prefix)[0]['vectors']}
+        else:
+            files = {'vectors': _generation_path(prefix, 'vectors', generation)}
+            os.replace(vectors_path, files['vectors'])
+        vectors = np.load(files['vectors'], mmap_mode='r')
+        if vectors.ndim != 2 or len(vectors) < len(song_ids):
+            raise ValueError(f"{files['vectors']} has fewer rows than the committed songs.")
+        files.update(_save_columns(prefix, generation, song_ids, _build_table(song_ids), text_hashes))
+        _swap_manifest(prefix, files, len(song_ids), vectors.shape[1])
+        return cls.load(prefix)
+
+    @classmethod
+    def load(cls, prefix):
+        """
+        Memory-maps a saved store.
+
+        Args:
+            prefix (str): Prefix the store was saved with.
+
+        Returns:
+            EmbeddingStore: The store, backed by read-only memory maps.
+
+        Raises:
+            ValueError: If the files don't match each other or the manifest.
+        """
+        files, manifest = _read_manifest(prefix)
+        store = cls(
+            np.load(files['vectors'], mmap_mode='r'),
+            np.load(files['song_ids'], mmap_mode='r'),
+            np.load(files['index'], mmap_mode='r'),
+            path=files['vectors']
+        )
+        n_songs = manifest.get('n_songs', len(store.song_ids))
+        if (store.vectors.ndim != 2 or len(store.song_ids) != n_songs or len(store.vectors) < n_songs
+                or store.dim != manifest.get('dim', store.dim)
+                or len(store.table) != _table_size(n_songs)):
+            raise ValueError(f"Embedding store {prefix} is inconsistent, regenerate it.")
+        # Rows of an unfinished append are ignored
+        store.vectors = store.vectors[:n_songs]
+        if 'text_hashes' in files and os.path.exists(files['text_hashes']):
+            text_hashes = np.load(files['text_hashes'], mmap_mode='r')
+            if len(text_hashes) == n_songs:
+                store.text_hashes = text_hashes
+            elif manifest:
+                raise ValueError(f"Embedding store {prefix} is inconsistent, regenerate it.")
+        return store
+
+    def __len__(self):
+        return len(self.song_ids)
+
+    def __contains__(self, song_id):
+        return self.row(song_id) >= 0
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1]
+
+    def row(self, song_id):
+        """Row of a song, -1 if it has no embedding."""
+        key = song_id.encode('utf-8')
+        if len(key) > self.song_ids.dtype.itemsize:
+            return -1
+
+        mask = len(self.table) - 1
+        slot = _hash(key.ljust(self.song_ids.dtype.itemsize, b'\0')) & mask
+        while True:
+            row = int(self.table[slot])
+            if row < 0 or self.song_ids[row] == key:
+                return row
+            slot = (slot + 1) & mask
+
+    def rows(self, song_ids):
+        """
+        Rows of several songs at once.
+
+        Args:
+            song_ids (list or np.array): Song IDs (str or bytes), str and bytes arrays
+                                         are encoded without a Python loop.
+
+        Returns:
+            np.array: Row of each song, -1 for songs without an embedding.
+        """
+        if isinstance(song_ids, np.ndarray) and song_ids.dtype.kind == 'S':
+            keys = song_ids
+        elif isinstance(song_ids, np.ndarray) and song_ids.dtype.kind == 'U':
+            try:
+                # MSD IDs are ASCII, which numpy casts much faster than it encodes
+                keys = song_ids.astype(bytes)
+            except UnicodeEncodeError:
+                keys = np.char.encode(song_ids, 'utf-8')
+        else:
+            keys = np.array([sid.encode('utf-8') if isinstance(sid, str) else sid for sid in song_ids], dtype=bytes)
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        if len(keys) == 0:
+            return rows
+
+        # Longer IDs cannot be stored, the others are padded like the stored ones
+        width = self.song_ids.dtype.itemsize
+        if keys.dtype.itemsize > width:
+            fits = np.char.str_len(keys) <= width
+        else:
+            fits = np.ones(len(keys), dtype=bool)
+        if keys.dtype.itemsize != width:
+            keys = keys.astype(f'S{width}')
+
+        mask = len(self.table) - 1
+        pending = np.flatnonzero(fits)
+        slots = _hash_array(keys[pending]) & mask
+        while len(pending):
+            candidates = self.table[slots]
+            found = candidates >= 0
+            found[found] = self.song_ids[candidates[found]] == keys[pending][found]
+            rows[pending[found]] = candidates[found]
+
+            # Stop at empty slots (unknown songs) and matches, probe the next slot otherwise
+            probing = candidates >= 0
+            probing[found] = False
+            pending = pending[probing]
+            slots = (slots[probing] + 1) & mask
+
+        return rows
+
+    def song_id(self, row):
+        return self.song_ids[row].decode('utf-8')
+
+
+def _manifest_path(prefix):
+    return prefix + '_manifest.json'
+
+
+def _legacy_paths(prefix):
+    """Files of stores saved before manifests."""
+    return prefix + '_vectors.npy', prefix + '_song_ids.npy', prefix + '_index.npy'
+
+
+def _generation_path(prefix, name, generation):
+    return f"{prefix}_{name}.{generation}.npy"
+
+
+def _read_manifest(prefix):
+    """
+    Files of a saved store and its manifest.
+
+    Returns:
+        tuple: ({name: path} of the 'vectors', 'song_ids', 'index' and optional
+               'text_hashes' files, manifest dict, empty for stores saved before manifests)
+    """
+    try:
+        with open(_manifest_path(prefix)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        vectors_path, song_ids_path, index_path = _legacy_paths(prefix)
+        return {
+            'vectors': vectors_path, 'song_ids': song_ids_path, 'index': index_path,
+            'text_hashes': prefix + '_text_hashes.npy',
+        }, {}
+    # File names are relative to the directory of the store, which can be moved
+    directory = os.path.dirname(prefix)
+    return {name: os.path.join(directory, file) for name, file in manifest['files'].items()}, manifest
+
+
+def _save_columns(prefix, generation, song_ids, table, text_hashes):
+    """Writes the ID, index and text hash files of a generation, returns their paths."""
+    files = {
+        'song_ids': _generation_path(prefix, 'song_ids', generation),
+        'index': _generation_path(prefix, 'index', generation),
+    }
+    if text_hashes is not None:
+        files['text_hashes'] = _generation_path(prefix, 'text_hashes', generation)
+    for name, array in (('song_ids', song_ids), ('index', table), ('text_hashes', text_hashes)):
+        if name in files:
+            _save_atomic(files[name], array)
+    return files
+
+
+def _swap_manifest(prefix, files, n_songs, dim):
+    """
+    Replaces the manifest of a store (the commit point of a save), then removes the
+    files of the other generations (previous, or left by interrupted saves) and the
+    files of stores saved before manifests, that the new one doesn't use.
+    """
+    manifest = {
+        'files': {name: os.path.basename(path) for name, path in files.items()},
+        'n_songs': int(n_songs),
+        'dim': int(dim),
+    }
+    with open(_manifest_path(prefix) + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(_manifest_path(prefix) + '.tmp', _manifest_path(prefix))
+
+    directory, base = os.path.split(prefix)
+    generation_file = re.compile(re.escape(base) + r'_(vectors|song_ids|index|text_hashes)\.[0-9a-f]{16}\.npy')
+    stale = {os.path.join(directory, file) for file in os.listdir(directory or '.') if generation_file.fullmatch(file)}
+    stale |= {*_legacy_paths(prefix), prefix + '_text_hashes.npy'}
+    for path in stale - set(files.values()):
+        try:
+            os.remove(path)
+        except OSError:
+            # Missing, or still mapped where that prevents removal (Windows)
+            pass
+
+
+def _encode_ids(song_ids):
+    return np.array([sid.encode('utf-8') if isinstance(sid, str) else sid for sid in song_ids], dtype=bytes)
+
+
+def _save_atomic(path, array):
+    """`np.save` to a temporary file renamed over `path`."""
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, array)
+    os.replace(path + '.tmp', path)
+
+
+def write_rows(path, rows, start):
+    """
+    Writes rows into a saved 2D `.npy` matrix from row `start` on, which becomes its
+    last written row: the shape in its header is updated in place, and later rows are
+    discarded. The file is created if `start` is 0 and it does not exist.
+
+    Args:
+        path (str): Path of the `.npy` file.
+        rows (np.array): Matrix (n_rows, dim) of the rows to write.
+        start (int): Row of the matrix the first row is written at.
+    """
+    if start == 0 and not os.path.exists(path):
+        with open(path, 'wb') as f:
+            np.save(f, rows)
+        return
+
+    with open(path, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        read_header, write_header = {
+            (1, 0): (np.lib.format.read_array_header_1_0, np.lib.format.write_array_header_1_0),
+            (2, 0): (np.lib.format.read_array_header_2_0, np.lib.format.write_array_header_2_0),
+        }[version]
+        shape, fortran_order, dtype = read_header(f)
+        data_offset = f.tell()
+        if shape[0] < start or shape[1:] != rows.shape[1:] or fortran_order or dtype != rows.dtype:
+            raise ValueError(f"{path} does not match the written rows.")
+
+        header = io.BytesIO()
+        write_header(header, {
+            'descr': np.lib.format.dtype_to_descr(dtype),
+            'fortran_order': False,
+            'shape': (start + len(rows),) + shape[1:],
+        })
+        if len(header.getvalue()) == data_offset:
+            # Rows first, so that an interrupted write leaves the former shape
+            row_size = dtype.itemsize * int(np.prod(shape[1:]))
+            f.seek(data_offset + start * row_size)
+            f.write(rows.tobytes())
+            f.truncate()
+            f.seek(0)
+            f.write(header.getvalue())
+            return
+
+    # The header cannot grow in place (shapes past numpy's growth padding)
+    previous = np.load(path, mmap_mode='r')[:start]
+    _save_atomic(path, np.concatenate([previous, rows]))
+
+
+def _hash(key):
+    """FNV-1a of a padded key (bytes), as computed by `_hash_array`."""
+    h = FNV_OFFSET
+    for byte in key:
+        h = ((h ^ byte) * FNV_PRIME) & UINT64_MASK
+    return h
+
+
+def _hash_array(keys):
+    """FNV-1a of each fixed-width key of a bytes array, one pass per byte column."""
+    columns = keys.view(np.uint8).reshape(len(keys), keys.dtype.itemsize)
+    hashes = np.full(len(keys), FNV_OFFSET, dtype=np.uint64)
+    for column in columns.T:
+        hashes ^= column
+        hashes *= np.uint64(FNV_PRIME)
+    return hashes.astype(np.int64)
+
+
+def _table_size(n_songs):
+    """Smallest power of 2 of at least twice `n_songs` slots (and at least 2)."""
+    return 1 << max(1, int(2 * n_songs - 1).bit_length())
+
+
+def _build_table(song_ids):
+    """
+    Open-addressing hash table (linear probing) of the rows of `song_ids`, with a load
+    factor of at most 1/2. Songs are inserted in rounds: each round, the first song
+    aiming at each empty slot takes it, the others move on to the next slot.
+    """
+    size = _table_size(len(song_ids))
+    mask = size - 1
+    table = np.full(size, -1, dtype=np.int64 if len(song_ids) >= 2**31 else np.int32)
+
+    pending = np.arange(len(song_ids))
+    slots = _hash_array(song_ids) & mask
+    while len(pending):
+        free = table[slots] < 0
+        taken_slots, first = np.unique(slots[free], return_index=True)
+        table[taken_slots] = pending[free][first]
+
+        placed = np.zeros(len(pending), dtype=bool)
+        placed[np.flatnonzero(free)[first]] = True
+        pending = pending[~placed]
+        slots = (slots[~placed] + 1) & mask
+
+    return table
+
+
+if __name__ == "__main__":
+    # Converts a legacy pickled {song_id: embedding} dict: python embedding_store.py in.pkl out_prefix
+    pickle_path, prefix = sys.argv[1:3]
+    with open(pickle_path, 'rb') as f:
+        store = EmbeddingStore.from_embedding_map(pickle.load(f))
+    store.save(prefix)
+    print(f"Saved {len(store)} embeddings to {prefix}_*.npy")
@@ -0,0 +1,102 @@
+import re
+from abc import ABC, abstractmethod
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+# Field labels of the song descriptions, shared by every song
+DESCRIPTION_LABELS = re.compile(r'\b(?:Song|Artist|Album|Year|Tempo|Tags|Genre):|\bBPM\b')
+
+
+class TextEncoder(ABC):
+    """
+    Encodes song descriptions into fixed-size vectors for `SongEmbeddingGenerator`.
+
+    Encoders are pickled to the generator's worker processes, where `load` is called
+    once before encoding: heavy state (models) should be created there, not in `__init__`.
+    """
+    # Identifies the encoder and its settings: stored vectors are re-encoded when it changes
+    name = None
+
+    def load(self, threads=None):
+        """Prepares the encoder in the process that will use it, with at most `threads` threads."""
+
+    @abstractmethod
+    def encode(self, texts):
+        """
+        Args:
+            texts (list): Song descriptions.
+
+        Returns:
+            np.array: Matrix (len(texts), dim) of float32 embeddings.
+        """
+
+
+class SentenceTransformerEncoder(TextEncoder):
+    """Transformer sentence embeddings (384 dimensions for the default all-MiniLM-L6-v2)."""
+    def __init__(self, model_name="all-MiniLM-L6-v2"):
+        self.model_name = model_name
+        self.name = model_name
+        self.model = None
+
+    def load(self, threads=None):
+        if self.model is not None:
+            return
+        # Imported here, as torch is slow to import and only needed by this encoder
+        from sentence_transformers import SentenceTransformer
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        self.model = SentenceTransformer(self.model_name)
+
+    def encode(self, texts):
+        self.load()
+        return self.model.encode(texts, convert_to_numpy=True).astype(np.float32)
+
+    def __getstate__(self):
+        # Worker processes load their own model
+        return {**self.__dict__, 'model': None}
+
+
+class HashingEncoder(TextEncoder):
+    """
+    Fast encoder without a model: word (1-2) and character (3-5) n-grams of the description
+    values are hashed with random signs into `dim` buckets, a sparse random projection
+    of their sublinear TF counts, then L2-normalized.
+
+    It is stateless (no vocabulary or IDF to fit), so a text always gets the same vector,
+    which incremental generation relies on.
+    """
+    def __init__(self, dim=384, char_weight=0.5):
+        """
+        Args:
+            dim (int): Size of the embeddings.
+            char_weight (float): Weight of character n-grams relative to word n-grams, 0
+                                 skips them (about 4x faster, no fuzzy matching of names).
+        """
+        self.dim = dim
+        self.char_weight = char_weight
+        self.name = f"hashing-ngrams-{dim}-{char_weight}"
+        vectorizer = dict(n_features=dim, alternate_sign=True, norm=None, lowercase=False,
+                          preprocessor=_strip_labels, dtype=np.float32)
+        self.words = HashingVectorizer(analyzer='word', ngram_range=(1, 2), token_pattern=r'(?u)\b\w+\b', **vectorizer)
+        self.chars = HashingVectorizer(analyzer='char_wb', ngram_range=(3, 5), **vectorizer)
+
+    def encode(self, texts):
+        counts = sparse.csr_matrix(self.words.transform(texts))
+        if self.char_weight:
+            counts = counts + self.char_weight * self.chars.transform(texts)
+        # Sublinear TF, keeping the random sign of each bucket
+        counts.data = np.sign(counts.data) * np.log1p(np.abs(counts.data))
+        return normalize(counts).toarray().astype(np.float32)
+
+
+ENCODERS = {
+    'sentence-transformer': SentenceTransformerEncoder,
+    'hashing': HashingEncoder,
+}
+
+
+def _strip_labels(text):
+    return DESCRIPTION_LABELS.sub(' ', text).lower()
@@ -0,0 +1,149 @@
+import os
+import numpy as np
+
+from ann_index import normalize
+
+# Songs projected at once when building the index
+PROJECTION_BLOCK_SIZE = 65536
+# Scores matrices are kept under this many floats per chunk of queries
+MAX_SCORES_PER_CHUNK = 16_000_000
+
+PROJECTIONS = ('pca', 'random')
+
+
+class ProjectedIndex:
+    """
+    Nearest neighbors index for cosine similarity over embeddings projected to fewer
+    dimensions.
+
+    Normalized embeddings are projected to `n_components` dimensions, either on their
+    principal components ('pca', which keeps most of the information of text
+    embeddings in a fraction of their dimensions) or on a Gaussian random projection
+    ('random', no fitting, preserves dot products in expectation). Queries are
+    projected the same way and scored against every song by a dot product in the
+    reduced space, which approximates their cosine similarity.
+    """
+    def __init__(self, n_components=128, projection='pca', random_state=0):
+        """
+        Initialize an empty index.
+
+        Args:
+            n_components (int): Target number of dimensions.
+            projection (str): 'pca' or 'random'.
+            random_state (int): Seed of the random projection.
+        """
+        if projection not in PROJECTIONS:
+            raise ValueError(f"Unknown projection {projection!r}, expected one of {PROJECTIONS}")
+        self.n_components = n_components
+        self.projection = projection
+        self.random_state = random_state
+
+        # Matrix (dim, n_components) applied to normalized vectors
+        self.components = None
+        # Projected normalized embeddings, float32 (n_songs, n_components)
+        self.vectors = None
+
+    def fit(self, embeddings):
+        """
+        Fits the projection and projects the rows of an embedding matrix.
+
+        Args:
+            embeddings (np.array): Matrix (n_songs, dim) of embeddings (can be memory-mapped).
+
+        Returns:
+            ProjectedIndex: The index itself.
+        """
+        n_songs, dim = embeddings.shape
+        n_components = min(self.n_components, dim)
+
+        if self.projection == 'pca':
+            # Principal axes of the uncentered vectors, which preserve their dot products
+            # best, from their second moment matrix accumulated by blocks
+            moments = np.zeros((dim, dim))
+            for start in range(0, n_songs, PROJECTION_BLOCK_SIZE):
+                block = normalize(np.asarray(embeddings[start:start + PROJECTION_BLOCK_SIZE], dtype=np.float32))
+                moments += block.T @ block
+            _, eigenvectors = np.linalg.eigh(moments)
+            self.components = np.ascontiguousarray(eigenvectors[:, ::-1][:, :n_components], dtype=np.float32)
+        else:
+            rng = np.random.default_rng(self.random_state)
+            self.components = (rng.normal(size=(dim, n_components)) / np.sqrt(n_components)).astype(np.float32)
+
+        self.vectors = np.empty((n_songs, n_components), dtype=np.float32)
+        for start in range(0, n_songs, PROJECTION_BLOCK_SIZE):
+            block = normalize(np.asarray(embeddings[start:start + PROJECTION_BLOCK_SIZE], dtype=np.float32))
+            self.vectors[start:start + len(block)] = block @ self.components
+        return self
+
+    def transform(self, queries):
+        """Projects query vectors (normalized first) to the reduced space."""
+        return normalize(np.atleast_2d(np.asarray(queries, dtype=np.float32))) @ self.components
+
+    def kneighbors(self, queries, n_neighbors=5, excluded=None):
+        """
+        Nearest neighbors in the reduced space, with the same output as sklearn's
+        `NearestNeighbors(metric='cosine').kneighbors`.
+
+        Args:
+            queries (np.array): Matrix (n_queries, dim) of query vectors, in the
+                                original space.
+            n_neighbors (int): Number of neighbors per query.
+            excluded (list, optional): One array of rows never returned per query.
+
+        Returns:
+            tuple: (distances, indices), both of shape (n_queries, n_neighbors), with
+                   approximate cosine distances and rows of the indexed matrix, nearest
+                   first. Rows are padded with inf distances and -1 indices when
+                   exclusions leave fewer songs.
+        """
+        queries = self.transform(queries)
+        n_songs = len(self.vectors)
+
+        distances = np.full((len(queries), n_neighbors), np.inf)
+        indices = np.full((len(queries), n_neighbors), -1, dtype=np.int64)
+        k = min(n_neighbors, n_songs)
+        if k == 0:
+            return distances, indices
+
+        chunk_size = max(1, MAX_SCORES_PER_CHUNK // n_songs)
+        for start in range(0, len(queries), chunk_size):
+            scores = queries[start:start + chunk_size] @ self.vectors.T
+            if excluded is not None:
+                for row, songs in enumerate(excluded[start:start + chunk_size]):
+                    scores[row, songs] = -np.inf
+
+            best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(scores, best, axis=1)
+            order = np.argsort(-best_scores, axis=1)
+            best = np.take_along_axis(best, order, axis=1)
+            best_scores = np.take_along_axis(best_scores, order, axis=1)
+
+            found = np.isfinite(best_scores)
+            distances[start:start + len(scores), :k] = np.where(found, 1.0 - best_scores, np.inf)
+            indices[start:start + len(scores), :k] = np.where(found, best, -1)
+
+        return distances, indices
+
+    def save(self, path):
+        """Saves the projection and the projected embeddings to a .npz file."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez(
+            path,
+            components=self.components,
+            vectors=self.vectors,
+            projection=np.array(self.projection),
+            params=np.array([self.n_components, self.random_state]),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Loads an index saved by `save`."""
+        with np.load(path) as data:
+            n_components, random_state = data['params'].tolist()
+            index = cls(n_components, str(data['projection']), random_state)
+            index.components = data['components']
+            index.vectors = data['vectors']
+        return index
+
+    def __len__(self):
+        return 0 if self.vectors is None else len(self.vectors)
@@ -0,0 +1,236 @@
+import os
+import numpy as np
+
+from ann_index import normalize
+
+# Songs whose codes are converted to float32 at once when scoring, small enough for the
+# converted block to stay in cache for the product (then as fast as a float32 product)
+SCORING_BLOCK_SIZE = 1024
+# Approximate scores are kept under this many floats per chunk of queries
+MAX_SCORES_PER_CHUNK = 16_000_000
+
+
+class Int8Index:
+    """
+    Nearest neighbors index for cosine similarity over int8 scalar-quantized embeddings.
+
+    Normalized embeddings are quantized per dimension to 256 levels between the
+    minimum and maximum of that dimension, so the index holds 1 byte per value
+    (4x less than float32, 8x less than float64). A query scores every song from
+    the codes, then re-ranks its `n_rerank` best candidates with the exact
+    similarities of the full-precision embeddings (typically memory-mapped, of
+    which only these rows are read).
+
+    `n_rerank` is raised when the index is built until the recall@k measured on
+    sample queries reaches `min_recall`.
+    """
+    def __init__(self, n_rerank=256, min_recall=0.99, max_rerank=4096, n_calibration_queries=200,
+                 calibration_k=5, random_state=0):
+        """
+        Initialize an empty index.
+
+        Args:
+            n_rerank (int): Minimum number of candidates re-ranked per query.
+            min_recall (float): Recall@`calibration_k` against exact search that the
+                                re-ranking depth must reach, 0 skips the calibration.
+            max_rerank (int): Upper bound of the calibrated re-ranking depth.
+            n_calibration_queries (int): Number of sample queries of the calibration.
+            calibration_k (int): Number of neighbors the recall is measured on.
+            random_state (int): Seed of the sample queries.
+        """
+        self.n_rerank = n_rerank
+        self.min_recall = min_recall
+        self.max_rerank = max_rerank
+        self.n_calibration_queries = n_calibration_queries
+        self.calibration_k = calibration_k
+        self.random_state = random_state
+
+        # Full-precision embeddings, used for re-ranking only
+        self.embeddings = None
+        # Normalized embeddings ~ offset + scale * (codes + 128)
+        self.codes = None
+        self.offset = None
+        self.scale = None
+        # Recall measured by the calibration (None if skipped)
+        self.recall = None
+
+    def fit(self, embeddings):
+        """
+        Quantizes the rows of an embedding matrix and calibrates the re-ranking depth.
+
+        Args:
+            embeddings (np.array): Matrix (n_songs, dim) of embeddings, kept by
+                                   reference for re-ranking (it can be memory-mapped).
+
+        Returns:
+            Int8Index: The index itself.
+        """
+        self.embeddings = embeddings
+        n_songs, dim = embeddings.shape
+
+        # Ranges of the normalized vectors, by blocks to avoid a normalized copy
+        low = np.full(dim, np.inf, dtype=np.float32)
+        high = np.full(dim, -np.inf, dtype=np.float32)
+        for start in range(0, n_songs, SCORING_BLOCK_SIZE):
+            block = normalize(np.asarray(embeddings[start:start + SCORING_BLOCK_SIZE], dtype=np.float32))
+            low = np.minimum(low, block.min(axis=0))
+            high = np.maximum(high, block.max(axis=0))
+        if n_songs == 0:
+            low[:], high[:] = 0, 0
+        self.offset = low
+        self.scale = (np.where(high > low, high - low, 1) / 255).astype(np.float32)
+
+        self.codes = np.empty((n_songs, dim), dtype=np.int8)
+        for start in range(0, n_songs, SCORING_BLOCK_SIZE):
+            block = normalize(np.asarray(embeddings[start:start + SCORING_BLOCK_SIZE], dtype=np.float32))
+            levels = np.rint((block - self.offset) / self.scale)
+            self.codes[start:start + len(block)] = np.clip(levels, 0, 255) - 128
+
+        if self.min_recall and n_songs:
+            self.calibrate()
+        return self
+
+    def calibrate(self):
+        """
+        Doubles `n_rerank` until the recall@`calibration_k` of sample queries reaches
+        `min_recall` (or `max_rerank` is reached).
+
+        Sample queries are means of small random sets of songs, like user embeddings.
+
+        Returns:
+            float: The recall measured with the final `n_rerank`.
+        """
+        rng = np.random.default_rng(self.random_state)
+        n_songs = len(self.codes)
+        queries = np.array([
+            self.embeddings[np.sort(rng.choice(n_songs, min(n_songs, rng.integers(1, 17)), replace=False))].mean(axis=0)
+            for _ in range(self.n_calibration_queries)
+        ], dtype=np.float32)
+        k = min(self.calibration_k, n_songs)
+        _, exact = self._exact_neighbors(queries, k)
+
+        while True:
+            _, indices = self.kneighbors(queries, k)
+            self.recall = np.mean([
+                len(np.intersect1d(found, expected)) / k for found, expected in zip(indices, exact)
+            ])
+            if self.recall >= self.min_recall or self.n_rerank >= min(self.max_rerank, n_songs):
+                break
+            self.n_rerank = min(self.n_rerank * 2, self.max_rerank)
+
+        if self.recall < self.min_recall:
+            print(f"Warning: int8 index recall@{k} is {self.recall:.3f} with {self.n_rerank} "
+                  f"re-ranked candidates, below the {self.min_recall} target.")
+        return self.recall
+
+    def kneighbors(self, queries, n_neighbors=5, excluded=None):
+        """
+        Nearest neighbors, with the same output as sklearn's
+        `NearestNeighbors(metric='cosine').kneighbors`.
+
+        Args:
+            queries (np.array): Matrix (n_queries, dim) of query vectors.
+            n_neighbors (int): Number of neighbors per query.
+            excluded (list, optional): One array of rows never returned per query.
+
+        Returns:
+            tuple: (distances, indices), both of shape (n_queries, n_neighbors), with
+                   cosine distances and rows of the indexed matrix, nearest first.
+                   Rows are padded with inf distances and -1 indices when exclusions
+                   leave fewer songs.
+        """
+        queries = normalize(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        n_songs = len(self.codes)
+
+        distances = np.full((len(queries), n_neighbors), np.inf)
+        indices = np.full((len(queries), n_neighbors), -1, dtype=np.int64)
+        n_candidates = min(max(self.n_rerank, n_neighbors), n_songs)
+        if n_candidates == 0:
+            return distances, indices
+
+        chunk_size = max(1, MAX_SCORES_PER_CHUNK // n_songs)
+        for start in range(0, len(queries), chunk_size):
+            chunk_excluded = None if excluded is None else excluded[start:start + chunk_size]
+            candidates = self._candidates(queries[start:start + chunk_size], n_candidates, chunk_excluded)
+            for i, query_candidates in enumerate(candidates, start):
+                # Exact re-ranking, reading the candidates' rows in file order
+                query_candidates = np.sort(query_candidates[query_candidates >= 0])
+                vectors = normalize(np.asarray(self.embeddings[query_candidates], dtype=np.float32))
+                similarities = vectors @ queries[i]
+
+                k = min(n_neighbors, len(query_candidates))
+                best = np.argpartition(-similarities, k - 1)[:k] if k > 0 else np.empty(0, dtype=np.int64)
+                best = best[np.argsort(-similarities[best])]
+                distances[i, :k] = 1.0 - similarities[best]
+                indices[i, :k] = query_candidates[best]
+
+        return distances, indices
+
+    def _candidates(self, queries, n_candidates, excluded):
+        """Rows of the `n_candidates` best approximate scores of each normalized query,
+        -1 for excluded songs."""
+        # q . (offset + scale * (codes + 128)) = q . offset + 128 * sum(q * scale) + (q * scale) . codes
+        scaled_queries = queries * self.scale
+        constants = queries @ self.offset + 128 * scaled_queries.sum(axis=1)
+        scores = np.empty((len(queries), len(self.codes)), dtype=np.float32)
+        block = np.empty((SCORING_BLOCK_SIZE, self.codes.shape[1]), dtype=np.float32)
+        for start in range(0, len(self.codes), SCORING_BLOCK_SIZE):
+            codes = self.codes[start:start + SCORING_BLOCK_SIZE]
+            np.copyto(block[:len(codes)], codes)
+            scores[:, start:start + len(codes)] = scaled_queries @ block[:len(codes)].T
+        scores += constants[:, None]
+        if excluded is not None:
+            for row, songs in enumerate(excluded):
+                scores[row, songs] = -np.inf
+
+        candidates = np.argpartition(-scores, n_candidates - 1, axis=1)[:, :n_candidates]
+        return np.where(np.isfinite(np.take_along_axis(scores, candidates, axis=1)), candidates, -1)
+
+    def _exact_neighbors(self, queries, n_neighbors):
+        """Exact cosine neighbors over the full-precision embeddings (calibration reference)."""
+        queries = normalize(queries)
+        n_songs = len(self.embeddings)
+        scores = np.empty((len(queries), n_songs), dtype=np.float32)
+        for start in range(0, n_songs, SCORING_BLOCK_SIZE):
+            block = normalize(np.asarray(self.embeddings[start:start + SCORING_BLOCK_SIZE], dtype=np.float32))
+            scores[:, start:start + len(block)] = queries @ block.T
+        best = np.argpartition(-scores, n_neighbors - 1, axis=1)[:, :n_neighbors]
+        return 1.0 - np.take_along_axis(scores, best, axis=1), best
+
+    def save(self, path):
+        """Saves the codes and parameters to a .npz file (not the full-precision embeddings)."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez(
+            path,
+            codes=self.codes,
+            offset=self.offset,
+            scale=self.scale,
+            recall=np.array(np.nan if self.recall is None else self.recall),
+            params=np.array([self.n_rerank, self.max_rerank, self.n_calibration_queries,
+                             self.calibration_k, self.random_state]),
+            min_recall=np.array(self.min_recall),
+        )
+
+    @classmethod
+    def load(cls, path, embeddings):
+        """
+        Loads an index saved by `save`.
+
+        Args:
+            path (str): Path of the .npz file.
+            embeddings (np.array): The full-precision embeddings the index was built on.
+        """
+        with np.load(path) as data:
+            n_rerank, max_rerank, n_calibration_queries, calibration_k, random_state = data['params'].tolist()
+            index = cls(n_rerank, float(data['min_recall']), max_rerank, n_calibration_queries,
+                        calibration_k, random_state)
+            index.codes = data['codes']
+            index.offset = data['offset']
+            index.scale = data['scale']
+            recall = float(data['recall'])
+            index.recall = None if np.isnan(recall) else recall
+        index.embeddings = embeddings
+        return index
+
+    def __len__(self):
+        return 0 if self.codes is None else len(self.codes)
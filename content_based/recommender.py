@@ -1,28 +1,62 @@
 import pickle
 import numpy as np
 import pandas as pd
-from sklearn.neighbors import NearestNeighbors
 import os
 
+from ann_index import IVFIndex, normalize
+from embedding_store import EmbeddingStore
+from projected_index import ProjectedIndex
+from quantized_index import Int8Index
+
+# Scores matrices of the exact search are kept under this many floats per chunk of queries
+MAX_SCORES_PER_CHUNK = 16_000_000
+# User embeddings are computed over the whole matrix for histories longer than 1/ratio of the catalog
+DENSE_HISTORY_RATIO = 8
+
 class ContentBasedRecommender:
     """
     Recommends songs based on content similarity.
     """
-    def __init__(self, embeddings_path="../data/song_embeddings.pkl", metadata_path="../data/songs_metadata.pkl"):
+    def __init__(self, embeddings_path="../data/song_embeddings", metadata_path="../data/songs_metadata.pkl",
+                 index_type="brute", index_path=None, n_lists=256, n_probe=8, n_rerank=256, min_recall=0.99,
+                 projection='pca', n_components=128):
         """
         Initialize the recommender.
         
         Args:
-            embeddings_path (str): Path to the song embeddings pickle.
+            embeddings_path (str): Prefix of the song `EmbeddingStore` (memory-mapped),
+                                   or path to a legacy pickle of embeddings.
             metadata_path (str): Path to the song metadata pickle.
+            index_type (str): 'brute' for exact search, 'ivf' for approximate search
+                              with an `IVFIndex`, 'int8' for search over int8-quantized
+                              embeddings with exact re-ranking (`Int8Index`), 'projected'
+                              for search over embeddings reduced to `n_components`
+                              dimensions (`ProjectedIndex`).
+            index_path (str, optional): Where the IVF, int8 or projected index is persisted.
+                                        It is loaded if up to date, built and saved otherwise.
+            n_lists (int): Number of IVF lists, used when building the index.
+            n_probe (int): Number of IVF lists scanned per query (recall/latency knob).
+            n_rerank (int): Minimum number of int8 candidates re-ranked per query.
+            min_recall (float): Recall@5 against exact search the int8 index is
+                                calibrated to reach, by re-ranking more candidates.
+            projection (str): 'pca' or 'random', projection of the projected index.
+            n_components (int): Number of dimensions of the projected index.
         """
         self.embeddings_path = embeddings_path
         self.metadata_path = metadata_path
+        self.index_type = index_type
+        self.index_path = index_path
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_rerank = n_rerank
+        self.min_recall = min_recall
+        self.projection = projection
+        self.n_components = n_components
         
-        self.embedding_map = None
+        self.store = None
         self.metadata_df = None
-        self.song_ids = None
         self.embedding_matrix = None
+        self.inverse_norms = None
         self.knn_model = None
         
         self._load_data()
@@ -30,12 +64,16 @@ class ContentBasedRecommender:
 
     def _load_data(self):
         """Loads embeddings and metadata."""
-        if not os.path.exists(self.embeddings_path):
-            raise FileNotFoundError(f"Embeddings file not found at {self.embeddings_path}. Run embedding_generator.py first.")
-        
-        print(f"Loading embeddings from {self.embeddings_path}...")
-        with open(self.embeddings_path, 'rb') as f:
-            self.embedding_map = pickle.load(f)
+        if EmbeddingStore.exists(self.embeddings_path):
+            print(f"Memory-mapping embeddings from {self.embeddings_path}_*.npy...")
+            self.store = EmbeddingStore.load(self.embeddings_path)
+        elif self.embeddings_path.endswith('.pkl') and os.path.exists(self.embeddings_path):
+            print(f"Loading legacy embeddings pickle from {self.embeddings_path}...")
+            with open(self.embeddings_path, 'rb') as f:
+                self.store = EmbeddingStore.from_embedding_map(pickle.load(f))
+            self.store.path = self.embeddings_path
+        else:
+            raise FileNotFoundError(f"Embeddings not found at {self.embeddings_path}. Run embedding_generator.py first.")
             
         if os.path.exists(self.metadata_path):
             print(f"Loading metadata from {self.metadata_path}...")
@@ -47,73 +85,253 @@ class ContentBasedRecommender:
             self.song_details = {}
 
     def _build_index(self):
-        """Prepares the KNN index for fast retrieval."""
-        # Convert map to matrix for sklearn
-        self.song_ids = list(self.embedding_map.keys())
-        self.embedding_matrix = np.array([self.embedding_map[sid] for sid in self.song_ids])
+        """Prepares the inverse norms of the embeddings (exact search), or the IVF, int8 or projected index."""
+        self.embedding_matrix = self.store.vectors
+        
+        if self.index_type == 'ivf':
+            self.knn_model = self._load_or_build_ivf_index()
+            return
+        if self.index_type == 'int8':
+            self.knn_model = self._load_or_build_int8_index()
+            return
+        if self.index_type == 'projected':
+            self.knn_model = self._load_or_build_projected_index()
+            return
+        
+        # Cosine similarities of all songs are then a single product with the normalized
+        # query, scaled by these norms, without a normalized copy of the matrix
+        print(f"Computing embedding norms for exact search over {len(self.store)} songs...")
+        norms = np.sqrt(np.einsum('ij,ij->i', self.embedding_matrix, self.embedding_matrix))
+        self.inverse_norms = (1 / np.where(norms > 0, norms, 1)).astype(np.float32)
+
+    def _is_index_up_to_date(self):
+        """Whether the index file was written after the embeddings."""
+        return bool(
+            self.index_path
+            and os.path.exists(self.index_path)
+            and os.path.getmtime(self.index_path) >= os.path.getmtime(self.store.path)
+        )
+
+    def _load_or_build_ivf_index(self):
+        """Loads the persisted IVF index, or builds (and persists) it if missing or stale."""
+        if self._is_index_up_to_date():
+            print(f"Loading IVF index from {self.index_path}...")
+            index = IVFIndex.load(self.index_path, n_probe=self.n_probe)
+            if len(index) == len(self.store):
+                return index
+            print("IVF index does not match the embeddings, rebuilding it.")
+        
+        print(f"Building IVF index ({self.n_lists} lists) for {len(self.store)} songs...")
+        index = IVFIndex(n_lists=self.n_lists, n_probe=self.n_probe).fit(self.embedding_matrix)
+        if self.index_path:
+            index.save(self.index_path)
+        return index
+
+    def _load_or_build_int8_index(self):
+        """Loads the persisted int8 index, or builds (and persists) it if missing, stale or
+        calibrated for other settings."""
+        if self._is_index_up_to_date():
+            print(f"Loading int8 index from {self.index_path}...")
+            index = Int8Index.load(self.index_path, self.embedding_matrix)
+            if len(index) == len(self.store) and index.min_recall == self.min_recall and index.n_rerank >= self.n_rerank:
+                return index
+            print("Int8 index does not match the embeddings or settings, rebuilding it.")
+        
+        print(f"Quantizing {len(self.store)} embeddings to int8 (recall@5 target {self.min_recall})...")
+        index = Int8Index(n_rerank=self.n_rerank, min_recall=self.min_recall).fit(self.embedding_matrix)
+        if index.recall is not None:
+            print(f"Int8 index re-ranks {index.n_rerank} candidates per query, recall@5 {index.recall:.3f}.")
+        if self.index_path:
+            index.save(self.index_path)
+        return index
+
+    def _load_or_build_projected_index(self):
+        """Loads the persisted projected index, or builds (and persists) it if missing, stale
+        or built with another projection."""
+        if self._is_index_up_to_date():
+            print(f"Loading projected index from {self.index_path}...")
+            index = ProjectedIndex.load(self.index_path)
+            is_matching = (
+                len(index) == len(self.store)
+                and index.projection == self.projection
+                and index.vectors.shape[1] == min(self.n_components, self.store.dim)
+            )
+            if is_matching:
+                return index
+            print("Projected index does not match the embeddings or settings, rebuilding it.")
         
-        print(f"Building NearestNeighbors index for {len(self.song_ids)} songs...")
-        self.knn_model = NearestNeighbors(n_neighbors=5, metric='cosine', algorithm='brute')
-        self.knn_model.fit(self.embedding_matrix)
+        print(f"Projecting {len(self.store)} embeddings to {self.n_components} dimensions ({self.projection})...")
+        index = ProjectedIndex(n_components=self.n_components, projection=self.projection).fit(self.embedding_matrix)
+        if self.index_path:
+            index.save(self.index_path)
+        return index
 
-    def calculate_user_embedding(self, user_history):
+    def calculate_user_embedding(self, user_history, play_counts=None):
         """
         Calculates a user's embedding vector based on their listening history.
         
         Args:
-            user_history (list): A list of dictionaries or tuples containing song_id and play_count.
+            user_history (list or np.array): A list of dictionaries or tuples containing song_id and play_count.
                                  Format: [{'song_id': '...', 'play_count': 5}, ...] 
                                  or list of (song_id, count).
+                                 With `play_counts`, an array of song IDs.
+            play_counts (np.array, optional): Play count of each song of `user_history`,
+                                              e.g. columns fetched from the database.
         
         Returns:
-            np.array: The weighted mean embedding for the user.
+            np.array: The weighted mean embedding (float32) for the user.
         """
-        if not user_history:
+        if user_history is None or len(user_history) == 0:
             return None
-            
-        weighted_sum = np.zeros(self.embedding_matrix.shape[1])
-        total_weight = 0
-        
-        for item in user_history:
-            if isinstance(item, dict):
-                song_id = item.get('song_id')
-                count = item.get('play_count', 1)
-            else:
-                song_id, count = item
-                
-            if song_id in self.embedding_map:
-                embedding = self.embedding_map[song_id]
-                weighted_sum += embedding * count
-                total_weight += count
+        
+        if play_counts is None:
+            song_ids, play_counts = _history_columns(user_history)
+        else:
+            song_ids = user_history
+        
+        rows = self.store.rows(song_ids)
+        known = rows >= 0
+        weights = np.asarray(play_counts, dtype=np.float64)[known]
+        total_weight = weights.sum()
         
         if total_weight == 0:
             return None
-            
-        return weighted_sum / total_weight
+        
+        weights = (weights / total_weight).astype(np.float32)
+        if len(weights) * DENSE_HISTORY_RATIO < len(self.embedding_matrix):
+            # One gather of the history's rows, one weighted reduction
+            return weights @ self.embedding_matrix[rows[known]]
+        
+        # Histories covering much of the catalog: the gather would copy most of the
+        # matrix, a product with dense per-song weights reads it in place instead
+        dense_weights = np.bincount(rows[known], weights=weights, minlength=len(self.embedding_matrix))
+        return dense_weights.astype(np.float32) @ self.embedding_matrix
 
-    def recommend(self, user_embedding, n_recommendations=5):
+    def recommend(self, user_embedding, n_recommendations=5, exclude_song_ids=None):
         """
         Finds the nearest songs to the user's embedding.
         
         Args:
             user_embedding (np.array): The user's accumulated vector.
             n_recommendations (int): Number of songs to recommend.
+            exclude_song_ids (iterable, optional): Songs never recommended, typically
+                                                   the ones the user already listened to.
             
         Returns:
             list: List of recommended songs with metadata.
         """
         if user_embedding is None:
             return []
+        
+        return self.recommend_batch([user_embedding], n_recommendations, [exclude_song_ids])[0]
+
+    def recommend_batch(self, user_embeddings, n_recommendations=5, exclude_song_ids=None):
+        """
+        Finds the nearest songs to the embeddings of several users at once.
+        
+        Args:
+            user_embeddings (list or np.array): One vector per user, None for users
+                                                without an embedding.
+            n_recommendations (int): Number of songs to recommend per user.
+            exclude_song_ids (list, optional): One iterable of excluded song IDs per
+                                               user (or None), as in `recommend`.
             
-        # Reshape for sklearn (1, n_features)
-        query = user_embedding.reshape(1, -1)
+        Returns:
+            list: One list of recommended songs with metadata per user, as returned
+                  by `recommend`.
+        """
+        if exclude_song_ids is None:
+            exclude_song_ids = [None] * len(user_embeddings)
+        
+        users = [i for i, embedding in enumerate(user_embeddings) if embedding is not None]
+        recommendations = [[] for _ in user_embeddings]
+        if not users:
+            return recommendations
+        
+        queries = np.array([user_embeddings[i] for i in users], dtype=np.float32).reshape(len(users), -1)
+        excluded = [self._excluded_indexes(exclude_song_ids[i]) for i in users]
+        
+        search = {
+            'ivf': self._search_ivf,
+            'int8': self._search_index,
+            'projected': self._search_index,
+        }.get(self.index_type, self._search_exact)
+        distances, indices = search(queries, n_recommendations, excluded)
+        
+        for user, user_distances, user_indices in zip(users, distances, indices):
+            recommendations[user] = self._format_recommendations(user_distances, user_indices)
+        return recommendations
+
+    def _excluded_indexes(self, song_ids):
+        """Rows of the embedding matrix of the given song IDs, unknown songs are ignored."""
+        if song_ids is None:
+            return np.empty(0, dtype=np.int64)
+        rows = self.store.rows(song_ids if isinstance(song_ids, np.ndarray) else list(song_ids))
+        return rows[rows >= 0]
+
+    def _search_exact(self, queries, n_neighbors, excluded):
+        """
+        Exact top-k cosine search: one matrix product per chunk of queries, excluded
+        songs masked out before the `argpartition`.
         
-        distances, indices = self.knn_model.kneighbors(query, n_neighbors=n_recommendations)
+        Returns:
+            tuple: (distances, indices) of shape (n_queries, k), nearest first, with
+                   k = min(n_neighbors, n_songs). Rows are padded with inf distances
+                   and -1 indices when exclusions leave fewer than k songs.
+        """
+        n_songs = len(self.embedding_matrix)
+        k = min(n_neighbors, n_songs)
+        distances = np.full((len(queries), k), np.inf)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        if k == 0:
+            return distances, indices
         
+        queries = normalize(queries)
+        chunk_size = max(1, MAX_SCORES_PER_CHUNK // n_songs)
+        for start in range(0, len(queries), chunk_size):
+            scores = queries[start:start + chunk_size] @ self.embedding_matrix.T
+            scores *= self.inverse_norms
+            for row, songs in enumerate(excluded[start:start + chunk_size]):
+                scores[row, songs] = -np.inf
+            
+            best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(scores, best, axis=1)
+            order = np.argsort(-best_scores, axis=1)
+            best = np.take_along_axis(best, order, axis=1)
+            best_scores = np.take_along_axis(best_scores, order, axis=1)
+            
+            found = np.isfinite(best_scores)
+            distances[start:start + len(scores)] = np.where(found, 1.0 - best_scores, np.inf)
+            indices[start:start + len(scores)] = np.where(found, best, -1)
+        
+        return distances, indices
+
+    def _search_ivf(self, queries, n_neighbors, excluded):
+        """Approximate search with the IVF index, over-fetching to make up for exclusions."""
+        distances = np.full((len(queries), n_neighbors), np.inf)
+        indices = np.full((len(queries), n_neighbors), -1, dtype=np.int64)
+        
+        for i, (query, songs) in enumerate(zip(queries, excluded)):
+            query_distances, query_indices = self.knn_model.kneighbors(query, n_neighbors + len(songs))
+            kept = ~np.isin(query_indices[0], songs) & (query_indices[0] >= 0)
+            kept_indices = query_indices[0][kept][:n_neighbors]
+            distances[i, :len(kept_indices)] = query_distances[0][kept][:n_neighbors]
+            indices[i, :len(kept_indices)] = kept_indices
+        
+        return distances, indices
+
+    def _search_index(self, queries, n_neighbors, excluded):
+        """Search with an index masking out exclusions itself (int8 or projected)."""
+        return self.knn_model.kneighbors(queries, n_neighbors, excluded)
+
+    def _format_recommendations(self, distances, indices):
+        """Builds the recommendation dicts of one user from its search results."""
         recommendations = []
-        for i, idx in enumerate(indices[0]):
-            song_id = self.song_ids[idx]
-            dist = distances[0][i]
+        for dist, idx in zip(distances, indices):
+            if idx < 0:
+                # Fewer candidates than requested (exclusions, approximate index)
+                continue
+            song_id = self.store.song_id(idx)
             
             details = self.song_details.get(song_id, {'title': 'Unknown', 'artist_name': 'Unknown'})
             
@@ -126,3 +344,16 @@ class ContentBasedRecommender:
             recommendations.append(rec)
             
         return recommendations
+
+
+def _history_columns(user_history):
+    """Splits a history of dicts and/or (song_id, count) tuples into song IDs and play counts."""
+    song_ids, play_counts = [], []
+    for item in user_history:
+        if isinstance(item, dict):
+            song_id, play_count = item.get('song_id'), item.get('play_count', 1)
+        else:
+            song_id, play_count = item
+        song_ids.append(song_id or '')
+        play_counts.append(play_count)
+    return song_ids, play_counts